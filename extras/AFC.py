@@ -3,10 +3,11 @@
 # Copyright (C) 2024 Armored Turtle
 #
 
-import json
 import re
+import time
 import traceback
 from configfile import error
+from contextlib import nullcontext
 from typing import Any
 
 
@@ -21,7 +22,7 @@ except: raise error(ERROR_STR.format(import_lib="AFC_logger", trace=traceback.fo
 try: from extras.AFC_functions import afcDeltaTime
 except: raise error(ERROR_STR.format(import_lib="AFC_functions", trace=traceback.format_exc()))
 
-try: from extras.AFC_utils import add_filament_switch, AFC_moonraker
+try: from extras.AFC_utils import add_filament_switch, AFC_moonraker, AFCVarWriter
 except: raise error(ERROR_STR.format(import_lib="AFC_utils", trace=traceback.format_exc()))
 
 try: from extras.AFC_stats import AFCStats
@@ -44,12 +45,21 @@ def load_config(config):
     return afc(config)
 
 class afc:
+    PRESTAGE_DELAY = 5.0
+    PRESTAGE_SCAN_CHUNK = 16384     # Bytes of print file scanned each time prestage timer runs
+    PRESTAGE_SCAN_INTERVAL = 0.1    # Seconds between scanning chunks of the print file
+    STATUS_PUSH_INTERVAL = 0.25
+    TD1_CHECK_INTERVAL = 30.0
     def __init__(self, config):
         self.config  = config
         self.printer = config.get_printer()
         self.reactor = self.printer.get_reactor()
         self.webhooks = self.printer.lookup_object('webhooks')
         self.printer.register_event_handler("klippy:connect",self.handle_connect)
+        self.printer.register_event_handler("klippy:disconnect",self.flush_vars)
+        self.printer.register_event_handler("klippy:disconnect",self._handle_moonraker_disconnect)
+        self.printer.register_event_handler("idle_timeout:ready",self._handle_moonraker_idle)
+        self.printer.register_event_handler("idle_timeout:idle",self._handle_moonraker_idle)
         self.logger  = AFC_logger(self.printer, self)
 
         self.spool      = self.printer.load_object(config, 'AFC_spool')
@@ -64,6 +74,10 @@ class afc:
         self.printer.register_event_handler("virtual_sdcard:reset_file", self._reset_file_callback)
         # Registering webhooks endpoint for <ip_address>/printer/afc/status
         self.webhooks.register_endpoint("afc/status", self._webhooks_status)
+        # Registering webhooks endpoint for <ip_address>/printer/afc/timeline
+        self.webhooks.register_endpoint("afc/timeline", self._webhooks_timeline)
+        # Registering webhooks endpoint for <ip_address>/printer/afc/subscribe
+        self.webhooks.register_endpoint("afc/subscribe", self._webhooks_subscribe)
 
         self.current            = None
         self.current_loading    = None
@@ -73,11 +87,29 @@ class afc:
         self.position_saved     = False
         self.spoolman           = None
         self.moonraker          = None
+        self.afc_stats          = None
         self.td1_defined        = False
         self._td1_present       = False
+        self.td1_check_timer    = self.reactor.register_timer(self._td1_check_timer_callback)
         self.lane_data_enabled  = False
         self.prep_done          = False         # Variable used to hold of save_vars function from saving too early and overriding save before prep can be ran
         self.in_print_timer     = None
+        self.prestage_timer     = self.reactor.register_timer(self._prestage_timer_callback)
+        self.prestage_scan_start = None         # File position scan for next toolchange started at, None when no scan is running
+        self.prestage_scan_pos   = None         # File position scan for next toolchange continues from
+        self.save_vars_timer    = self.reactor.register_timer(self._save_vars_timer_callback)
+        self.vars_dirty         = False         # Set when save_vars has been called and variables have not been written to file yet
+        self.status_cache       = {}            # Cached get_status response
+        self.status_key         = None          # Values used to build status_cache, used to check if response needs to be rebuilt
+        # Increased every time afc/status snapshot changes, starts from boot time in ms so versions clients got
+        # before a restart never match a version after it
+        self.webhooks_status_version = int(time.time() * 1000)
+        self.webhooks_status_parts   = None     # Values used to detect changes in afc/status snapshot
+        self.webhooks_status_cache   = None     # Cached afc/status snapshot for current version
+        self.status_subscribers      = {}       # Clients subscribed to afc/subscribe, keyed by client connection
+        self.status_push_snapshot    = None     # Last afc/status snapshot pushed to subscribed clients
+        self.status_push_version     = 0
+        self.status_push_timer       = self.reactor.register_timer(self._status_push_callback)
 
         # Objects for everything configured for AFC
         self.units      = {}
@@ -115,9 +147,15 @@ class afc:
         self.moonraker_port         = config.get("moonraker_port", 7125)             # Port to connect to when interacting with moonraker. Used when there are multiple moonraker/klipper instances on a single host
         self.moonraker_host         = config.get("moonraker_host", "http://localhost")
         self.moonraker_connect_to   = config.get("moonraker_timeout", 30)
+        self.moonraker_request_timeout = config.getfloat("moonraker_request_timeout", 10., minval=1.) # Seconds to wait for moonraker to answer a request before giving up
         self.unit_order_list        = config.get('unit_order_list','')
         self.VarFile                = config.get('VarFile','../printer_data/config/AFC/AFC.var')# Path to the variables file for AFC configuration.
         self.cfgloc                 = self._remove_after_last(self.VarFile,"/")
+        self.save_vars_delay        = config.getfloat("save_vars_delay", 0.5, minval=0.) # Time in seconds to collect changes before variables are written to file, multiple saves within this time are written once
+        self.var_writer             = AFCVarWriter(self.reactor, self.logger, self.VarFile + '.unit')
+        self.stats_flush_delay      = config.getfloat("stats_flush_delay", 30., minval=0.) # Time in seconds to collect afc_stats changes before they are written to moonraker, stats are also written after each toolchange and when printer goes idle
+        self.spoolman_cache_ttl     = config.getfloat("spoolman_cache_ttl", 300., minval=0.) # Time in seconds spoolman spool data is reused before being fetched again, spools used by lanes are refreshed in the background
+        self.spoolman_usage_interval= config.getfloat("spoolman_usage_interval", 0., minval=0.) # Time in seconds filament usage tracked by AFC is collected before it is reported to spoolman for each spool. Also reported at each toolchange and when printer goes idle, 0 disables reporting
         self.default_material_temps = config.getlists("default_material_temps",
                                                       ("default: 235", "PLA:210", "PETG:235", "ABS:235", "ASA:235"))# Default temperature to set extruder when loading/unloading lanes. Material needs to be either manually set or uses material from spoolman if extruder temp is not set in spoolman.
         self.default_material_temps = list(self.default_material_temps) if self.default_material_temps is not None else None
@@ -174,10 +212,24 @@ class afc:
         self.long_moves_accel       = config.getfloat("long_moves_accel", 400)      # Acceleration in mm/s squared when doing long moves
         self.short_moves_speed      = config.getfloat("short_moves_speed", 25)      # Speed in mm/s to move filament when doing short moves
         self.short_moves_accel      = config.getfloat("short_moves_accel", 400)     # Acceleration in mm/s squared when doing short moves
+        self.long_moves_start_dist  = config.getfloat("long_moves_start_dist", 0, minval=0.)  # Distance in mm at the start of a bowden move that is moved at long_moves_start_speed to pull slack from the spool, 0 disables
+        self.long_moves_start_speed = config.getfloat("long_moves_start_speed", self.short_moves_speed) # Speed in mm/s for the first long_moves_start_dist of a bowden move
+        self.long_moves_slow_dist   = config.getfloat("long_moves_slow_dist", 0, minval=0.)   # Distance in mm at the end of a bowden move that is moved at long_moves_slow_speed before the toolhead sensor, 0 disables
+        self.long_moves_slow_speed  = config.getfloat("long_moves_slow_speed", self.short_moves_speed)  # Speed in mm/s for the last long_moves_slow_dist of a bowden move
         self.short_move_dis         = config.getfloat("short_move_dis", 10)         # Move distance in mm for failsafe moves.
         self.tool_homing_distance   = config.getfloat("tool_homing_distance", 200)  # Distance over which toolhead homing is to be attempted.
         self.max_move_dis           = config.getfloat("max_move_dis", 999999)       # Maximum distance to move filament. AFC breaks filament moves over this number into multiple moves. Useful to lower this number if running into timer too close errors when doing long filament moves.
         self.n20_break_delay_time   = config.getfloat("n20_break_delay_time", 0.200)# Time to wait between breaking n20 motors(nSleep/FWD/RWD all 1) and then releasing the break to allow coasting.
+        self.heat_during_transport  = config.getboolean("heat_during_transport", False) # Set to True to heat extruder while filament is moved through hub and bowden during TOOL_LOAD/TOOL_UNLOAD, AFC only waits for temperature right before filament reaches the extruder gears
+        self.prestage_lanes         = config.getboolean("prestage_lanes", False)    # Set to True to advance the next lane in a print towards its hub while printing, so the next toolchange only moves the remaining prestage_offset distance
+        self.prestage_offset        = config.getfloat("prestage_offset", 20, minval=0.)       # Distance in mm short of dist_hub that a pre-staged lane is stopped at
+        self.prestage_scan_length   = config.getint("prestage_scan_length", 262144, minval=0) # Max number of bytes to scan ahead in the print file when looking for the next toolchange
+        self.learn_bowden_length    = config.getboolean("learn_bowden_length", False) # Set to True to record per lane and hub the distance where toolhead sensor triggers, later loads move at long move speed up to this distance minus learned_bowden_margin and then slowly approach toolhead sensor
+        self.learned_bowden_margin  = config.getfloat("learned_bowden_margin", 30, minval=0.) # Distance in mm short of learned bowden length where fast move stops and slow approach to toolhead sensor starts
+        self.timeline_size          = config.getint("timeline_size", 2000, minval=1)  # Number of toolchange phase spans to keep in memory for AFC_TIMELINE and printer/afc/timeline
+        self.parallel_toolchange    = config.getboolean("parallel_toolchange", False) # Set to True to start feeding the next lane while the current lane unloads when lanes share no hub, buffer or drive. Bowden is also fed when lanes use different extruders
+        self.background_load        = config.getboolean("background_load", False)   # Set to True to feed the next lane in a print through its hub and bowden while printing when it goes to an idle extruder
+        self.background_preheat     = config.getboolean("background_preheat", False) # Set to True to also heat the idle extruder to the lanes temperature when background loading
 
         self.tool_max_unload_attempts= config.getint('tool_max_unload_attempts', 4) # Max number of attempts to unload filament from toolhead when using buffer as ramming sensor
         self.tool_max_load_checks   = config.getint('tool_max_load_checks', 4)      # Max number of attempts to check to make sure filament is loaded into toolhead extruder when using buffer as ramming sensor
@@ -247,6 +299,16 @@ class afc:
                                         self.cmd_AFC_TOGGLE_MACRO_help, self.cmd_AFC_TOGGLE_MACRO_options)
         self.function.register_commands(self.show_macros, 'UNSET_LANE_LOADED', self.cmd_UNSET_LANE_LOADED,
                                         self.cmd_UNSET_LANE_LOADED_help)
+        self.function.register_commands(self.show_macros, 'AFC_TIMELINE', self.cmd_AFC_TIMELINE,
+                                        self.cmd_AFC_TIMELINE_help, self.cmd_AFC_TIMELINE_options)
+        self.function.register_commands(self.show_macros, 'AFC_MOVE_CHUNKS', self.cmd_AFC_MOVE_CHUNKS,
+                                        self.cmd_AFC_MOVE_CHUNKS_help)
+        self.function.register_commands(self.show_macros, 'LANE_UNLOAD_BATCH', self.cmd_LANE_UNLOAD_BATCH,
+                                        self.cmd_LANE_UNLOAD_BATCH_help, self.cmd_LANE_UNLOAD_BATCH_options)
+        self.function.register_commands(self.show_macros, 'AFC_CURRENT_CHANGES', self.cmd_AFC_CURRENT_CHANGES,
+                                        self.cmd_AFC_CURRENT_CHANGES_help)
+        self.function.register_commands(self.show_macros, 'AFC_MOONRAKER_LATENCY', self.cmd_AFC_MOONRAKER_LATENCY,
+                                        self.cmd_AFC_MOONRAKER_LATENCY_help)
 
     def _remove_after_last(self, string, char):
         last_index = string.rfind(char)
@@ -298,22 +360,72 @@ class afc:
         """
 
         try:
-            self.moonraker = AFC_moonraker( self.moonraker_host, self.moonraker_port, self.logger )
-            if not self.moonraker.wait_for_moonraker( toolhead=self.toolhead, timeout=self.moonraker_connect_to ):
+            self.moonraker = AFC_moonraker( self.moonraker_host, self.moonraker_port, self.logger, self.reactor,
+                                            self.moonraker_request_timeout, self.VarFile + '.stats',
+                                            self.stats_flush_delay, self.spoolman_cache_ttl, self.VarFile + '.spools',
+                                            self.VarFile + '.spool_use', self.spoolman_usage_interval )
+            # When spoolman data was saved from a previous boot PREP does not wait for moonraker, lanes start
+            # from saved data and moonraker is connected in the background
+            snapshot = self.moonraker.spoolman_server is not None and self.moonraker.spool_snapshot
+            timeout = 1 if snapshot else self.moonraker_connect_to
+            if not self.moonraker.wait_for_moonraker( toolhead=self.toolhead, timeout=timeout ):
+                if snapshot:
+                    self.logger.info("Using saved spoolman data until moonraker is reachable")
+                    self.spoolman = self.moonraker.spoolman_server
+                    self.moonraker_connect_end = self.reactor.monotonic() + int(self.moonraker_connect_to)
+                    self.reactor.register_timer(self._moonraker_connect_timer, self.reactor.monotonic() + 1)
                 return False
 
-            # Remove current lane_data from database before pushing data back up so that
-            # stale lane data is not in database
-            self.moonraker.delete_lane_data()
-            self.spoolman = self.moonraker.get_spoolman_server()
-            self.td1_defined, self._td1_present, self.lane_data_enabled = self.moonraker.check_for_td1()
-            self.afc_stats = AFCStats(self.moonraker, self.logger, self.tool_cut_threshold)
-
-            self.printer.send_event("afc:moonraker_connect")
+            self._moonraker_connected()
         except Exception as e:
             self.logger.debug("Moonraker/Spoolman/afc_stats/td1 error\nError: {}\n{}".format(e, traceback.format_exc()))
             self.spoolman = None                      # set to none if not found
 
+    def _moonraker_connected(self):
+        """
+        Queries moonraker for spoolman/td1 setup and loads afc_stats once moonraker is reachable
+        """
+        # Remove current lane_data from database before pushing data back up so that
+        # stale lane data is not in database
+        self.moonraker.delete_lane_data()
+        self.spoolman = self.moonraker.get_spoolman_server()
+        if self.spoolman is not None:
+            self.moonraker.replay_spool_use_journal()
+        self.td1_defined, self._td1_present, self.lane_data_enabled = self.moonraker.check_for_td1()
+        if self.td1_defined:
+            self.reactor.update_timer(self.td1_check_timer, self.reactor.monotonic() + self.TD1_CHECK_INTERVAL)
+        afc_stats = AFCStats(self.moonraker, self.logger, self.tool_cut_threshold)
+
+        self.printer.send_event("afc:moonraker_connect")
+        # Only set once lane stats are created as well, stats are skipped while this is None
+        self.afc_stats = afc_stats
+
+    def _moonraker_connect_timer(self, eventtime):
+        """
+        Timer callback that keeps trying to reach moonraker after PREP started from saved spoolman data,
+        lanes are reconciled with spoolman once moonraker responds
+        """
+        if self.moonraker.check_connection():
+            self.logger.info("Connected to moonraker, checking saved spoolman data")
+            try:
+                self._moonraker_connected()
+                # Lane data PREP already pushed was just deleted from moonraker, push it again
+                for lane in self.lanes.values():
+                    lane.send_lane_data()
+                # PREP skipped cut threshold check since stats were not loaded yet
+                self.afc_stats.check_cut_threshold()
+                if self.spoolman is not None:
+                    self.spool.reconcile_spools()
+            except Exception as e:
+                self.logger.debug("Moonraker/Spoolman/afc_stats/td1 error\nError: {}\n{}".format(e, traceback.format_exc()))
+            return self.reactor.NEVER
+
+        if eventtime > self.moonraker_connect_end:
+            self.logger.warning(f"Failed to connect to moonraker after {self.moonraker_connect_to} seconds, "
+                                "lanes keep using saved spoolman data")
+            return self.reactor.NEVER
+        return eventtime + 1
+
     def handle_connect(self):
         """
         Handle the connection event.
@@ -364,6 +476,15 @@ class afc:
 
         return present
 
+    def _td1_check_timer_callback(self, eventtime):
+        """
+        Timer callback that refreshes whether a TD-1 is connected, so status responses can report it without
+        querying moonraker every time they are built
+        """
+        # Property updates _td1_present when printer is not printing
+        self.td1_present
+        return self.reactor.monotonic() + self.TD1_CHECK_INTERVAL
+
     def _reset_file_callback(self):
         """
         Set timer to check back to see if printer is printing. This is needed as file and print status is set after
@@ -394,9 +515,282 @@ class afc:
             self.number_of_toolchanges  = self.moonraker.get_file_filament_change_count(print_filename)
             self.current_toolchange     = -1 # Reset
             self.logger.info("Total number of toolchanges set to {}".format(self.number_of_toolchanges))
+            self.schedule_prestage()
 
         return self.reactor.NEVER
 
+    def schedule_prestage(self):
+        """
+        Schedules prestage timer to run PRESTAGE_DELAY seconds from now if prestage_lanes or background_load is
+        enabled, delay gives the toolhead time to get back to printing after a toolchange.
+        """
+        if self.prestage_lanes or self.background_load:
+            self.prestage_scan_start = self.prestage_scan_pos = None
+            self.reactor.update_timer(self.prestage_timer, self.reactor.monotonic() + self.PRESTAGE_DELAY)
+
+    def _get_next_toolchange_lane(self):
+        """
+        Scans ahead in the current print file from virtual_sdcard's current position to find the next toolchange.
+        Only PRESTAGE_SCAN_CHUNK bytes are read per call so the reactor is not blocked on large files, the scan
+        continues where it left off on the next call until prestage_scan_length bytes have been scanned.
+
+        :return (object, bool): Lane object for the next toolchange or None, True if scan is not done yet and
+                                should be continued
+        """
+        # Number of toolchanges from file metadata is known and all changes are done, no need to scan file
+        if 0 < self.number_of_toolchanges <= self.current_toolchange:
+            return None, False
+
+        sdcard = self.printer.lookup_object('virtual_sdcard', None)
+        if sdcard is None or sdcard.file_path() is None:
+            return None, False
+
+        if self.prestage_scan_pos is None or self.prestage_scan_pos < sdcard.file_position:
+            self.prestage_scan_start = self.prestage_scan_pos = sdcard.file_position
+
+        tool_cmds = {key.upper(): lane for key, lane in self.tool_cmds.items()}
+        bytes_scanned = 0
+        try:
+            with open(sdcard.file_path(), 'rb') as f:
+                f.seek(self.prestage_scan_pos)
+                for line in f:
+                    bytes_scanned += len(line)
+                    self.prestage_scan_pos += len(line)
+                    # Remove everything after ; since comments could contain tool commands
+                    line = re.sub(';.*', '', line.decode(errors='ignore')).strip()
+                    if line:
+                        command = line.split(' ')[0].upper()
+                        if command in tool_cmds:
+                            return self.lanes.get(tool_cmds[command]), False
+                        if command == 'CHANGE_TOOL':
+                            lane = re.search(r'LANE=(\S+)', line, re.IGNORECASE)
+                            if lane is not None:
+                                return self.lanes.get(lane.group(1)), False
+                    if self.prestage_scan_pos - self.prestage_scan_start >= self.prestage_scan_length:
+                        return None, False
+                    if bytes_scanned >= self.PRESTAGE_SCAN_CHUNK:
+                        return None, True
+        except Exception as e:
+            self.logger.debug("Error scanning print file for next toolchange: {}".format(e), traceback=traceback.format_exc())
+        return None, False
+
+    def _can_prestage(self, cur_lane):
+        """
+        Helper function to check if a lane can be pre-staged. Lane has to be loaded, not already at the hub or
+        in the toolhead, and has to have its own drive motor so it can move while another lane is printing.
+
+        :param cur_lane: Lane object to check
+        :return boolean: True if lane can be pre-staged
+        """
+        return (cur_lane.name != self.current
+                and cur_lane.hub != 'direct'
+                and cur_lane._afc_prep_done
+                and cur_lane.prep_state and cur_lane.load_state
+                and not cur_lane.loaded_to_hub
+                and cur_lane.prestaged_dist == 0
+                and cur_lane.status in (AFCLaneState.NONE, AFCLaneState.LOADED)
+                and cur_lane.dist_hub - self.prestage_offset > 0)
+
+    def _prestage_timer_callback(self, eventtime):
+        """
+        Timer callback that looks up the next toolchange in the print and advances that lane to prestage_offset
+        short of its hub. The move is queued without dwelling the toolhead so printing is not interrupted, TOOL_LOAD
+        then only moves the remaining distance to the hub.
+        """
+        if self.in_toolchange or self.error_state or not self.function.is_printing():
+            return self.reactor.NEVER
+
+        next_lane, scanning = self._get_next_toolchange_lane()
+        if scanning:
+            return eventtime + self.PRESTAGE_SCAN_INTERVAL
+        self.prestage_scan_start = self.prestage_scan_pos = None
+        if next_lane is None:
+            return self.reactor.NEVER
+
+        if self.background_load and self._can_background_load(next_lane):
+            self._background_load(next_lane)
+            return self.reactor.NEVER
+
+        if not self.prestage_lanes or not self._can_prestage(next_lane):
+            return self.reactor.NEVER
+
+        distance = next_lane.dist_hub - self.prestage_offset
+        speed, accel = next_lane.get_speed_accel(SpeedMode.HUB)
+        if next_lane.queue_move(distance, speed, accel) is not None:
+            next_lane.prestaged_dist = distance
+            self.logger.debug("Pre-staging {} {:.1f}mm towards {}".format(next_lane.name, distance, next_lane.hub))
+            self.save_vars()
+
+        return self.reactor.NEVER
+
+    def _can_background_load(self, cur_lane):
+        """
+        Helper function to check if a lane can be loaded while printing. Lane has to go to an extruder other than the
+        one currently printing, that extruder has to be idle and lanes have to share no hub, buffer or drive.
+
+        :param cur_lane: Lane object to check
+        :return boolean: True if lane can be fed through its bowden while printing
+        """
+        active_lane = self.function.get_current_lane_obj()
+        if active_lane is None or active_lane is cur_lane:
+            return False
+        extruder = cur_lane.extruder_obj
+        return (extruder is not active_lane.extruder_obj
+                and extruder.lane_loaded is None
+                and extruder.tool_start is not None and extruder.tool_start != "buffer"
+                and not cur_lane.get_sensor_state("tool_start")
+                and self._lanes_independent(active_lane, cur_lane)
+                and not cur_lane.hub_obj.state
+                and cur_lane._afc_prep_done
+                and cur_lane.prep_state and cur_lane.load_state
+                and cur_lane.prefed_bowden == 0
+                and cur_lane.status in (AFCLaneState.NONE, AFCLaneState.LOADED))
+
+    def _get_bowden_feed_length(self, cur_lane):
+        """
+        Helper function that returns how far past its hub a lane can be fed blindly, prestage_offset short of
+        afc_bowden_length or of the learned bowden length minus learned_bowden_margin when that is shorter
+
+        :param cur_lane: Lane object to get bowden feed length for
+        :return float: Distance in mm to feed past hub
+        """
+        bowden = cur_lane.hub_obj.afc_bowden_length
+        if self.learn_bowden_length:
+            learned_length = cur_lane.get_learned_bowden_length()
+            if learned_length is not None:
+                bowden = min(bowden, learned_length - self.learned_bowden_margin)
+        return max(bowden - self.prestage_offset, 0)
+
+    def _background_load(self, cur_lane):
+        """
+        Feeds lane through its hub and bowden up to prestage_offset short of its idle extruder's toolhead sensor
+        while another extruder is printing, so the next TOOL_LOAD only has to approach the toolhead sensor and
+        load the extruder. Idle extruder is heated as well when background_preheat is enabled.
+
+        :param cur_lane: Lane object to load
+        :return boolean: True if feed move was started
+        """
+        if cur_lane.loaded_to_hub:
+            to_hub = cur_lane.hub_obj.hub_clear_move_dis
+        else:
+            to_hub = cur_lane.dist_hub - cur_lane.prestaged_dist
+        bowden = self._get_bowden_feed_length(cur_lane)
+        distance = to_hub + bowden
+        if bowden <= 0 or distance <= 0:
+            return False
+
+        speed, accel = cur_lane.get_speed_accel(SpeedMode.LONG)
+        if cur_lane.queue_move(distance, speed, accel) is None:
+            return False
+
+        if not cur_lane.loaded_to_hub:
+            cur_lane.prestaged_dist += to_hub
+        cur_lane.prefed_bowden = bowden
+        self.logger.info("Background loading {} {:.1f}mm towards {}".format(cur_lane.name, distance, cur_lane.extruder_obj.name))
+        self.save_vars()
+
+        if self.background_preheat:
+            self._preheat_extruder(cur_lane)
+        return True
+
+    def _preheat_extruder(self, cur_lane):
+        """
+        Helper function that sets target temperature of lanes extruder without waiting, only used for extruders that
+        are not currently active so active extruder temperature is never changed during a print.
+
+        :param cur_lane: Lane object to get extruder and temperature from
+        """
+        extruder = self.printer.lookup_object(cur_lane.extruder_obj.name, None)
+        if extruder is None or not hasattr(extruder, 'get_heater'):
+            return
+        heater = extruder.get_heater()
+        if heater is self.toolhead.get_extruder().get_heater():
+            return
+        target_temp, _ = self._get_default_material_temps(cur_lane)
+        if heater.target_temp < target_temp:
+            self.logger.info("Pre-heating {} to {} for {}".format(cur_lane.extruder_obj.name, target_temp, cur_lane.name))
+            self.printer.lookup_object('heaters').set_temperature(heater, target_temp, wait=False)
+
+    def _lanes_independent(self, out_lane, in_lane):
+        """
+        Helper function to check if two lanes share nothing that would stop them from moving at the same time
+
+        :param out_lane: Lane that is being unloaded
+        :param in_lane: Lane that is going to be loaded
+        :return boolean: True if lanes do not share a hub, buffer or drive stepper/selector
+        """
+        if in_lane.hub == 'direct' or out_lane.hub == 'direct':
+            return False
+        if in_lane.hub_obj is out_lane.hub_obj:
+            return False
+        if in_lane.buffer_obj is not None and in_lane.buffer_obj is out_lane.buffer_obj:
+            return False
+        # Lanes that use a shared drive stepper need a selector, so they can only move one at a time
+        if in_lane.drive_stepper is not None or out_lane.drive_stepper is not None:
+            return False
+        return True
+
+    def _start_parallel_feed(self, out_lane, in_lane):
+        """
+        Starts feeding in_lane towards its hub while out_lane is unloaded. When lanes go to different extruders the
+        bowden is fed as well, stopping prestage_offset short of afc_bowden_length. Move is queued on in_lane's
+        stepper so it runs while TOOL_UNLOAD moves out_lane.
+
+        :param out_lane: Lane that is going to be unloaded
+        :param in_lane: Lane that is going to be loaded
+        :return boolean: True if a feed move was started
+        """
+        if not self.parallel_toolchange or not self._lanes_independent(out_lane, in_lane):
+            return False
+        if in_lane.hub_obj.state or not in_lane.load_state or not in_lane._afc_prep_done:
+            return False
+
+        if in_lane.loaded_to_hub:
+            to_hub = in_lane.hub_obj.hub_clear_move_dis
+        else:
+            to_hub = in_lane.dist_hub - in_lane.prestaged_dist
+
+        bowden = 0
+        if in_lane.extruder_obj is not out_lane.extruder_obj and not in_lane.get_sensor_state("tool_start"):
+            bowden = self._get_bowden_feed_length(in_lane)
+        if bowden == 0:
+            to_hub -= self.prestage_offset
+
+        distance = to_hub + bowden
+        if distance <= 0:
+            return False
+        speed, accel = in_lane.get_speed_accel(SpeedMode.LONG if bowden > 0 else SpeedMode.HUB)
+        if in_lane.queue_move(distance, speed, accel) is None:
+            return False
+
+        # Lanes loaded to hub track how far they were fed past their parked position so it can be retracted again
+        if not in_lane.loaded_to_hub or bowden == 0:
+            in_lane.prestaged_dist += to_hub
+        in_lane.prefed_bowden = bowden
+        self.logger.debug("Feeding {} {:.1f}mm while unloading {}".format(in_lane.name, distance, out_lane.name))
+        self.save_vars()
+        return True
+
+    def _cancel_parallel_feed(self, in_lane):
+        """
+        Retracts filament that was fed into in_lane's bowden by _start_parallel_feed back behind its hub, used when
+        unloading the previous lane fails.
+
+        :param in_lane: Lane that was being fed
+        """
+        in_lane.wait_queued_move()
+        if in_lane.prefed_bowden > 0:
+            in_lane.move_advanced((in_lane.prefed_bowden + in_lane.hub_obj.hub_clear_move_dis) * -1, SpeedMode.LONG,
+                                  assist_active = AssistActive.YES)
+            in_lane.loaded_to_hub   = True
+            in_lane.prestaged_dist  = 0
+            in_lane.prefed_bowden   = 0
+            self.save_vars()
+        elif in_lane.loaded_to_hub and in_lane.prestaged_dist > 0:
+            in_lane.move_advanced(in_lane.prestaged_dist * -1, SpeedMode.HUB, assist_active = AssistActive.DYNAMIC)
+            in_lane.prestaged_dist  = 0
+            self.save_vars()
+
     def _get_default_material_temps(self, cur_lane):
         """
         Helper function to get material temperatures
@@ -432,9 +826,14 @@ class afc:
                     break
         return float(temp_value), using_min_value
 
-    def _check_extruder_temp(self, cur_lane):
+    def _check_extruder_temp(self, cur_lane, wait_for_temp=True):
         """
         Helper function that check to see if extruder needs to be heated, and wait for hotend to get to temp if needed
+
+        :param cur_lane: Current lane object
+        :param wait_for_temp: Set to False to only set heater target without waiting, caller then needs to call
+                              _wait_for_extruder_temp before filament reaches the extruder gears
+        :return boolean: True if extruder needed to be heated to target temperature
         """
 
         # Prepare extruder and heater.
@@ -461,11 +860,19 @@ class afc:
         if self.heater.target_temp <= (target_temp-5) or (self.heater.target_temp >= (target_temp+5) and not using_min_value):
             wait = False if self.heater.target_temp >= (target_temp+5) else True
 
-            self.logger.info('Setting extruder temperature to {} {}'.format(target_temp, "and waiting for extruder to reach temperature" if wait else ""))
-            pheaters.set_temperature(extruder.get_heater(), target_temp, wait=wait)
+            self.logger.info('Setting extruder temperature to {} {}'.format(target_temp, "and waiting for extruder to reach temperature" if wait and wait_for_temp else ""))
+            pheaters.set_temperature(extruder.get_heater(), target_temp, wait=wait and wait_for_temp)
 
         return wait
 
+    def _wait_for_extruder_temp(self):
+        """
+        Helper function that blocks until extruder reaches the target temperature that was set in _check_extruder_temp
+        """
+        pheaters = self.printer.lookup_object('heaters')
+        self.logger.info('Waiting for extruder to reach temperature {}'.format(self.heater.target_temp))
+        pheaters.set_temperature(self.heater, self.heater.target_temp, wait=True)
+
     def _set_quiet_mode(self, val):
         """
         Helper function to set quiet mode to on or off
@@ -846,12 +1253,57 @@ class afc:
 
     def save_vars(self):
         """
-        save_vars function saves lane variables to var file and prints with indents to
-                  make it more readable for users
+        save_vars function marks lane variables as changed and schedules them to be saved to var file. Saves that
+        happen within `save_vars_delay` seconds are written once, and writing happens outside of klippers reactor.
+        Use flush_vars when variables need to be on disk before continuing.
         """
 
         # Return early if prep is not done so that file is not overridden until prep is at least done
         if not self.prep_done: return
+        if not self.vars_dirty:
+            self.vars_dirty = True
+            self.reactor.update_timer(self.save_vars_timer, self.reactor.monotonic() + self.save_vars_delay)
+
+    def flush_vars(self):
+        """
+        flush_vars function writes lane variables to var file immediately and only returns once file is written
+        """
+        if not self.prep_done: return
+        self.vars_dirty = False
+        self.reactor.update_timer(self.save_vars_timer, self.reactor.NEVER)
+        self.var_writer.write(self._get_vars_data())
+
+    def _handle_moonraker_idle(self, print_time):
+        """
+        Writes collected afc_stats and spoolman usage to moonraker once printer is no longer printing
+        """
+        if self.afc_stats is not None:
+            self.afc_stats.flush()
+        if self.moonraker is not None:
+            self.moonraker.flush_spool_use()
+
+    def _handle_moonraker_disconnect(self):
+        """
+        Makes sure afc_stats and spoolman usage that have not been sent to moonraker are in journals
+        before klipper stops
+        """
+        if self.moonraker is not None:
+            self.moonraker.save_stats_journal()
+            self.moonraker.save_spool_use_journal()
+
+    def _save_vars_timer_callback(self, eventtime):
+        """
+        Timer callback that hands current lane variables to writer thread once save window has passed
+        """
+        if self.vars_dirty:
+            self.vars_dirty = False
+            self.var_writer.write_async(self._get_vars_data())
+        return self.reactor.NEVER
+
+    def _get_vars_data(self):
+        """
+        Helper function to collect lane variables that are saved to var file
+        """
         str = {}
         for UNIT in self.units.keys():
             cur_unit=self.units[UNIT]
@@ -874,13 +1326,7 @@ class afc:
             cur_extruder = self.tools[extrude]
             str["system"]["extruders"][cur_extruder.name]={}
             str["system"]["extruders"][cur_extruder.name]['lane_loaded'] = cur_extruder.lane_loaded
-
-        try:
-            with open(self.VarFile+ '.unit', 'w') as f:
-                f.write(json.dumps(str, indent=4))
-        except Exception as e:
-            self.logger.error("Error happened when trying to save variables, check AFC.log for error")
-            self.logger.debug(f"Error:{e}\n{traceback.format_exc()}", only_debug=True)
+        return str
 
     # HUB COMMANDS
     cmd_HUB_LOAD_help = "Load lane into hub"
@@ -912,15 +1358,17 @@ class afc:
         cur_hub = cur_lane.hub_obj
         if not cur_lane.prep_state: return
         cur_lane.status = AFCLaneState.HUB_LOADING
-        if not cur_lane.load_state:
-            while not cur_lane.load_state:
-                cur_lane.move_advanced( cur_hub.move_dis, SpeedMode.SHORT)
-        if not cur_lane.loaded_to_hub:
-            cur_lane.move_advanced(cur_lane.dist_hub, SpeedMode.HUB, assist_active = AssistActive.DYNAMIC)
-        while not cur_hub.state:
-            cur_lane.move_advanced(cur_hub.move_dis, SpeedMode.SHORT)
-        while cur_hub.state:
-            cur_lane.move_advanced(cur_hub.move_dis * -1, SpeedMode.SHORT)
+        with cur_lane.manual_move_session():
+            if not cur_lane.load_state:
+                while not cur_lane.load_state:
+                    cur_lane.move_advanced( cur_hub.move_dis, SpeedMode.SHORT)
+            if not cur_lane.loaded_to_hub:
+                cur_lane.move_advanced(cur_lane.dist_hub, SpeedMode.HUB, assist_active = AssistActive.DYNAMIC)
+            short_speed, short_accel = cur_lane.get_speed_accel(SpeedMode.SHORT)
+            while not cur_hub.state:
+                cur_lane.move_to_sensor(cur_hub.move_dis, short_speed, short_accel, "hub")
+            while cur_hub.state:
+                cur_lane.move_to_sensor(cur_hub.move_dis * -1, short_speed, short_accel, "hub", state=False)
         cur_lane.status = AFCLaneState.NONE
         cur_lane.do_enable(False)
         cur_lane.loaded_to_hub = True
@@ -957,40 +1405,109 @@ class afc:
         cur_lane = self.lanes[lane]
         self.LANE_UNLOAD( cur_lane )
 
+    cmd_LANE_UNLOAD_BATCH_help = "Unload several lanes at the same time"
+    cmd_LANE_UNLOAD_BATCH_options = {"LANES": {"default": "ALL", "type": "string"}}
+    def cmd_LANE_UNLOAD_BATCH(self, gcmd):
+        """
+        This function ejects several lanes at the same time. Lanes are moved together so ejecting takes as long as
+        the longest lane instead of the sum of all lanes. LANES takes a comma separated list of lanes, or ALL to eject
+        every lane that is loaded and not in a toolhead.
+
+        Usage
+        -----
+        `LANE_UNLOAD_BATCH LANES=<lane1,lane2|ALL>`
+
+        Example
+        -----
+        ```
+        LANE_UNLOAD_BATCH LANES=lane1,lane2,lane3
+        ```
+        """
+        if self.function.is_printing():
+            self.error.AFC_error("Cannot eject lanes while printer is printing", pause=False)
+            return
+
+        lane_names = gcmd.get('LANES', 'ALL')
+        if lane_names.upper() == 'ALL':
+            lanes = [lane for lane in self.lanes.values()
+                     if lane.load_state and lane.name != self.current and lane.hub != 'direct'
+                     and lane.name not in [extruder.lane_loaded for extruder in self.tools.values()]]
+        else:
+            lanes = []
+            for lane in [name.strip() for name in lane_names.split(',') if name.strip()]:
+                if lane not in self.lanes:
+                    self.logger.info('{} Unknown'.format(lane))
+                    return
+                lanes.append(self.lanes[lane])
+        self.unload_lanes( lanes )
+
     def LANE_UNLOAD(self, cur_lane):
-        cur_hub = cur_lane.hub_obj
+        self.unload_lanes( [cur_lane] )
 
+    def unload_lanes(self, lanes):
+        """
+        Ejects lanes back out of their units, lanes are moved at the same time when more than one lane is passed in.
+        Lanes that are loaded in the toolhead or are direct lanes are skipped.
+
+        :param lanes: List of lane objects to eject
+        """
         self.current_state = State.EJECTING_LANE
 
-        if cur_lane.name != self.current and cur_lane.hub != 'direct':
-            # Setting status as ejecting so if filament is removed and de-activates the prep sensor while
-            # extruder motors are still running it does not trigger infinite spool or pause logic
-            # once user removes filament lanes status will go to None
-            cur_lane.status = AFCLaneState.EJECTING
+        ejecting = []
+        for cur_lane in lanes:
+            if cur_lane.name == self.current:
+                self.logger.info("LANE {} is loaded in toolhead, can't unload.".format(cur_lane.name))
+            elif cur_lane.hub == 'direct':
+                self.logger.info("LANE {} is a direct lane must be tool unloaded.".format(cur_lane.name))
+            else:
+                ejecting.append(cur_lane)
+
+        if ejecting:
+            moves = []
+            for cur_lane in ejecting:
+                cur_hub = cur_lane.hub_obj
+                # Setting status as ejecting so if filament is removed and de-activates the prep sensor while
+                # extruder motors are still running it does not trigger infinite spool or pause logic
+                # once user removes filament lanes status will go to None
+                cur_lane.status = AFCLaneState.EJECTING
+                # Retract filament that was fed into bowden while printing back behind hub first
+                if cur_lane.prefed_bowden > 0:
+                    moves.append((cur_lane, (cur_lane.prefed_bowden + cur_hub.hub_clear_move_dis) * -1, SpeedMode.LONG,
+                                  AssistActive.YES))
+                    cur_lane.loaded_to_hub = True
+                    cur_lane.prestaged_dist = 0
+                    cur_lane.prefed_bowden = 0
+                if cur_lane.loaded_to_hub:
+                    # Lanes loaded to hub can be fed past their parked position by a parallel toolchange feed
+                    moves.append((cur_lane, (cur_lane.dist_hub + cur_lane.prestaged_dist) * -1, SpeedMode.HUB,
+                                  AssistActive.DYNAMIC))
+                elif cur_lane.prestaged_dist > 0:
+                    moves.append((cur_lane, cur_lane.prestaged_dist * -1, SpeedMode.HUB, AssistActive.DYNAMIC))
+                cur_lane.loaded_to_hub = False
+                cur_lane.prestaged_dist = 0
             self.save_vars()
-            if cur_lane.loaded_to_hub:
-                cur_lane.move_advanced(cur_lane.dist_hub * -1, SpeedMode.HUB, assist_active = AssistActive.DYNAMIC)
-            cur_lane.loaded_to_hub = False
-            while cur_lane.load_state:
-                cur_lane.move_advanced(cur_hub.move_dis * -1, SpeedMode.SHORT, assist_active = AssistActive.YES)
-            cur_lane.move_advanced(cur_hub.move_dis * -5, SpeedMode.SHORT)
-            cur_lane.do_enable(False)
-            cur_lane.status = AFCLaneState.NONE
-            cur_lane.unit_obj.return_to_home()
+
+            with ejecting[0].manual_move_session() if len(ejecting) == 1 else nullcontext():
+                self.function.move_lanes(moves)
+                while loaded := [cur_lane for cur_lane in ejecting if cur_lane.load_state]:
+                    self.function.move_lanes([(cur_lane, cur_lane.hub_obj.move_dis * -1, SpeedMode.SHORT, AssistActive.YES)
+                                              for cur_lane in loaded])
+                self.function.move_lanes([(cur_lane, cur_lane.hub_obj.move_dis * -5, SpeedMode.SHORT, AssistActive.NO)
+                                          for cur_lane in ejecting])
+
+            for cur_lane in ejecting:
+                cur_lane.do_enable(False)
+                cur_lane.status = AFCLaneState.NONE
+                cur_lane.unit_obj.return_to_home()
             # Put CAM back to lane if its loaded to toolhead
             self.function.select_loaded_lane()
             self.save_vars()
 
-            # Removing spool from vars since it was ejected
-            self.spool.set_spoolID(cur_lane, "")
-            self.logger.info("LANE {} eject done".format(cur_lane.name))
-            self.function.afc_led(cur_lane.led_not_ready, cur_lane.led_index)
-
-        elif cur_lane.name == self.current:
-            self.logger.info("LANE {} is loaded in toolhead, can't unload.".format(cur_lane.name))
-
-        elif cur_lane.hub == 'direct':
-            self.logger.info("LANE {} is a direct lane must be tool unloaded.".format(cur_lane.name))
+            for cur_lane in ejecting:
+                # Removing spool from vars since it was ejected
+                self.spool.set_spoolID(cur_lane, "")
+                self.logger.info("LANE {} eject done".format(cur_lane.name))
+                self.function.afc_led(cur_lane.led_not_ready, cur_lane.led_index)
 
         self.current_state = State.IDLE
 
@@ -1052,7 +1569,7 @@ class afc:
         cur_hub = cur_lane.hub_obj
 
         # Check if the lane is in a state ready to load and hub is clear.
-        if (cur_lane.load_state and not cur_hub.state) or cur_lane.hub == 'direct':
+        if (cur_lane.load_state and (not cur_hub.state or cur_lane.prefed_bowden > 0)) or cur_lane.hub == 'direct':
 
             self.logger.info("Loading {}".format(cur_lane.name))
 
@@ -1063,31 +1580,40 @@ class afc:
             cur_extruder = cur_lane.extruder_obj
             self.current_state = State.LOADING
             self.current_loading = cur_lane.name
+            self.afcDeltaTime.start_span()
 
             # Set the lane status to 'loading' and activate the loading LED.
             cur_lane.status = AFCLaneState.TOOL_LOADING
             self.save_vars()
             cur_lane.unit_obj.lane_loading( cur_lane )
 
-            if self._check_extruder_temp(cur_lane):
-                self.afcDeltaTime.log_with_time("Done heating toolhead")
-
-            # Move filament to the hub if it's not already loaded there.
+            # Start moving filament to the hub if it's not already loaded there, move runs while extruder heats
+            hub_move = None
             if not cur_lane.loaded_to_hub or cur_lane.hub == 'direct':
-                cur_lane.move_advanced(cur_lane.dist_hub, SpeedMode.HUB, assist_active = AssistActive.DYNAMIC)
+                # Only move remaining distance if lane was pre-staged while printing
+                hub_distance = cur_lane.dist_hub - cur_lane.prestaged_dist
+                if hub_distance > 0:
+                    hub_move = cur_lane.move_advanced_async(hub_distance, SpeedMode.HUB, assist_active = AssistActive.DYNAMIC)
+
+            # When heat_during_transport is enabled heater target is only set here, waiting happens right before
+            # filament is synced to extruder so heating overlaps with hub and bowden moves
+            heating = self._check_extruder_temp(cur_lane, wait_for_temp=not self.heat_during_transport)
+            if heating and not self.heat_during_transport:
+                self.afcDeltaTime.log_with_time("Done heating toolhead", span="heat")
+
+            if hub_move is not None:
+                hub_move.wait()
                 self.afcDeltaTime.log_with_time("Loaded to hub")
 
             cur_lane.loaded_to_hub = True
-            hub_attempts = 0
+            cur_lane.prestaged_dist = 0
 
             # Ensure filament moves past the hub.
-            while not cur_hub.state and cur_lane.hub != 'direct':
-                if hub_attempts == 0:
-                    cur_lane.move_advanced(cur_hub.move_dis, SpeedMode.SHORT)
-                else:
-                    cur_lane.move_advanced(cur_lane.short_move_dis, SpeedMode.SHORT)
-                hub_attempts += 1
-                if hub_attempts > 20:
+            if not cur_hub.state and cur_lane.hub != 'direct':
+                short_speed, short_accel = cur_lane.get_speed_accel(SpeedMode.SHORT)
+                hub_triggered, _ = cur_lane.move_to_sensor(cur_hub.move_dis + cur_lane.short_move_dis * 20,
+                                                           short_speed, short_accel, "hub")
+                if not hub_triggered:
                     message = 'filament did not trigger hub sensor, CHECK FILAMENT PATH\n||=====||==>--||-----||\nTRG   LOAD   HUB   TOOL.'
                     if self.function.in_print():
                         message += '\nOnce issue is resolved please manually load {} with {} macro and click resume to continue printing.'.format(cur_lane.name, cur_lane.map)
@@ -1095,29 +1621,61 @@ class afc:
                     self.error.handle_lane_failure(cur_lane, message)
                     return False
 
-            self.afcDeltaTime.log_with_time("Filament loaded to hub")
+            self.afcDeltaTime.log_with_time("Filament loaded to hub", span="hub_load")
 
-            # Move filament towards the toolhead.
+            # Move filament towards the toolhead. If distance to toolhead sensor has been learned, move fast up to
+            # learned distance minus margin and let the sensor approach cover the rest.
+            learned_length = None
+            bowden_move = 0
             if cur_lane.hub != 'direct':
-                cur_lane.move_advanced(cur_hub.afc_bowden_length, SpeedMode.LONG, assist_active = AssistActive.YES)
+                if self.learn_bowden_length and cur_extruder.tool_start:
+                    learned_length = cur_lane.get_learned_bowden_length()
+                if learned_length is not None:
+                    bowden_move = max(learned_length - self.learned_bowden_margin, 0)
+                    self.logger.debug("{} using learned bowden length {:.1f}mm".format(cur_lane.name, learned_length))
+                else:
+                    bowden_move = cur_hub.afc_bowden_length
+                # Only move remaining distance if bowden was fed while previous lane was unloading
+                if bowden_move - cur_lane.prefed_bowden > 0:
+                    bowden_distance = bowden_move - cur_lane.prefed_bowden
+                    cur_lane.move_advanced(bowden_distance, SpeedMode.LONG, assist_active = AssistActive.YES,
+                                           profile=cur_lane.get_bowden_profile(bowden_distance))
+                cur_lane.prefed_bowden = 0
+                self.afcDeltaTime.log_with_time("Bowden move done", span="bowden")
 
             # Ensure filament reaches the toolhead.
             tool_attempts = 0
             if cur_extruder.tool_start:
-                while not cur_lane.get_toolhead_pre_sensor_state():
-                    tool_attempts += 1
-                    cur_lane.move(cur_lane.short_move_dis, cur_extruder.tool_load_speed, cur_lane.long_moves_accel)
-                    if tool_attempts > int(self.tool_homing_distance/cur_lane.short_move_dis):
-                        message = 'filament failed to trigger pre extruder gear toolhead sensor, CHECK FILAMENT PATH\n||=====||====||==>--||\nTRG   LOAD   HUB   TOOL'
-                        message += '\nTo resolve set lane loaded with `SET_LANE_LOADED LANE={}` macro.'.format(cur_lane.name)
-                        message += '\nManually move filament with LANE_MOVE macro for {} until filament is right before toolhead extruder gears,'.format(cur_lane.name)
-                        message += '\n then load into extruder gears with extrude button in your gui of choice until the color fully changes'
-                        if self.function.in_print():
-                            message += '\nOnce filament is fully loaded click resume to continue printing'
-                        self.error.handle_lane_failure(cur_lane, message)
-                        return False
+                homing_distance = self.tool_homing_distance
+                if learned_length is not None:
+                    homing_distance += self.learned_bowden_margin
+                tool_triggered, tool_moved = cur_lane.move_to_sensor(homing_distance, cur_extruder.tool_load_speed,
+                                                                     cur_lane.long_moves_accel, "tool_start")
+                if self.learn_bowden_length and cur_lane.hub != 'direct':
+                    # Only learn when sensor triggered during slow approach, otherwise trigger point is unknown
+                    if tool_triggered and tool_moved > 0:
+                        cur_lane.set_learned_bowden_length(bowden_move + tool_moved)
+                    else:
+                        if tool_triggered:
+                            self.logger.warning("{} toolhead sensor was already triggered after bowden move, bowden length "
+                                                "could not be learned. Check afc_bowden_length".format(cur_lane.name))
+                        # Sensor triggered before slow approach or never triggered, learned length no longer valid
+                        cur_lane.clear_learned_bowden_length()
+                if not tool_triggered:
+                    message = 'filament failed to trigger pre extruder gear toolhead sensor, CHECK FILAMENT PATH\n||=====||====||==>--||\nTRG   LOAD   HUB   TOOL'
+                    message += '\nTo resolve set lane loaded with `SET_LANE_LOADED LANE={}` macro.'.format(cur_lane.name)
+                    message += '\nManually move filament with LANE_MOVE macro for {} until filament is right before toolhead extruder gears,'.format(cur_lane.name)
+                    message += '\n then load into extruder gears with extrude button in your gui of choice until the color fully changes'
+                    if self.function.in_print():
+                        message += '\nOnce filament is fully loaded click resume to continue printing'
+                    self.error.handle_lane_failure(cur_lane, message)
+                    return False
+
+            self.afcDeltaTime.log_with_time("Filament loaded to pre-sensor", span="tool_sensor")
 
-            self.afcDeltaTime.log_with_time("Filament loaded to pre-sensor")
+            if heating and self.heat_during_transport:
+                self._wait_for_extruder_temp()
+                self.afcDeltaTime.log_with_time("Done heating toolhead", span="heat")
 
             # Synchronize lane's extruder stepper and finalize tool loading.
             cur_lane.status = AFCLaneState.TOOL_LOADED
@@ -1137,34 +1695,35 @@ class afc:
                         self.error.handle_lane_failure(cur_lane, message)
                         return False
 
-                self.afcDeltaTime.log_with_time("Filament loaded to post-sensor")
+                self.afcDeltaTime.log_with_time("Filament loaded to post-sensor", span="tool_end_sensor")
 
             # Adjust tool position for loading.
             self.move_e_pos( cur_extruder.tool_stn, cur_extruder.tool_load_speed, "tool stn" )
 
-            self.afcDeltaTime.log_with_time("Filament loaded to nozzle")
+            self.afcDeltaTime.log_with_time("Filament loaded to nozzle", span="tool_stn")
 
             # Check if ramming is enabled, if it is, go through ram load sequence.
             # Lane will load until Advance sensor is True
             # After the tool_stn distance the lane will retract off the sensor to confirm load and reset buffer
             if cur_extruder.tool_start == "buffer":
                 cur_lane.unsync_to_extruder()
-                load_checks = 0
-                while cur_lane.get_toolhead_pre_sensor_state():
-                    cur_lane.move_advanced(cur_lane.short_move_dis * -1, SpeedMode.SHORT)
-                    load_checks += 1
-                    self.reactor.pause(self.reactor.monotonic() + 0.1)
-                    if load_checks > self.tool_max_load_checks:
-                        msg = ''
-                        msg += "Buffer did not become compressed after {} short moves.\n".format(self.tool_max_load_checks)
-                        msg += "Setting and increasing 'tool_max_load_checks' in AFC.cfg may improve loading reliability.\n\n"
-                        msg += "Check that the filament is properly loaded into the toolhead extruder. If filament is loaded\n"
-                        msg += "into toolhead extruders gears, then manually run SET_LANE_LOADED LANE={cur_lane.name} then\n"
-                        msg += "manually extrude filament and clean nozzle."
-                        if self.function.in_print():
-                            msg += '\nOnce issue is resolved click resume to continue printing'
-                        self.error.handle_lane_failure(cur_lane, msg)
-                        return False
+                with cur_lane.manual_move_session():
+                    load_checks = 0
+                    while cur_lane.get_toolhead_pre_sensor_state():
+                        cur_lane.move_advanced(cur_lane.short_move_dis * -1, SpeedMode.SHORT)
+                        load_checks += 1
+                        self.reactor.pause(self.reactor.monotonic() + 0.1)
+                        if load_checks > self.tool_max_load_checks:
+                            msg = ''
+                            msg += "Buffer did not become compressed after {} short moves.\n".format(self.tool_max_load_checks)
+                            msg += "Setting and increasing 'tool_max_load_checks' in AFC.cfg may improve loading reliability.\n\n"
+                            msg += "Check that the filament is properly loaded into the toolhead extruder. If filament is loaded\n"
+                            msg += "into toolhead extruders gears, then manually run SET_LANE_LOADED LANE={cur_lane.name} then\n"
+                            msg += "manually extrude filament and clean nozzle."
+                            if self.function.in_print():
+                                msg += '\nOnce issue is resolved click resume to continue printing'
+                            self.error.handle_lane_failure(cur_lane, msg)
+                            return False
                 cur_lane.sync_to_extruder()
             # Update tool and lane status.
             cur_lane.set_loaded()
@@ -1180,37 +1739,39 @@ class afc:
                 else:
                     self.gcode.run_script_from_command(self.poop_cmd)
 
-                self.afcDeltaTime.log_with_time("TOOL_LOAD: After poop")
+                self.afcDeltaTime.log_with_time("TOOL_LOAD: After poop", span="poop")
                 self.function.log_toolhead_pos()
 
                 if self.wipe:
                     self.gcode.run_script_from_command(self.wipe_cmd)
-                    self.afcDeltaTime.log_with_time("TOOL_LOAD: After first wipe")
+                    self.afcDeltaTime.log_with_time("TOOL_LOAD: After first wipe", span="wipe")
                     self.function.log_toolhead_pos()
 
             if self.kick:
                 self.gcode.run_script_from_command(self.kick_cmd)
-                self.afcDeltaTime.log_with_time("TOOL_LOAD: After kick")
+                self.afcDeltaTime.log_with_time("TOOL_LOAD: After kick", span="kick")
                 self.function.log_toolhead_pos()
 
             if self.wipe:
                 self.gcode.run_script_from_command(self.wipe_cmd)
-                self.afcDeltaTime.log_with_time("TOOL_LOAD: After second wipe")
+                self.afcDeltaTime.log_with_time("TOOL_LOAD: After second wipe", span="wipe")
                 self.function.log_toolhead_pos()
 
             # Update lane and extruder state for tracking.
             cur_extruder.lane_loaded = cur_lane.name
             self.spool.set_active_spool(cur_lane.spool_id)
             cur_lane.unit_obj.lane_tool_loaded( cur_lane )
-            self.save_vars()
+            self.flush_vars()
             self.current_state = State.IDLE
             load_time = self.afcDeltaTime.log_major_delta("{} is now loaded in toolhead".format(cur_lane.name), False)
-            self.afc_stats.average_tool_load_time.average_time(load_time)
+            # Stats are not available until moonraker connects when PREP started from saved spoolman data
+            if self.afc_stats is not None:
+                self.afc_stats.average_tool_load_time.average_time(load_time)
 
-            # Increment stat counts
-            self.afc_stats.tc_tool_load.increase_count()
-            cur_lane.lane_load_count.increase_count()
-            cur_lane.espooler.stats.update_database()
+                # Increment stat counts
+                self.afc_stats.tc_tool_load.increase_count()
+                cur_lane.lane_load_count.increase_count()
+                cur_lane.espooler.stats.update_database()
 
         else:
             # Handle errors if the hub is not clear or the lane is not ready for loading.
@@ -1284,6 +1845,7 @@ class afc:
 
         self.current_state  = State.UNLOADING
         self.current_loading = cur_lane.name
+        self.afcDeltaTime.start_span()
         self.logger.info("Unloading {}".format(cur_lane.name))
         cur_lane.status = AFCLaneState.TOOL_UNLOADING
         self.save_vars()
@@ -1295,19 +1857,32 @@ class afc:
         cur_hub = cur_lane.hub_obj
         cur_extruder = cur_lane.extruder_obj
 
-        # Prepare the extruder and heater for unloading.
-        if self._check_extruder_temp(cur_lane):
-            self.afcDeltaTime.log_with_time("Done heating toolhead")
+        # Prepare the extruder and heater for unloading. When heat_during_transport is enabled z-hop is done
+        # while extruder heats and quick pull happens once extruder is at temperature
+        heating = self._check_extruder_temp(cur_lane, wait_for_temp=not self.heat_during_transport)
+        defer_quick_pull = heating and self.heat_during_transport
+        if heating and not self.heat_during_transport:
+            self.afcDeltaTime.log_with_time("Done heating toolhead", span="heat")
 
         # Quick pull to prevent oozing.
-        self.move_e_pos( -2, cur_extruder.tool_unload_speed, "Quick Pull", wait_tool=False)
-        self.function.log_toolhead_pos("TOOL_UNLOAD quick pull: ")
+        if not defer_quick_pull:
+            self.move_e_pos( -2, cur_extruder.tool_unload_speed, "Quick Pull", wait_tool=False)
+            self.function.log_toolhead_pos("TOOL_UNLOAD quick pull: ")
+            self.afcDeltaTime.log_with_time("TOOL_UNLOAD: After quick pull", span="quick_pull")
 
         # Perform Z-hop to avoid collisions during unloading.
         pos = self.gcode_move.last_position
         pos[2] += self.z_hop
         # toolhead wait is needed here as it will cause TTC for some if wait does not occur
         self.move_z_pos(pos[2], "Tool_Unload quick pull", wait_moves=True)
+        self.afcDeltaTime.log_with_time("TOOL_UNLOAD: After z-hop", span="z_hop")
+
+        if defer_quick_pull:
+            self._wait_for_extruder_temp()
+            self.afcDeltaTime.log_with_time("Done heating toolhead", span="heat")
+            self.move_e_pos( -2, cur_extruder.tool_unload_speed, "Quick Pull", wait_tool=False)
+            self.function.log_toolhead_pos("TOOL_UNLOAD quick pull: ")
+            self.afcDeltaTime.log_with_time("TOOL_UNLOAD: After quick pull", span="quick_pull")
 
         # Disable the buffer if it's active.
         cur_lane.disable_buffer()
@@ -1321,32 +1896,33 @@ class afc:
 
         # Perform filament cutting and parking if specified.
         if self.tool_cut:
-            self.afc_stats.increase_cut_total()
+            if self.afc_stats is not None:
+                self.afc_stats.increase_cut_total()
             self.gcode.run_script_from_command(self.tool_cut_cmd)
-            self.afcDeltaTime.log_with_time("TOOL_UNLOAD: After cut")
+            self.afcDeltaTime.log_with_time("TOOL_UNLOAD: After cut", span="cut")
             self.function.log_toolhead_pos()
 
             if self.park:
                 self.gcode.run_script_from_command(self.park_cmd)
-                self.afcDeltaTime.log_with_time("TOOL_UNLOAD: After park")
+                self.afcDeltaTime.log_with_time("TOOL_UNLOAD: After park", span="park")
                 self.function.log_toolhead_pos()
 
         # Form filament tip if necessary.
         if self.form_tip:
             if self.park:
                 self.gcode.run_script_from_command(self.park_cmd)
-                self.afcDeltaTime.log_with_time("TOOL_UNLOAD: After form tip park")
+                self.afcDeltaTime.log_with_time("TOOL_UNLOAD: After form tip park", span="park")
                 self.function.log_toolhead_pos()
 
             if self.form_tip_cmd == "AFC":
                 self.tip = self.printer.lookup_object('AFC_form_tip')
                 self.tip.tip_form()
-                self.afcDeltaTime.log_with_time("TOOL_UNLOAD: After afc form tip")
+                self.afcDeltaTime.log_with_time("TOOL_UNLOAD: After afc form tip", span="form_tip")
                 self.function.log_toolhead_pos()
 
             else:
                 self.gcode.run_script_from_command(self.form_tip_cmd)
-                self.afcDeltaTime.log_with_time("TOOL_UNLOAD: After custom form tip")
+                self.afcDeltaTime.log_with_time("TOOL_UNLOAD: After custom form tip", span="form_tip")
                 self.function.log_toolhead_pos()
 
         # Attempt to unload the filament from the extruder, retrying if needed.
@@ -1354,26 +1930,27 @@ class afc:
         if cur_extruder.tool_start == "buffer":
             # if ramming is enabled, AFC will retract to collapse buffer before unloading
             cur_lane.unsync_to_extruder()
-            while not cur_lane.get_trailing() and self.tool_max_unload_attempts > 0:
-                # attempt to return buffer to trailing pin
-                cur_lane.move_advanced(cur_lane.short_move_dis * -1, SpeedMode.SHORT)
-                num_tries += 1
-                self.reactor.pause(self.reactor.monotonic() + 0.1)
-                if num_tries > self.tool_max_unload_attempts:
-                    msg = ''
-                    msg += "Buffer did not become compressed after {} short moves.\n".format(self.tool_max_unload_attempts)
-                    msg += "Setting and increasing 'tool_max_unload_attempts' in AFC.cfg may improve unloading reliability\n\n"
-                    msg += "Please check to make sure filament is unloaded from the toolhead's extruder. If filament is still\n"
-                    msg += "loaded manually retract back until its free, then run UNSET_LANE_LOADED and then do manual\n"
-                    msg += "moves with BT_LANE_MOVE until filament is retracted behind your hub. Or you can run AFC_RESET\n"
-                    msg += f"and select {cur_lane.name}, then AFC will slowly move lane until hub is no longer triggered.\n"
-                    if self.next_lane_load is not None:
-                        msg += f"\nOnce lane is behind hub and hub is no longer triggered manually load {self.next_lane_load}\n"
-                        msg += f"with {self.lanes[self.next_lane_load].map} macro.\n"
-                        if self.function.in_print():
-                            msg += "Once lane is loaded click resume to continue printing"
-                    self.error.handle_lane_failure(cur_lane, msg)
-                    return False
+            with cur_lane.manual_move_session():
+                while not cur_lane.get_trailing() and self.tool_max_unload_attempts > 0:
+                    # attempt to return buffer to trailing pin
+                    cur_lane.move_advanced(cur_lane.short_move_dis * -1, SpeedMode.SHORT)
+                    num_tries += 1
+                    self.reactor.pause(self.reactor.monotonic() + 0.1)
+                    if num_tries > self.tool_max_unload_attempts:
+                        msg = ''
+                        msg += "Buffer did not become compressed after {} short moves.\n".format(self.tool_max_unload_attempts)
+                        msg += "Setting and increasing 'tool_max_unload_attempts' in AFC.cfg may improve unloading reliability\n\n"
+                        msg += "Please check to make sure filament is unloaded from the toolhead's extruder. If filament is still\n"
+                        msg += "loaded manually retract back until its free, then run UNSET_LANE_LOADED and then do manual\n"
+                        msg += "moves with BT_LANE_MOVE until filament is retracted behind your hub. Or you can run AFC_RESET\n"
+                        msg += f"and select {cur_lane.name}, then AFC will slowly move lane until hub is no longer triggered.\n"
+                        if self.next_lane_load is not None:
+                            msg += f"\nOnce lane is behind hub and hub is no longer triggered manually load {self.next_lane_load}\n"
+                            msg += f"with {self.lanes[self.next_lane_load].map} macro.\n"
+                            if self.function.in_print():
+                                msg += "Once lane is loaded click resume to continue printing"
+                        self.error.handle_lane_failure(cur_lane, msg)
+                        return False
             cur_lane.sync_to_extruder(False)
             # we only need to do this if we need to move off the extruder gears
             if cur_extruder.tool_stn_unload > 0:
@@ -1385,15 +1962,13 @@ class afc:
 
             if cur_extruder.tool_stn_unload == 0:
                 cur_lane.unsync_to_extruder()
-                while cur_lane.get_toolhead_pre_sensor_state():
-                    # attempt to move filament back from sensor without moving extruder
-                    cur_lane.move_advanced(cur_lane.short_move_dis * -1, SpeedMode.SHORT)
-                    num_tries += 1
-                    if num_tries > self.tool_max_unload_attempts:
-                        # note that this will break out of the loop and immediately fall into the error
-                        # condition of the next loop for messaging to the user
-                        break
-                    self.reactor.pause(self.reactor.monotonic() + 0.1)
+                # attempt to move filament back from sensor without moving extruder, if sensor does not clear
+                # the next loop falls into its error condition for messaging to the user
+                short_speed, short_accel = cur_lane.get_speed_accel(SpeedMode.SHORT)
+                sensor_cleared, _ = cur_lane.move_to_sensor(cur_lane.short_move_dis * self.tool_max_unload_attempts * -1,
+                                                            short_speed, short_accel, "tool_start", state=False)
+                if not sensor_cleared:
+                    num_tries = self.tool_max_unload_attempts
 
             while cur_lane.get_toolhead_pre_sensor_state() or cur_extruder.tool_end_state:
                 num_tries += 1
@@ -1418,36 +1993,35 @@ class afc:
 
                 self.function.log_toolhead_pos("Sensor move after ")
 
-        self.afcDeltaTime.log_with_time("Unloaded from toolhead")
+        self.afcDeltaTime.log_with_time("Unloaded from toolhead", span="unload_to_sensor")
 
         # Move filament past the sensor after the extruder, if applicable.
         if cur_extruder.tool_sensor_after_extruder > 0:
             with cur_lane.assist_move(cur_extruder.tool_unload_speed, True, cur_lane.assisted_unload):
                 self.move_e_pos(cur_extruder.tool_sensor_after_extruder * -1, cur_extruder.tool_unload_speed, "After extruder")
 
-            self.afcDeltaTime.log_with_time("Tool sensor after extruder move done")
+            self.afcDeltaTime.log_with_time("Tool sensor after extruder move done", span="after_extruder")
 
-        self.save_vars()
         # Synchronize and move filament out of the hub.
         cur_lane.unsync_to_extruder()
         if cur_lane.hub != 'direct':
-            cur_lane.move_advanced(cur_hub.afc_unload_bowden_length * -1, SpeedMode.LONG, assist_active = AssistActive.YES)
+            retract = cur_lane.move_advanced_async(cur_hub.afc_unload_bowden_length * -1, SpeedMode.LONG, assist_active = AssistActive.YES)
         else:
-            cur_lane.move_advanced(cur_lane.dist_hub * -1, SpeedMode.HUB, assist_active = AssistActive.DYNAMIC)
-
-        self.afcDeltaTime.log_with_time("Long retract done")
+            retract = cur_lane.move_advanced_async(cur_lane.dist_hub * -1, SpeedMode.HUB, assist_active = AssistActive.DYNAMIC)
 
-        # Clear toolhead's loaded status for easier error handling later.
+        # Clear toolhead's loaded status for easier error handling later, done while filament retracts
         cur_lane.set_unloaded()
 
         self.save_vars()
+        retract.wait()
+        self.afcDeltaTime.log_with_time("Long retract done", span="long_retract")
 
         # Ensure filament is fully cleared from the hub.
-        num_tries = 0
-        while cur_hub.state:
-            cur_lane.move_advanced(cur_lane.short_move_dis * -1, SpeedMode.SHORT, assist_active = AssistActive.YES)
-            num_tries += 1
-            if num_tries > (cur_hub.afc_unload_bowden_length / cur_lane.short_move_dis):
+        short_speed, short_accel = cur_lane.get_speed_accel(SpeedMode.SHORT)
+        if cur_hub.state:
+            hub_cleared, _ = cur_lane.move_to_sensor(cur_hub.afc_unload_bowden_length * -1, short_speed, short_accel,
+                                                     "hub", state=False, assist_active=True)
+            if not hub_cleared:
                 # Handle failure if the filament doesn't clear the hub.
                 message = 'Hub is not clearing, filament may be stuck in hub'
                 message += '\nPlease check to make sure filament has not broken off and caused the sensor to stay stuck'
@@ -1462,7 +2036,7 @@ class afc:
                 self.error.handle_lane_failure(cur_lane, message)
                 return False
 
-        self.afcDeltaTime.log_with_time("Hub cleared")
+        self.afcDeltaTime.log_with_time("Hub cleared", span="hub_clear")
 
         #Move to make sure hub path is clear based on the move_clear_dis var
         if cur_lane.hub != 'direct':
@@ -1476,16 +2050,15 @@ class afc:
                     self.gcode.run_script_from_command(cur_hub.cut_cmd)
 
                 # Confirm the hub is clear after the cut.
-                while cur_hub.state:
-                    cur_lane.move_advanced(cur_lane.short_move_dis * -1, SpeedMode.SHORT, assist_active = AssistActive.YES)
-                    num_tries += 1
-                    # TODO: Figure out max number of tries
-                    if num_tries > (cur_hub.afc_unload_bowden_length / cur_lane.short_move_dis):
+                if cur_hub.state:
+                    hub_cleared, _ = cur_lane.move_to_sensor(cur_hub.afc_unload_bowden_length * -1, short_speed, short_accel,
+                                                             "hub", state=False, assist_active=True)
+                    if not hub_cleared:
                         message = 'HUB NOT CLEARING after hub cut\n'
                         self.error.handle_lane_failure(cur_lane, message)
                         return False
 
-                self.afcDeltaTime.log_with_time("Hub cut done")
+                self.afcDeltaTime.log_with_time("Hub cut done", span="hub_cut")
 
         # Finalize unloading and reset lane state.
         cur_lane.loaded_to_hub = True
@@ -1493,19 +2066,22 @@ class afc:
         cur_lane.status = AFCLaneState.NONE
 
         if cur_lane.hub == 'direct':
+            short_speed, short_accel = cur_lane.get_speed_accel(SpeedMode.SHORT)
             while cur_lane.load_state:
-                cur_lane.move_advanced(cur_lane.short_move_dis * -1, SpeedMode.SHORT, assist_active = AssistActive.YES)
+                cur_lane.move_to_sensor(cur_lane.short_move_dis * -10, short_speed, short_accel, "load", state=False, assist_active=True)
             cur_lane.move_advanced(cur_lane.short_move_dis * -5, SpeedMode.SHORT)
 
         cur_lane.do_enable(False)
         cur_lane.unit_obj.return_to_home()
 
-        self.afc_stats.tc_tool_unload.increase_count()
-        cur_lane.espooler.stats.update_database()
+        if self.afc_stats is not None:
+            self.afc_stats.tc_tool_unload.increase_count()
+            cur_lane.espooler.stats.update_database()
 
-        self.save_vars()
+        self.flush_vars()
         unload_time = self.afcDeltaTime.log_major_delta("Lane {} unload done".format(cur_lane.name))
-        self.afc_stats.average_tool_unload_time.average_time(unload_time)
+        if self.afc_stats is not None:
+            self.afc_stats.average_tool_unload_time.average_time(unload_time)
         self.current_state = State.IDLE
         return True
 
@@ -1596,7 +2172,10 @@ class afc:
                     if c_lane not in self.lanes:
                         self.error.AFC_error('{} Unknown'.format(c_lane))
                         return
+                    parallel_feed = self._start_parallel_feed(self.lanes[c_lane], cur_lane)
                     if not self.TOOL_UNLOAD(self.lanes[c_lane]):
+                        if parallel_feed:
+                            self._cancel_parallel_feed(cur_lane)
                         # Abort if the unloading process fails.
                         msg = (' UNLOAD error NOT CLEARED')
                         self.error.fix(msg, self.lanes[c_lane])  #send to error handling
@@ -1606,16 +2185,25 @@ class afc:
             if self.TOOL_LOAD(cur_lane, purge_length) and not self.error_state:
                 if restore_pos:
                     self.restore_pos()
+                    self.afcDeltaTime.log_with_time("Restored position", span="restore_pos")
                 total_time = self.afcDeltaTime.log_total_time("Total change time:")
-                self.afc_stats.average_toolchange_time.average_time(total_time)
+                if self.afc_stats is not None:
+                    self.afc_stats.average_toolchange_time.average_time(total_time)
+                    self.afc_stats.increase_toolcount_change()
                 self.in_toolchange = False
                 # Setting next lane load as none since toolchange was successful
                 self.next_lane_load = None
-                self.afc_stats.increase_toolcount_change()
+                # Start moving lane for the next toolchange while printing
+                self.schedule_prestage()
             else:
                 # Error happened, reset toolchanges without error count
-                if not self.testing:
+                if not self.testing and self.afc_stats is not None:
                     self.afc_stats.reset_toolchange_wo_error()
+            # Write all stats and spoolman usage collected during toolchange with one flush
+            if self.afc_stats is not None:
+                self.afc_stats.flush()
+            if self.moonraker is not None:
+                self.moonraker.flush_spool_use()
         else:
             self.logger.info("{} already loaded".format(cur_lane.name))
             if not self.error_state and self.current_toolchange == -1:
@@ -1642,8 +2230,20 @@ class afc:
 
     def get_status(self, eventtime=None):
         """
-        Displays current status of AFC for webhooks
+        Displays current status of AFC for webhooks, response is only rebuilt when a value in it changes
         """
+        message         = self._get_message()
+        bypass_state    = bool(self._get_bypass_state())
+        quiet_mode      = bool(self._get_quiet_mode())
+        status_key = (self.current, self.current_loading, self.next_lane_load, self.current_state,
+                      self.current_toolchange, self.number_of_toolchanges, self.spoolman, self._td1_present,
+                      self.lane_data_enabled, self.error_state, bypass_state, quiet_mode, self.position_saved, message["message"], message["type"],
+                      self.led_state, len(self.units), len(self.lanes), len(self.tools), len(self.hubs),
+                      len(self.buffers))
+        if status_key == self.status_key:
+            return self.status_cache
+        self.status_key = status_key
+
         str = {}
         str['current_load']             = self.current
         str['current_lane']             = self.current_loading
@@ -1652,11 +2252,11 @@ class afc:
         str["current_toolchange"]       = self.current_toolchange if self.current_toolchange >= 0 else 0
         str["number_of_toolchanges"]    = self.number_of_toolchanges
         str['spoolman']                 = self.spoolman
-        str["td1_present"]              = self.td1_present
+        str["td1_present"]              = self._td1_present
         str["lane_data_enabled"]        = self.lane_data_enabled
         str['error_state']              = self.error_state
-        str["bypass_state"]             = bool(self._get_bypass_state())
-        str["quiet_mode"]               = bool(self._get_quiet_mode())
+        str["bypass_state"]             = bypass_state
+        str["quiet_mode"]               = quiet_mode
         str["position_saved"]           = self.position_saved
 
         unitdisplay =[]
@@ -1669,13 +2269,40 @@ class afc:
         str["extruders"] = list(self.tools.keys())
         str["hubs"] = list(self.hubs.keys())
         str["buffers"] = list(self.buffers.keys())
-        str["message"] = self._get_message()
+        str["message"] = message
         str["led_state"] = self.led_state
+        self.status_cache = str
         return str
 
-    def _webhooks_status(self, web_request):
+    def _get_status_version(self):
         """
-        Webhooks callback for <ip_address>/printer/afc/status, and displays current AFC status for everything
+        Helper function that returns version of afc/status snapshot. Version is increased whenever a unit, lane,
+        extruder, hub or buffer status changes. Since get_status responses are cached and only replaced when they
+        change, comparing responses by identity is enough to detect changes.
+
+        :return int: Current status version
+        """
+        message = self._get_message()
+        parts = [self.current, self.spoolman, self._td1_present, self.lane_data_enabled, self.current_toolchange,
+                 self.number_of_toolchanges, self.led_state, message["message"], message["type"]]
+        for unit in self.units.values():
+            parts.append(unit.hub_obj.state if unit.hub_obj is not None else None)
+            parts.extend(lane.get_status() for lane in unit.lanes.values())
+        parts.extend(extruder.get_status() for extruder in self.tools.values())
+        parts.extend(hub.get_status() for hub in self.hubs.values())
+        parts.extend(buffer.get_status() for buffer in self.buffers.values())
+
+        last_parts = self.webhooks_status_parts
+        if last_parts is None or len(parts) != len(last_parts) or \
+            any(a is not b and a != b for a, b in zip(parts, last_parts)):
+            self.webhooks_status_version += 1
+            self.webhooks_status_cache = None
+        self.webhooks_status_parts = parts
+        return self.webhooks_status_version
+
+    def _build_webhooks_status(self):
+        """
+        Helper function to build full afc/status snapshot
         """
         str = {}
         numoflanes = 0
@@ -1695,7 +2322,7 @@ class afc:
         str["system"]['num_lanes']              = numoflanes
         str["system"]['num_extruders']          = len(self.tools)
         str["system"]['spoolman']               = self.spoolman
-        str["system"]["td1_present"]            = self.td1_present
+        str["system"]["td1_present"]            = self._td1_present
         str["system"]["lane_data_enabled"]      = self.lane_data_enabled
         str["system"]["current_toolchange"]     = self.current_toolchange
         str["system"]["number_of_toolchanges"]  = self.number_of_toolchanges
@@ -1703,6 +2330,7 @@ class afc:
         str["system"]["hubs"]                   = {}
         str["system"]["buffers"]                = {}
         str["system"]["led_state"] = self.led_state
+        str["system"]["message"]   = self._get_message()
 
         for extruder in self.tools.values():
             str["system"]["extruders"][extruder.name] = extruder.get_status()
@@ -1712,8 +2340,154 @@ class afc:
 
         for buffer in self.buffers.values():
             str["system"]["buffers"][buffer.name] = buffer.get_status()
+        return str
+
+    def _get_webhooks_snapshot(self):
+        """
+        Helper function that returns current afc/status version and its cached snapshot
+        """
+        version = self._get_status_version()
+        if self.webhooks_status_cache is None:
+            self.webhooks_status_cache = self._build_webhooks_status()
+        return version, self.webhooks_status_cache
+
+    def _filter_webhooks_status(self, str, lanes=None, fields=None):
+        """
+        Helper function to limit an afc/status snapshot or delta to specified lanes and lane fields
+
+        :param str: afc/status snapshot or delta to filter
+        :param lanes: Set of lane names to keep, None keeps all lanes
+        :param fields: Set of lane fields to keep, None keeps all fields
+        :return dict: Filtered snapshot
+        """
+        if lanes is None and fields is None:
+            return str
+        filtered = {}
+        for unit in self.units.values():
+            # When filtering by lane only units that own a requested lane are kept
+            if unit.name not in str or (lanes is not None and not lanes.intersection(unit.lanes)):
+                continue
+            unit_status = {}
+            for lane in unit.lanes.values():
+                if lane.name not in str[unit.name] or (lanes is not None and lane.name not in lanes):
+                    continue
+                lane_status = str[unit.name][lane.name]
+                if fields is not None:
+                    lane_status = { k: v for k, v in lane_status.items() if k in fields }
+                if lane_status:
+                    unit_status[lane.name] = lane_status
+            if "system" in str[unit.name]:
+                unit_status["system"] = str[unit.name]["system"]
+            if unit_status:
+                filtered[unit.name] = unit_status
+        if "system" in str:
+            filtered["system"] = str["system"]
+        return filtered
+
+    @staticmethod
+    def _status_delta(old, new):
+        """
+        Helper function that returns values in new that are different from old, nested dictionaries are compared
+        recursively so only changed fields are returned
+        """
+        delta = {}
+        for key, value in new.items():
+            old_value = old.get(key)
+            if isinstance(value, dict) and isinstance(old_value, dict):
+                if value is not old_value:
+                    sub_delta = afc._status_delta(old_value, value)
+                    if sub_delta:
+                        delta[key] = sub_delta
+            elif value != old_value:
+                delta[key] = value
+        return delta
+
+    @staticmethod
+    def _get_webhooks_list(web_request, name):
+        """
+        Helper function to get a list argument from a web request, accepts either a list or a comma separated string
+        """
+        value = web_request.get(name, None)
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = [ v.strip() for v in value.split(",") if v.strip() ]
+        return set(value)
+
+    def _webhooks_status(self, web_request):
+        """
+        Webhooks callback for <ip_address>/printer/afc/status, and displays current AFC status for everything
+
+        Optional arguments:
+        - `version`: Version returned by a previous request, if status has not changed since then only
+          `{"version": <version>, "unchanged": true}` is returned
+        - `lanes`: List or comma separated string of lane names to return, other lanes are left out
+        - `fields`: List or comma separated string of lane fields to return, other lane fields are left out
+        """
+        version, str = self._get_webhooks_snapshot()
+        if web_request.get_int("version", None) == version:
+            web_request.send({"version": version, "unchanged": True})
+            return
+
+        str = self._filter_webhooks_status(str, self._get_webhooks_list(web_request, "lanes"),
+                                           self._get_webhooks_list(web_request, "fields"))
+        web_request.send( {"status:" : {"AFC": str}, "version": version})
+
+    def _webhooks_subscribe(self, web_request):
+        """
+        Webhooks callback for <ip_address>/printer/afc/subscribe. Replies with current afc/status snapshot and then
+        pushes only changed lane, unit and system fields to the client whenever AFC status changes.
+
+        Optional arguments:
+        - `lanes`: List or comma separated string of lane names to push changes for
+        - `fields`: List or comma separated string of lane fields to push changes for
+        - `response_template`: Dictionary that pushed updates are merged into, same as klippers objects/subscribe
+        """
+        client = web_request.get_client_connection()
+        lanes  = self._get_webhooks_list(web_request, "lanes")
+        fields = self._get_webhooks_list(web_request, "fields")
+        template = web_request.get_dict("response_template", {})
+
+        version, str = self._get_webhooks_snapshot()
+        if not self.status_subscribers:
+            self.status_push_snapshot = str
+            self.status_push_version  = version
+            self.reactor.update_timer(self.status_push_timer, self.reactor.NOW)
+        self.status_subscribers[client] = (lanes, fields, template)
+
+        web_request.send({"status": self._filter_webhooks_status(str, lanes, fields), "version": version})
+
+    def _status_push_callback(self, eventtime):
+        """
+        Timer callback that pushes changes in afc/status to subscribed clients, timer stops once all clients
+        have disconnected
+        """
+        for client in [ c for c in self.status_subscribers if c.is_closed() ]:
+            del self.status_subscribers[client]
+        if not self.status_subscribers:
+            self.status_push_snapshot = None
+            return self.reactor.NEVER
+
+        version, str = self._get_webhooks_snapshot()
+        if version != self.status_push_version:
+            delta = self._status_delta(self.status_push_snapshot, str)
+            self.status_push_snapshot = str
+            self.status_push_version  = version
+            for client, (lanes, fields, template) in self.status_subscribers.items():
+                client_delta = self._filter_webhooks_status(delta, lanes, fields)
+                if client_delta:
+                    client.send(dict(template, params={"eventtime": eventtime, "version": version,
+                                                       "status": client_delta}))
+        return eventtime + self.STATUS_PUSH_INTERVAL
 
-        web_request.send( {"status:" : {"AFC": str}})
+    def _webhooks_timeline(self, web_request):
+        """
+        Webhooks callback for <ip_address>/printer/afc/timeline, returns toolchange phase spans and a per phase
+        summary. Optional `phase` argument only returns spans for that phase.
+        """
+        phase = web_request.get_str("phase", None)
+        web_request.send({"spans": self.afcDeltaTime.get_spans(phase),
+                          "summary": self.afcDeltaTime.get_summary()})
 
     cmd_AFC_STATUS_help = "Return current status of AFC"
     def cmd_AFC_STATUS(self, gcmd):
@@ -1853,8 +2627,127 @@ class afc:
         """
         short = bool(gcmd.get_int("SHORT", self.short_stats))
 
+        if self.afc_stats is None:
+            self.logger.info("AFC stats are not available until moonraker is connected")
+            return
         self.afc_stats.print_stats(afc_obj=self, short=short)
 
+    cmd_AFC_TIMELINE_help = "Prints p50/p95/max time for each toolchange phase to console"
+    cmd_AFC_TIMELINE_options = {"RESET": {"type": "int", "default": 0}}
+    def cmd_AFC_TIMELINE(self, gcmd):
+        """
+        This macro prints a summary of time spent in each toolchange phase, based on spans recorded for the last
+        `timeline_size` phases. Full list of spans can be retrieved from the `printer/afc/timeline` endpoint.
+
+        Optional Values
+        ----
+        Set RESET=1 to clear recorded spans after printing summary.
+
+        Usage
+        -----
+        `AFC_TIMELINE RESET=<1|0>`
+
+        Example
+        -----
+        ```
+        AFC_TIMELINE
+        ```
+        """
+        summary = self.afcDeltaTime.get_summary()
+        if not summary:
+            self.logger.info("No toolchange phases recorded yet")
+            return
+
+        msg  = "{:<18}{:>7}{:>9}{:>9}{:>9}\n".format("Phase", "Count", "p50", "p95", "Max")
+        for phase, values in sorted(summary.items(), key=lambda item: item[1]["p50"], reverse=True):
+            msg += "{:<18}{:>7}{:>8.2f}s{:>8.2f}s{:>8.2f}s\n".format(phase, values["count"], values["p50"],
+                                                                    values["p95"], values["max"])
+        self.logger.raw(msg)
+
+        if gcmd.get_int("RESET", 0):
+            self.afcDeltaTime.spans.clear()
+
+    cmd_AFC_MOVE_CHUNKS_help = "Prints current move chunk size and how often each chunk size was used for each lane"
+    def cmd_AFC_MOVE_CHUNKS(self, gcmd):
+        """
+        This macro prints the chunk size each lane currently splits long moves into and how many chunks were moved
+        with each size. Chunk size is lowered when the host falls behind generating steps and raised again once it
+        keeps up, `max_move_dis` is the largest chunk size used.
+
+        Usage
+        -----
+        `AFC_MOVE_CHUNKS`
+
+        Example
+        -----
+        ```
+        AFC_MOVE_CHUNKS
+        ```
+        """
+        msg = ""
+        for lane in self.lanes.values():
+            chunk, counts = lane.get_move_chunk_counts()
+            used = ", ".join("{:g}mm: {}".format(size, count) for size, count in sorted(counts.items()))
+            msg += "{}: current {:g}mm{}\n".format(lane.name, chunk, " ({})".format(used) if used else "")
+        self.logger.raw(msg if msg else "No lanes configured")
+
+    cmd_AFC_MOONRAKER_LATENCY_help = "Prints latency histogram of requests AFC sent to moonraker for each endpoint"
+    def cmd_AFC_MOONRAKER_LATENCY(self, gcmd):
+        """
+        This macro prints how long requests AFC sent to moonraker took, grouped by endpoint. Each line shows number
+        of requests, average and max time and how many requests finished within each time bucket.
+
+        Usage
+        -----
+        `AFC_MOONRAKER_LATENCY`
+
+        Example
+        -----
+        ```
+        AFC_MOONRAKER_LATENCY
+        ```
+        """
+        if self.moonraker is None:
+            self.logger.info("Not connected to moonraker")
+            return
+        latency = self.moonraker.get_latency()
+        if not latency:
+            self.logger.info("No requests sent to moonraker yet")
+            return
+
+        bounds = ["<={:g}ms".format(bound * 1000) for bound in self.moonraker.pool.LATENCY_BUCKETS] + ["slower"]
+        msg = ""
+        for endpoint, stats in sorted(latency.items()):
+            buckets = ", ".join("{}: {}".format(bound, count) for bound, count in zip(bounds, stats["buckets"]) if count)
+            msg += "{}: {} requests, avg {:.1f}ms, max {:.1f}ms ({})\n".format(endpoint, stats["count"],
+                                                                              stats["total"] / stats["count"] * 1000,
+                                                                              stats["max"] * 1000, buckets)
+        msg += "Reconnects: {}".format(self.moonraker.pool.reconnects)
+        self.logger.raw(msg)
+
+    cmd_AFC_CURRENT_CHANGES_help = "Prints how many TMC current changes were sent and skipped for each lane"
+    def cmd_AFC_CURRENT_CHANGES(self, gcmd):
+        """
+        This macro prints how many times each lane changed TMC current between print and load current, and how
+        many requested changes were skipped because driver was already at requested current or request was
+        replaced before it was sent. Only lanes with `print_current` set change current.
+
+        Usage
+        -----
+        `AFC_CURRENT_CHANGES`
+
+        Example
+        -----
+        ```
+        AFC_CURRENT_CHANGES
+        ```
+        """
+        msg = ""
+        for lane in self.lanes.values():
+            changes, elided = lane.get_current_change_counts()
+            msg += "{}: {} sent, {} skipped\n".format(lane.name, changes, elided)
+        self.logger.raw(msg if msg else "No lanes configured")
+
     cmd_AFC_CHANGE_BLADE_help = "Sets cutter blade changed date and resets total count since blade was changed"
     def cmd_AFC_CHANGE_BLADE(self, gcmd):
         """
@@ -1871,6 +2764,9 @@ class afc:
         AFC_CHANGE_BLADE
         ```
         """
+        if self.afc_stats is None:
+            self.logger.info("AFC stats are not available until moonraker is connected")
+            return
         self.afc_stats.last_blade_changed.set_current_time()
         self.afc_stats.cut_total_since_changed.reset_count()
         self.logger.info("Cutter blade stats reset")
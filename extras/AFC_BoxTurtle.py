@@ -134,18 +134,19 @@ class afcBoxTurtle(afcUnit):
         bow_pos = 0
         if cur_extruder.tool_start:
             # if tool_start is defined move and confirm distance
-            while not cur_lane.get_toolhead_pre_sensor_state():
-                fault_dis = cur_hub.afc_bowden_length + 500
-                cur_lane.move(dis, self.short_moves_speed, self.short_moves_accel)
-                bow_pos += dis
-                self.afc.reactor.pause(self.afc.reactor.monotonic() + 0.1)
-                if bow_pos >= fault_dis:
-                    # fault if move to bowden length does not reach toolhead sensor return to calibration macro
-                    msg = 'while moving to toolhead. Failed after {}mm'.format(bow_pos)
-                    msg += '\n if filament stopped short of the toolhead sensor/ramming during calibration'
-                    msg += '\n use the following command to increase bowden length'
-                    msg += '\n SET_BOWDEN_LENGTH HUB={} LENGTH=+(distance the filament was short from the toolhead)'.format(cur_hub.name)
-                    return False, msg, bow_pos
+            with cur_lane.manual_move_session():
+                while not cur_lane.get_toolhead_pre_sensor_state():
+                    fault_dis = cur_hub.afc_bowden_length + 500
+                    cur_lane.move(dis, self.short_moves_speed, self.short_moves_accel)
+                    bow_pos += dis
+                    self.afc.reactor.pause(self.afc.reactor.monotonic() + 0.1)
+                    if bow_pos >= fault_dis:
+                        # fault if move to bowden length does not reach toolhead sensor return to calibration macro
+                        msg = 'while moving to toolhead. Failed after {}mm'.format(bow_pos)
+                        msg += '\n if filament stopped short of the toolhead sensor/ramming during calibration'
+                        msg += '\n use the following command to increase bowden length'
+                        msg += '\n SET_BOWDEN_LENGTH HUB={} LENGTH=+(distance the filament was short from the toolhead)'.format(cur_hub.name)
+                        return False, msg, bow_pos
 
             if cur_extruder.tool_start != 'buffer':
                 # is using ramming, only use first trigger of sensor
@@ -180,6 +181,7 @@ class afcBoxTurtle(afcUnit):
             unload_cal_msg = '\n afc_unload_bowden_length: New: {} Old: {}'.format(unload_dist, cur_lane.hub_obj.afc_unload_bowden_length)
             cur_lane.hub_obj.afc_bowden_length = bowden_dist
             cur_lane.hub_obj.afc_unload_bowden_length = unload_dist
+            cur_lane.hub_obj.clear_learned_bowden_length()
 
             if bowden_dist < 0:
                 self.afc.error.AFC_error(
@@ -300,66 +302,68 @@ class afcBoxTurtle(afcUnit):
 
     def move_until_state(self, cur_lane, state, move_dis, tolerance, short_move, pos=0, fault_dis=250, checkpoint=None):
         # moves filament until specified sensor, returns values for further calibration
-        while not state():
-            cur_lane.move(move_dis, cur_lane.short_moves_speed, cur_lane.short_moves_accel)
-            pos += move_dis
-            if pos >= fault_dis:
-                # return if pos exceeds fault_dis
-                return fault_dis, checkpoint, False
-        self.afc.reactor.pause(self.afc.reactor.monotonic() + 0.1)
-
-        state_retracts = 0
-        while state():
-            # retract off of sensor
-            state_retracts =+ 1
-            cur_lane.move(short_move * -1, cur_lane.short_moves_speed, cur_lane.short_moves_accel, True)
-            pos -= short_move
-            check_p = '{} switch did not go false, reset lane and check switch'.format(checkpoint)
-            if state_retracts >= 4:
-                # fault if it takes more than 4 attempts
-                f_dis = short_move * 4
-                return f_dis, check_p, False
-        self.afc.reactor.pause(self.afc.reactor.monotonic() + 0.1)
-
-        tol_checks = 0
-        while not state():
-            # move back to sensor in short steps
-            tol_checks += 1
-            cur_lane.move(tolerance, cur_lane.short_moves_speed, cur_lane.short_moves_accel)
-            pos += tolerance
-            check_p = '{} switch failed to become true during tolerance check, reset lane and check switch'.format(checkpoint)
-            if tol_checks >= 15:
-                # fault if tol_checks exceed 15
-                return fault_dis, check_p, False
-
-        return pos, checkpoint, True
+        with cur_lane.manual_move_session():
+            while not state():
+                cur_lane.move(move_dis, cur_lane.short_moves_speed, cur_lane.short_moves_accel)
+                pos += move_dis
+                if pos >= fault_dis:
+                    # return if pos exceeds fault_dis
+                    return fault_dis, checkpoint, False
+            self.afc.reactor.pause(self.afc.reactor.monotonic() + 0.1)
+
+            state_retracts = 0
+            while state():
+                # retract off of sensor
+                state_retracts =+ 1
+                cur_lane.move(short_move * -1, cur_lane.short_moves_speed, cur_lane.short_moves_accel, True)
+                pos -= short_move
+                check_p = '{} switch did not go false, reset lane and check switch'.format(checkpoint)
+                if state_retracts >= 4:
+                    # fault if it takes more than 4 attempts
+                    f_dis = short_move * 4
+                    return f_dis, check_p, False
+            self.afc.reactor.pause(self.afc.reactor.monotonic() + 0.1)
+
+            tol_checks = 0
+            while not state():
+                # move back to sensor in short steps
+                tol_checks += 1
+                cur_lane.move(tolerance, cur_lane.short_moves_speed, cur_lane.short_moves_accel)
+                pos += tolerance
+                check_p = '{} switch failed to become true during tolerance check, reset lane and check switch'.format(checkpoint)
+                if tol_checks >= 15:
+                    # fault if tol_checks exceed 15
+                    return fault_dis, check_p, False
+
+            return pos, checkpoint, True
 
     def calc_position(self, cur_lane, state, pos, short_move, tolerance, fault_dis=250, checkpoint=None):
         # move off and back on to sensor to calculate end position of calibration
-        check_pos = 0
-        while state():
-            # retract from sensor
-            cur_lane.move(short_move * -1, cur_lane.short_moves_speed, cur_lane.short_moves_accel, True)
-            pos -= short_move
-            check_pos -= short_move
-            if abs(check_pos) >= fault_dis:
-                # fault if absolute value you check_pos exceeds fault_dis
-                return fault_dis, checkpoint, False
-        self.afc.reactor.pause(self.afc.reactor.monotonic() + 0.1)
-
-        checkpoint += ', tolerance check,'
-        tol_checks = 0
-        while not state():
-            #move back to sensor to confirm distance
-            tol_checks += 1
-            cur_lane.move(tolerance, cur_lane.short_moves_speed, cur_lane.short_moves_accel)
-            pos += tolerance
-
-            if tol_checks >= 15:
-                # fault if tol_checks exceeds 15
-                return pos, checkpoint, False
-
-        return pos, checkpoint, True
+        with cur_lane.manual_move_session():
+            check_pos = 0
+            while state():
+                # retract from sensor
+                cur_lane.move(short_move * -1, cur_lane.short_moves_speed, cur_lane.short_moves_accel, True)
+                pos -= short_move
+                check_pos -= short_move
+                if abs(check_pos) >= fault_dis:
+                    # fault if absolute value you check_pos exceeds fault_dis
+                    return fault_dis, checkpoint, False
+            self.afc.reactor.pause(self.afc.reactor.monotonic() + 0.1)
+
+            checkpoint += ', tolerance check,'
+            tol_checks = 0
+            while not state():
+                #move back to sensor to confirm distance
+                tol_checks += 1
+                cur_lane.move(tolerance, cur_lane.short_moves_speed, cur_lane.short_moves_accel)
+                pos += tolerance
+
+                if tol_checks >= 15:
+                    # fault if tol_checks exceeds 15
+                    return pos, checkpoint, False
+
+            return pos, checkpoint, True
 
     def calibrate_lane(self, cur_lane, tol):
         # function to calibrate distance from secondary extruder to hub
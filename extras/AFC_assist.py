@@ -115,8 +115,10 @@ class AFCEspoolerStats:
     def __init__(self, espooler_name:str, espooler_obj:object):
         self.espooler_name = espooler_name
         self.espooler_obj = espooler_obj
-        self._n20_runtime_fwd   = 0
-        self._n20_runtime_rwd   = 0
+        self._n20_runtime_fwd   = None  # Created once moonraker connects
+        self._n20_runtime_rwd   = None
+        self._unsaved_fwd       = 0.    # Runtime accumulated before moonraker connected
+        self._unsaved_rwd       = 0.
         self._fwd_updated       = False
         self._rwd_updated       = False
         self._direction         = None
@@ -140,6 +142,15 @@ class AFCEspoolerStats:
         self._n20_runtime_fwd   = AFCStats_var(self.espooler_name, "n20_runtime_fwd", values, self.espooler_obj.afc.moonraker)
         self._n20_runtime_rwd   = AFCStats_var(self.espooler_name, "n20_runtime_rwd", values, self.espooler_obj.afc.moonraker)
 
+        # Add runtime from before moonraker connected, this happens when PREP started from saved spoolman data
+        if self._unsaved_fwd > 0:
+            self._n20_runtime_fwd.value += self._unsaved_fwd
+            self._fwd_updated = True
+        if self._unsaved_rwd > 0:
+            self._n20_runtime_rwd.value += self._unsaved_rwd
+            self._rwd_updated = True
+        self._unsaved_fwd = self._unsaved_rwd = 0.
+
 
     def _convert_value(self, value:int) -> tuple[int, str]:
         """
@@ -161,11 +172,13 @@ class AFCEspoolerStats:
 
     @property
     def n20_runtime_fwd(self):
-        val, unit = self._convert_value(self._n20_runtime_fwd.value)
+        val, unit = self._convert_value(self._n20_runtime_fwd.value if self._n20_runtime_fwd is not None
+                                        else self._unsaved_fwd)
         return f"{val:.2f}{unit}"
     @property
     def n20_runtime_rwd(self):
-        val, unit = self._convert_value(self._n20_runtime_rwd.value)
+        val, unit = self._convert_value(self._n20_runtime_rwd.value if self._n20_runtime_rwd is not None
+                                        else self._unsaved_rwd)
         return f"{val:.2f}{unit}"
 
     @property
@@ -218,10 +231,16 @@ class AFCEspoolerStats:
             self._delta = self._direction_end - self._direction_start
 
             if self._direction == EspoolerDir.FWD:
-                self._n20_runtime_fwd.value += self._delta
+                if self._n20_runtime_fwd is None:
+                    self._unsaved_fwd += self._delta
+                else:
+                    self._n20_runtime_fwd.value += self._delta
                 self._fwd_updated      = True
             else:
-                self._n20_runtime_rwd.value += self._delta
+                if self._n20_runtime_rwd is None:
+                    self._unsaved_rwd += self._delta
+                else:
+                    self._n20_runtime_rwd.value += self._delta
                 self._rwd_updated      = True
 
         self._direction = self._direction_start = self._direction_end = None
@@ -230,14 +249,19 @@ class AFCEspoolerStats:
         """
         Helper function for resetting FWD/RWD active runtime
         """
-        self._n20_runtime_fwd.reset_count()
-        self._n20_runtime_rwd.reset_count()
+        self._unsaved_fwd = self._unsaved_rwd = 0.
+        if self._n20_runtime_fwd is not None:
+            self._n20_runtime_fwd.reset_count()
+            self._n20_runtime_rwd.reset_count()
 
     def update_database(self):
         """
         Updates database for both forward and reverse directions if updated flag
-        is set
+        is set. Nothing is sent until moonraker connects, flags stay set so runtime is sent then.
         """
+        if self._n20_runtime_fwd is None:
+            return
+
         if self._fwd_updated:
             self._n20_runtime_fwd.update_database()
             self._fwd_updated = False
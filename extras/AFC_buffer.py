@@ -24,6 +24,8 @@ class AFCTrigger:
 
         self.name       = config.get_name().split(' ')[-1]
         self.lanes      = {}
+        self.response   = {}
+        self.status_key = None                  # Values used to build response, used to check if response needs to be rebuilt
         self.last_state = "Unknown"
         self.enable     = False
         self.current    = ''
@@ -304,6 +306,12 @@ class AFCTrigger:
         self.disable_buffer()
 
     def get_status(self, eventtime=None):
+        # Only rebuild response when a value in it has changed
+        status_key = (self.last_state, self.enable, len(self.lanes))
+        if status_key == self.status_key:
+            return self.response
+        self.status_key = status_key
+
         self.response = {}
         self.response['state'] = self.last_state
         self.response['lanes'] = [lane.name for lane in self.lanes.values()]
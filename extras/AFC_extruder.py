@@ -39,6 +39,8 @@ class AFCExtruder:
 
         self.lane_loaded                = None
         self.lanes                      = {}
+        self.response                   = {}
+        self.status_key                 = None  # Values used to build response, used to check if response needs to be rebuilt
 
         self.tool_start_state = False
         if self.tool_start is not None:
@@ -259,6 +261,14 @@ class AFCExtruder:
         self.afc.function.ConfigRewrite(self.fullname, 'tool_sensor_after_extruder', self.tool_sensor_after_extruder, '')
 
     def get_status(self, eventtime=None):
+        # Only rebuild response when a value in it has changed
+        status_key = (self.tool_stn, self.tool_stn_unload, self.tool_sensor_after_extruder, self.tool_unload_speed,
+                      self.tool_load_speed, self.buffer_name, self.lane_loaded, self.tool_start_state,
+                      self.tool_end_state, len(self.lanes))
+        if status_key == self.status_key:
+            return self.response
+        self.status_key = status_key
+
         self.response = {}
         self.response['tool_stn'] = self.tool_stn
         self.response['tool_stn_unload'] = self.tool_stn_unload
@@ -9,15 +9,19 @@
 #
 # Full license text available at: https://www.gnu.org/licenses/gpl-3.0.html
 
+import math
 import os
 import random
 import re
 import traceback
 import configparser
 
+from collections import deque
 from configfile import error
+from contextlib import nullcontext
 from datetime import datetime
 from pathlib import Path
+from extras.force_move import calc_move_time
 
 try: from extras.AFC_utils import ERROR_STR
 except: raise error("Error when trying to import AFC_utils.ERROR_STR\n{trace}".format(trace=traceback.format_exc()))
@@ -25,6 +29,12 @@ except: raise error("Error when trying to import AFC_utils.ERROR_STR\n{trace}".f
 try: from extras.AFC_respond import AFCprompt
 except: raise error(ERROR_STR.format(import_lib="AFC_respond", trace=traceback.format_exc()))
 
+try: from extras.AFC_lane import AFCLaneState, SpeedMode, AssistActive
+except: raise error(ERROR_STR.format(import_lib="AFC_lane", trace=traceback.format_exc()))
+
+try: from extras.AFC_stepper import calc_profile_moves
+except: raise error(ERROR_STR.format(import_lib="AFC_stepper", trace=traceback.format_exc()))
+
 def load_config(config):
     return afcFunction(config)
 
@@ -51,6 +61,8 @@ class afcFunction:
                                self.cmd_AFC_LANE_RESET_help, self.cmd_AFC_LANE_RESET_options)
         self.register_commands(self.show_macros, 'AFC_TEST_LANES', self.cmd_AFC_TEST_LANES,
                                self.cmd_AFC_TEST_LANES_help)
+        self.register_commands(self.show_macros, 'AFC_ESTIMATE_CHANGE', self.cmd_AFC_ESTIMATE_CHANGE,
+                               self.cmd_AFC_ESTIMATE_CHANGE_help, self.cmd_AFC_ESTIMATE_CHANGE_options)
         # Always adding this so it will show up as a button in guis
         self.register_commands(self.show_macros, 'AFC_GET_TD_ONE_DATA', self.cmd_AFC_GET_TD_ONE_DATA,   self.cmd_AFC_GET_TD_ONE_DATA_help)
 
@@ -63,6 +75,7 @@ class afcFunction:
         """
         self.afc.gcode.register_mux_command('TEST', "LANE", lane_obj.name, self.cmd_TEST, desc=self.cmd_TEST_help)
         self.afc.gcode.register_mux_command('HUB_CUT_TEST', "LANE", lane_obj.name, self.cmd_HUB_CUT_TEST, desc=self.cmd_HUB_CUT_TEST_help)
+        self.afc.gcode.register_mux_command('AFC_TUNE_SPEED', "LANE", lane_obj.name, self.cmd_AFC_TUNE_SPEED, desc=self.cmd_AFC_TUNE_SPEED_help)
 
     def register_hub_macros(self, hub_obj):
         """
@@ -341,6 +354,32 @@ class afcFunction:
             curr_lane_obj = self.afc.lanes[curr_lane]
         return curr_lane_obj
 
+    def move_lanes(self, moves):
+        """
+        Moves several lanes at the same time. Moves are queued on each lanes own trapq with a common start time
+        so all lanes start together, and function returns once the longest move has finished instead of after
+        the sum of all moves. Lanes that cannot queue moves (synced to an extruder, in a manual move session or
+        sharing a drive stepper) are moved one after another once the other lanes have been started. When all
+        moves are for one lane they are done as normal blocking moves.
+
+        :param moves: List of (lane, distance, speed_mode, assist_active) tuples, a lane can be listed more than
+                      once to chain several moves for that lane
+        """
+        if len({lane.name for lane, *_ in moves}) <= 1:
+            for lane, distance, speed_mode, assist_active in moves:
+                lane.move_advanced(distance, speed_mode, assist_active)
+            return
+
+        start_times = {lane.name: lane.get_queue_start_time() for lane, *_ in moves}
+        start_time  = max((t for t in start_times.values() if t is not None), default=None)
+
+        # Start lanes that queue moves first so blocking moves do not delay them
+        moves = sorted(moves, key=lambda move: start_times[move[0].name] is None)
+        completions = [lane.move_advanced_async(distance, speed_mode, assist_active, start_time)
+                       for lane, distance, speed_mode, assist_active in moves]
+        for completion in completions:
+            completion.wait()
+
     def verify_led_object(self, led_name):
         """
         Helper function to lookup AFC_led object.
@@ -1215,6 +1254,19 @@ class afcFunction:
                 button_style = "primary" if index % 2 == 0 else "secondary"
                 buttons.append((button_label, button_command, button_style))
 
+        # Lanes that are in their hub can all be reset at the same time, only offered for hubs where it is clear
+        # which lane is in the hub since a hub sensor cannot tell lanes apart
+        in_hub = {}
+        for LANE in self.afc.lanes.values():
+            if LANE.load_state and LANE.hub_obj.state and not LANE.loaded_to_hub and LANE.name != self.afc.current:
+                in_hub.setdefault(LANE.hub_obj.name, []).append(LANE.name)
+        in_hub = [names[0] for names in in_hub.values() if len(names) == 1]
+        if len(in_hub) > 1:
+            button_command = "AFC_LANE_RESET LANE={}".format(",".join(in_hub))
+            if dis is not None:
+                button_command += " DISTANCE={}".format(dis)
+            buttons.append(("Reset all", button_command, "warning"))
+
         total_buttons = sum(len(group) for group in buttons)
         if total_buttons == 0:
             text = 'No lanes are loaded, a lane must be loaded to be reset'
@@ -1231,6 +1283,10 @@ class afcFunction:
         such as whether the toolhead is loaded or whether the hub is already clear. The function moves the lane back to the
         hub based on the specified or default distances, ensuring the lane's correct state before completing the reset.
 
+        Several lanes can be reset at once by separating lane names with commas, lanes are moved at the same time. When
+        resetting several lanes, lanes whose hub is already clear are skipped and lanes that share a hub cannot be reset
+        together.
+
         Usage
         -----
         `AFC_LANE_RESET LANE=<lane> DISTANCE=<distance>`
@@ -1245,6 +1301,10 @@ class afcFunction:
         ```
         AFC_LANE_RESET LANE=lane2
         ```
+        (Resets lane1 and lane5 to their hubs at the same time)
+        ```
+        AFC_LANE_RESET LANE=lane1,lane5
+        ```
         """
 
         prompt = AFCprompt(gcmd, self.logger)
@@ -1256,10 +1316,12 @@ class afcFunction:
             self.afc.error.AFC_error("No lane selected to reset, please provide a lane to reset.", pause=False)
             return
 
-        if lane not in self.afc.lanes:
-            prompt.p_end()
-            self.afc.error.AFC_error("'{}' is not a valid lane".format(lane), pause=False)
-            return
+        lane_names = [name.strip() for name in lane.split(',') if name.strip()]
+        for name in lane_names:
+            if name not in self.afc.lanes:
+                prompt.p_end()
+                self.afc.error.AFC_error("'{}' is not a valid lane".format(name), pause=False)
+                return
 
         if long_dis is not None:
             try:
@@ -1271,46 +1333,70 @@ class afcFunction:
                 self.afc.error.AFC_error("DISTANCE must be a valid number.", pause=False)
                 return
 
-        cur_lane = self.afc.lanes[lane]
-        CUR_HUB = cur_lane.hub_obj
-        short_move = cur_lane.short_move_dis * 2
+        lanes = [self.afc.lanes[name] for name in lane_names]
+        if len(lanes) == 1:
+            if not lanes[0].hub_obj.state:
+                prompt.p_end()
+                self.afc.error.AFC_error("Hub is already clear while trying to reset '{}'".format(lanes[0].name), pause=False)
+                return
+        else:
+            for cur_lane in [cur_lane for cur_lane in lanes if not cur_lane.hub_obj.state]:
+                self.logger.info("Hub is already clear for '{}', skipping reset".format(cur_lane.name))
+                lanes.remove(cur_lane)
+            if not lanes:
+                prompt.p_end()
+                return
 
-        if not CUR_HUB.state:
-            prompt.p_end()
-            self.afc.error.AFC_error("Hub is already clear while trying to reset '{}'".format(lane), pause=False)
-            return
+            # Hub sensor cannot tell lanes apart, so lanes sharing a hub would keep moving until all are clear
+            hubs = {}
+            for cur_lane in lanes:
+                hubs.setdefault(cur_lane.hub_obj.name, []).append(cur_lane.name)
+            for hub_name, names in hubs.items():
+                if len(names) > 1:
+                    prompt.p_end()
+                    self.afc.error.AFC_error("Cannot reset {} at the same time since they share hub '{}', reset them "
+                                             "one at a time".format(", ".join(names), hub_name), pause=False)
+                    return
 
         if (tool_load := self.get_current_lane_obj()) is not None:
             prompt.p_end()
             self.afc.error.AFC_error("Toolhead is loaded with '{}', unload or check sensor before resetting lane".format(tool_load.name), pause=False)
 
         prompt.p_end()
-        self.afc.gcode.respond_info('Resetting {} to hub'.format(lane))
-        pos = 0
+        self.afc.gcode.respond_info('Resetting {} to hub'.format(", ".join(cur_lane.name for cur_lane in lanes)))
+        pos = {cur_lane.name: 0 for cur_lane in lanes}
         fail_state_msg = "'{}' failed to reset to hub, {} switch became false during reset"
 
-        if long_dis is not None:
-            cur_lane.move(float(long_dis) * -1, cur_lane.long_moves_speed, cur_lane.long_moves_accel, True)
+        with lanes[0].manual_move_session() if len(lanes) == 1 else nullcontext():
+            if long_dis is not None:
+                self.move_lanes([(cur_lane, float(long_dis) * -1, SpeedMode.LONG, AssistActive.YES) for cur_lane in lanes])
 
-        while CUR_HUB.state:
-            cur_lane.move(short_move * -1, cur_lane.short_moves_speed, cur_lane.short_moves_accel, True)
-            pos -= short_move
+            while resetting := [cur_lane for cur_lane in lanes if cur_lane.hub_obj.state]:
+                self.move_lanes([(cur_lane, cur_lane.short_move_dis * -2, SpeedMode.SHORT, AssistActive.YES)
+                                 for cur_lane in resetting])
 
-            if not cur_lane.load_state:
-                self.afc.error.AFC_error(fail_state_msg.format(cur_lane, "load"), pause=False)
-                return
+                for cur_lane in resetting:
+                    pos[cur_lane.name] -= cur_lane.short_move_dis * 2
 
-            if not cur_lane.prep_state:
-                self.afc.error.AFC_error(fail_state_msg.format(cur_lane, "prep"), pause=False)
-                return
+                    if not cur_lane.load_state:
+                        self.afc.error.AFC_error(fail_state_msg.format(cur_lane, "load"), pause=False)
+                        return
 
-            if abs(pos) >= CUR_HUB.afc_bowden_length:
-                self.afc.error.AFC_error("'{}' failed to reset to hub".format(cur_lane), pause=False)
-                return
+                    if not cur_lane.prep_state:
+                        self.afc.error.AFC_error(fail_state_msg.format(cur_lane, "prep"), pause=False)
+                        return
 
-        cur_lane.move(CUR_HUB.move_dis * -1, cur_lane.short_moves_speed, cur_lane.short_moves_accel, True)
-        cur_lane.loaded_to_hub = True
-        cur_lane.do_enable(False)
+                    if abs(pos[cur_lane.name]) >= cur_lane.hub_obj.afc_bowden_length:
+                        self.afc.error.AFC_error("'{}' failed to reset to hub".format(cur_lane), pause=False)
+                        return
+
+            self.move_lanes([(cur_lane, cur_lane.hub_obj.move_dis * -1, SpeedMode.SHORT, AssistActive.YES)
+                             for cur_lane in lanes])
+        for cur_lane in lanes:
+            cur_lane.loaded_to_hub = True
+            cur_lane.prestaged_dist = 0
+            cur_lane.prefed_bowden = 0
+            cur_lane.do_enable(False)
 
         self.afc.gcode.respond_info('{} reset to hub, take necessary action'.format(lane))
 
@@ -1525,6 +1611,7 @@ class afcFunction:
 
         if length_param is not None:
             CUR_HUB.afc_bowden_length = self._calc_length(CUR_HUB.config_bowden_length, cur_bowden_len, length_param)
+            CUR_HUB.clear_learned_bowden_length()
 
         if unload_length is not None:
             CUR_HUB.afc_unload_bowden_length = self._calc_length(CUR_HUB.config_unload_bowden_length, cur_unload_bowden_len, unload_length)
@@ -1568,6 +1655,436 @@ class afcFunction:
         CUR_HUB.hub_cut(cur_lane)
         self.logger.info('Hub cut Done!')
 
+    cmd_AFC_ESTIMATE_CHANGE_help = "Estimates how long a toolchange to a lane takes without moving anything"
+    cmd_AFC_ESTIMATE_CHANGE_options = {"LANE": {"default": "lane1", "type": "string"}}
+    def cmd_AFC_ESTIMATE_CHANGE(self, gcmd):
+        """
+        This function estimates time each phase of a toolchange to a lane takes without moving any hardware. Lane
+        and extruder moves are calculated from configured distances, speeds and accelerations the same way they are
+        split up when moving. Phases that run macros (cut, park, form tip, poop, wipe, kick), heating and restoring
+        position cannot be calculated, so median time recorded in toolchange timeline is used instead when available.
+        Moves that stop on a sensor are estimated from learned bowden length when available.
+
+        By default current loaded lane is unloaded first, FROM can be used to estimate unloading a different lane.
+        LONG_SPEED, LONG_ACCEL, MAX_MOVE_DIS and Z_HOP can be set to compare estimates with different values without
+        changing current values.
+
+        Usage
+        -----
+        `AFC_ESTIMATE_CHANGE LANE=<lane> FROM=<lane> LONG_SPEED=<speed> LONG_ACCEL=<accel> MAX_MOVE_DIS=<distance> Z_HOP=<height>`
+
+        Example
+        -----
+        ```
+        AFC_ESTIMATE_CHANGE LANE=lane2 LONG_SPEED=200
+        ```
+        """
+        lane = gcmd.get('LANE', None)
+        if lane not in self.afc.lanes:
+            self.logger.info('{} Unknown'.format(lane))
+            return
+        from_lane = gcmd.get('FROM', self.afc.current)
+        if from_lane is not None and from_lane not in self.afc.lanes:
+            self.logger.info('{} Unknown'.format(from_lane))
+            return
+        cur_lane = self.afc.lanes[lane]
+
+        settings = {
+            "long_speed":   gcmd.get_float("LONG_SPEED", None, minval=1.),
+            "long_accel":   gcmd.get_float("LONG_ACCEL", None, minval=1.),
+            "max_move_dis": gcmd.get_float("MAX_MOVE_DIS", None, minval=1.),
+            "z_hop":        gcmd.get_float("Z_HOP", self.afc.z_hop, minval=0.)}
+
+        if from_lane == cur_lane.name:
+            self.logger.info("{} already loaded, toolchange would not move anything".format(cur_lane.name))
+            return
+
+        sections = []
+        if from_lane is not None:
+            sections.append(("Unload {}".format(from_lane), self._estimate_tool_unload(self.afc.lanes[from_lane], settings)))
+        load = self._estimate_tool_load(cur_lane, settings)
+        load.append(("restore_pos", *self._estimate_from_timeline("restore_pos")))
+        sections.append(("Load {}".format(cur_lane.name), load))
+
+        total = 0.
+        missing = []
+        msg = ""
+        for title, phases in sections:
+            msg += "{}:\n".format(title)
+            for phase, seconds, source in phases:
+                if seconds is None:
+                    missing.append(phase)
+                    msg += "  {:<18}{:>9}\n".format(phase, "-")
+                    continue
+                total += seconds
+                msg += "  {:<18}{:>8.2f}s  {}\n".format(phase, seconds, source)
+        msg += "Estimated toolchange time: {:.2f}s".format(total)
+        if missing:
+            msg += "\nNot included, no timeline data: {}".format(", ".join(sorted(set(missing))))
+        self.logger.raw(msg)
+
+    def _estimate_lane_move(self, cur_lane, distance, speed_mode, settings, profile=None):
+        """
+        Helper function for AFC_ESTIMATE_CHANGE that calculates time a lane move takes. Moves are split into chunks
+        of lanes current chunk size and reverse moves are slowed by rev_long_moves_speed_factor like lane moves are.
+
+        :param cur_lane: Lane to estimate move for
+        :param distance: Distance to move, negative to retract
+        :param speed_mode: SpeedMode used for move
+        :param settings: Dictionary of values to use instead of configured values
+        :param profile: Optional bowden profile from get_bowden_profile
+        :return float: Time in seconds
+        """
+        if distance == 0:
+            return 0.
+        speed, accel = cur_lane.get_speed_accel(speed_mode)
+        quiet = self.afc._get_quiet_mode()
+        if speed_mode == SpeedMode.LONG and not quiet:
+            if settings["long_speed"] is not None:
+                if profile:
+                    profile = [(dist, settings["long_speed"] if seg_speed == speed else seg_speed) for dist, seg_speed in profile]
+                speed = settings["long_speed"]
+            accel = settings["long_accel"] if settings["long_accel"] is not None else accel
+        factor = cur_lane.rev_long_moves_speed_factor if distance < 0 else 1.
+
+        if profile and not quiet:
+            return sum(accel_t + cruise_t + decel_t for accel_t, cruise_t, decel_t, _, _ in
+                       calc_profile_moves([(abs(dist), seg_speed * factor) for dist, seg_speed in profile], accel))
+
+        chunk = settings["max_move_dis"] if settings["max_move_dis"] is not None else cur_lane.get_move_chunk_counts()[0]
+        full_chunks, remainder = divmod(abs(distance), chunk)
+        total = 0.
+        for move_dist, count in ((chunk, full_chunks), (remainder, 1)):
+            if move_dist > 0 and count > 0:
+                _, accel_t, cruise_t, _ = calc_move_time(move_dist, speed * factor, accel)
+                total += (accel_t * 2 + cruise_t) * count
+        return total
+
+    def _estimate_extruder_move(self, cur_extruder, distance, speed):
+        """
+        Helper function for AFC_ESTIMATE_CHANGE that calculates time an extrude only move takes, speed and
+        acceleration are limited by extruders max_extrude_only values
+
+        :return float: Time in seconds
+        """
+        if distance == 0:
+            return 0.
+        extruder = self.printer.lookup_object(cur_extruder.name, None)
+        speed = min(speed, getattr(extruder, "max_e_velocity", speed))
+        accel = getattr(extruder, "max_e_accel", self.afc.toolhead.max_accel)
+        _, accel_t, cruise_t, _ = calc_move_time(abs(distance), speed, accel)
+        return accel_t * 2 + cruise_t
+
+    def _estimate_from_timeline(self, phase):
+        """
+        Helper function for AFC_ESTIMATE_CHANGE that returns median recorded time for a phase
+
+        :return (float, str): Time in seconds or None if phase has not been recorded, source of estimate
+        """
+        summary = self.afc.afcDeltaTime.get_summary().get(phase)
+        if summary is None:
+            return None, "timeline"
+        return summary["p50"], "timeline p50 of {}".format(summary["count"])
+
+    def _estimate_tool_unload(self, cur_lane, settings):
+        """
+        Helper function for AFC_ESTIMATE_CHANGE that estimates phases of TOOL_UNLOAD
+
+        :return list: List of (phase, seconds, source) tuples, seconds is None when phase could not be estimated
+        """
+        cur_hub         = cur_lane.hub_obj
+        cur_extruder    = cur_lane.extruder_obj
+        unload_speed    = cur_extruder.tool_unload_speed
+        phases = [("heat", *self._estimate_from_timeline("heat")),
+                  ("quick_pull", self._estimate_extruder_move(cur_extruder, 2, unload_speed), "calc")]
+
+        if settings["z_hop"] > 0:
+            kin = self.afc.toolhead.get_kinematics()
+            z_accel = getattr(kin, "max_z_accel", self.afc.toolhead.max_accel)
+            _, accel_t, cruise_t, _ = calc_move_time(settings["z_hop"], self.afc._get_resume_speedz(), z_accel)
+            phases.append(("z_hop", accel_t * 2 + cruise_t, "calc"))
+
+        if self.afc.tool_cut:
+            phases.append(("cut", *self._estimate_from_timeline("cut")))
+            if self.afc.park:
+                phases.append(("park", *self._estimate_from_timeline("park")))
+        if self.afc.form_tip:
+            if self.afc.park:
+                phases.append(("park", *self._estimate_from_timeline("park")))
+            phases.append(("form_tip", *self._estimate_from_timeline("form_tip")))
+
+        if cur_extruder.tool_stn_unload > 0:
+            phases.append(("unload_to_sensor", self._estimate_extruder_move(cur_extruder, cur_extruder.tool_stn_unload,
+                                                                            unload_speed), "calc"))
+        if cur_extruder.tool_sensor_after_extruder > 0:
+            phases.append(("after_extruder", self._estimate_extruder_move(cur_extruder, cur_extruder.tool_sensor_after_extruder,
+                                                                          unload_speed), "calc"))
+
+        if cur_lane.hub != 'direct':
+            phases.append(("long_retract", self._estimate_lane_move(cur_lane, cur_hub.afc_unload_bowden_length * -1,
+                                                                    SpeedMode.LONG, settings), "calc"))
+            phases.append(("hub_clear", self._estimate_lane_move(cur_lane, cur_hub.hub_clear_move_dis * -1,
+                                                                 SpeedMode.SHORT, settings), "calc"))
+            if cur_hub.cut:
+                phases.append(("hub_cut", *self._estimate_from_timeline("hub_cut")))
+        else:
+            phases.append(("long_retract", self._estimate_lane_move(cur_lane, cur_lane.dist_hub * -1,
+                                                                    SpeedMode.HUB, settings), "calc"))
+        return phases
+
+    def _estimate_tool_load(self, cur_lane, settings):
+        """
+        Helper function for AFC_ESTIMATE_CHANGE that estimates phases of TOOL_LOAD. Hub move runs while extruder
+        heats, so only time hub move takes longer than recorded heating time is counted.
+
+        :return list: List of (phase, seconds, source) tuples, seconds is None when phase could not be estimated
+        """
+        cur_hub         = cur_lane.hub_obj
+        cur_extruder    = cur_lane.extruder_obj
+        heat, heat_source = self._estimate_from_timeline("heat")
+        phases = [("heat", heat, heat_source)]
+
+        if not cur_lane.loaded_to_hub or cur_lane.hub == 'direct':
+            hub_time = self._estimate_lane_move(cur_lane, max(cur_lane.dist_hub - cur_lane.prestaged_dist, 0),
+                                                SpeedMode.HUB, settings)
+            if heat is not None and not self.afc.heat_during_transport:
+                hub_time = max(hub_time - heat, 0.)
+            phases.append(("hub_load", hub_time, "calc"))
+
+        learned_length = None
+        if cur_lane.hub != 'direct':
+            if self.afc.learn_bowden_length and cur_extruder.tool_start:
+                learned_length = cur_lane.get_learned_bowden_length()
+            if learned_length is not None:
+                bowden_move = max(learned_length - self.afc.learned_bowden_margin, 0)
+            else:
+                bowden_move = cur_hub.afc_bowden_length
+            bowden_distance = max(bowden_move - cur_lane.prefed_bowden, 0)
+            phases.append(("bowden", self._estimate_lane_move(cur_lane, bowden_distance, SpeedMode.LONG, settings,
+                                                              cur_lane.get_bowden_profile(bowden_distance)), "calc"))
+
+        if cur_extruder.tool_start and learned_length is not None:
+            _, accel_t, cruise_t, _ = calc_move_time(self.afc.learned_bowden_margin, cur_extruder.tool_load_speed,
+                                                     cur_lane.long_moves_accel)
+            phases.append(("tool_sensor", accel_t * 2 + cruise_t, "calc, learned bowden length"))
+
+        if cur_extruder.tool_end:
+            phases.append(("tool_end_sensor", self._estimate_extruder_move(cur_extruder, cur_lane.short_move_dis,
+                                                                           cur_extruder.tool_load_speed), "calc"))
+        phases.append(("tool_stn", self._estimate_extruder_move(cur_extruder, cur_extruder.tool_stn,
+                                                                cur_extruder.tool_load_speed), "calc"))
+
+        if self.afc.poop:
+            phases.append(("poop", *self._estimate_from_timeline("poop")))
+            if self.afc.wipe:
+                phases.append(("wipe", *self._estimate_from_timeline("wipe")))
+        if self.afc.kick:
+            phases.append(("kick", *self._estimate_from_timeline("kick")))
+        if self.afc.wipe:
+            phases.append(("wipe", *self._estimate_from_timeline("wipe")))
+        return phases
+
+    cmd_AFC_TUNE_SPEED_help = "Finds fastest reliable long move speed and reverse speed factor for a lane, expects LANE=laneN"
+    def cmd_AFC_TUNE_SPEED(self, gcmd):
+        """
+        This function sweeps long move speed and acceleration upward for a lane by moving filament from its hub to the
+        toolhead sensor and back. Each move stops `learned_bowden_margin` short of where the toolhead sensor triggered
+        on a slow reference move and then slowly approaches the sensor. A trial fails when the sensor triggers early,
+        late by more than TOLERANCE or not at all, which means filament slipped or ground at that speed. Same is
+        checked for the hub sensor on the way back. Once forward speed is found, `rev_long_moves_speed_factor` is swept
+        at that speed. Fastest values where all TRIALS passed are recommended, SAVE=1 applies and saves them to the lanes
+        config section. Acceleration is raised in the same ratio as speed.<br>
+
+        Filament is moved to the toolhead sensor but not into the extruder, nothing can be loaded in the toolhead and
+        the hub needs to be clear.
+
+        Optional Values
+        ----
+        START, STEP and MAX set long move speeds in mm/s to try, TRIALS sets number of moves each value has to pass and
+        TOLERANCE sets in mm how far off a sensor can trigger from its reference position.
+
+        Usage
+        -----
+        `AFC_TUNE_SPEED LANE=<lane> START=<speed> STEP=<speed> MAX=<speed> TRIALS=<count> TOLERANCE=<mm> SAVE=<0|1>`
+
+        Example
+        -----
+        ```
+        AFC_TUNE_SPEED LANE=lane1 START=100 STEP=25 MAX=400 SAVE=1
+        ```
+        """
+        lane = gcmd.get('LANE', None)
+        if lane not in self.afc.lanes:
+            self.logger.info('{} Unknown'.format(lane))
+            return
+        cur_lane        = self.afc.lanes[lane]
+        cur_hub         = cur_lane.hub_obj
+        cur_extruder    = cur_lane.extruder_obj
+        start           = gcmd.get_float("START", 50., minval=10.)
+        step            = gcmd.get_float("STEP", 25., minval=1.)
+        max_speed       = gcmd.get_float("MAX", 500., minval=start)
+        trials          = gcmd.get_int("TRIALS", 2, minval=1)
+        tolerance       = gcmd.get_float("TOLERANCE", 5., minval=0.5)
+        save            = gcmd.get_int("SAVE", 0, minval=0, maxval=1)
+
+        if self.is_printing():
+            self.afc.error.AFC_error("Cannot tune lane speed while printing", pause=False)
+            return
+        if cur_lane.hub == 'direct' or cur_extruder.tool_start in (None, "buffer"):
+            self.afc.error.AFC_error("{} needs a hub and a toolhead sensor to tune speed".format(cur_lane.name), pause=False)
+            return
+        if self.get_current_lane_obj() is not None or cur_lane.get_sensor_state("tool_start"):
+            self.afc.error.AFC_error("Toolhead is loaded, unload before tuning {}".format(cur_lane.name), pause=False)
+            return
+        if cur_hub.state or not cur_lane.load_state or not cur_lane.prep_state:
+            self.afc.error.AFC_error("{} needs to be loaded and hub {} clear to tune speed".format(cur_lane.name, cur_hub.name), pause=False)
+            return
+
+        old_speed   = cur_lane.long_moves_speed
+        old_accel   = cur_lane.long_moves_accel
+        old_factor  = cur_lane.rev_long_moves_speed_factor
+        margin      = self.afc.learned_bowden_margin
+        short_speed, short_accel = cur_lane.get_speed_accel(SpeedMode.SHORT)
+        cur_lane.status = AFCLaneState.CALIBRATING
+        self.logger.info("Tuning long move speed for {}".format(cur_lane.name))
+
+        with cur_lane.manual_move_session():
+            try:
+                # Find hub trigger point, all trials start and end here
+                if not cur_lane.loaded_to_hub:
+                    cur_lane.move_advanced(cur_lane.dist_hub, SpeedMode.HUB)
+                cur_lane.loaded_to_hub = False
+                triggered, _ = cur_lane.move_to_sensor(cur_hub.move_dis + cur_lane.short_move_dis * 20, short_speed,
+                                                       short_accel, "hub")
+                if not triggered:
+                    self.afc.error.AFC_error("{} did not trigger hub {}".format(cur_lane.name, cur_hub.name), pause=False)
+                    return
+
+                # Slow reference move to find where toolhead sensor triggers
+                triggered, reference = cur_lane.move_to_sensor(cur_hub.afc_bowden_length + self.afc.tool_homing_distance,
+                                                               cur_extruder.tool_load_speed, short_accel, "tool_start")
+                if not triggered or not self._tune_speed_return(cur_lane, reference, short_speed, short_accel,
+                                                                short_speed, tolerance):
+                    self.afc.error.AFC_error("{} failed reference move to toolhead sensor".format(cur_lane.name), pause=False)
+                    return
+                self.logger.info("{} toolhead sensor triggers {:.1f}mm past hub".format(cur_lane.name, reference))
+
+                # Sweep forward speed, acceleration is raised in the same ratio as speed
+                best_speed = best_accel = None
+                speed = start
+                while speed <= max_speed:
+                    accel = max(old_accel, old_accel * speed / old_speed)
+                    passed, times = self._tune_speed_trials(cur_lane, speed, accel, old_factor, reference, margin,
+                                                            trials, tolerance)
+                    self.logger.info("{:.0f}mm/s accel {:.0f}: {}".format(speed, accel, self._tune_speed_result(passed, times)))
+                    if not passed:
+                        break
+                    best_speed, best_accel = speed, accel
+                    speed += step
+
+                if best_speed is None:
+                    self.logger.info("{} did not pass at {:.0f}mm/s, lower START and try again".format(cur_lane.name, start))
+                    return
+
+                # Sweep reverse speed factor at best forward speed
+                best_factor = None
+                for factor in (0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.1, 1.2):
+                    passed, times = self._tune_speed_trials(cur_lane, best_speed, best_accel, factor, reference,
+                                                            margin, trials, tolerance)
+                    self.logger.info("Reverse factor {:.1f}: {}".format(factor, self._tune_speed_result(passed, times)))
+                    if not passed:
+                        break
+                    best_factor = factor
+            finally:
+                cur_lane.long_moves_speed               = old_speed
+                cur_lane.long_moves_accel               = old_accel
+                cur_lane.rev_long_moves_speed_factor    = old_factor
+                # Park filament behind hub
+                if cur_hub.state:
+                    cur_lane.move_to_sensor(cur_hub.afc_unload_bowden_length * -1, short_speed, short_accel, "hub",
+                                            state=False, assist_active=True)
+                cur_lane.move_advanced(cur_hub.hub_clear_move_dis * -1, SpeedMode.SHORT)
+                cur_lane.loaded_to_hub = True
+                cur_lane.status = AFCLaneState.NONE
+                cur_lane.do_enable(False)
+                self.afc.save_vars()
+
+        if best_factor is None:
+            best_factor = old_factor
+        msg  = "{} recommended values:\n".format(cur_lane.name)
+        msg += "  long_moves_speed: {:.0f} (currently {:.0f})\n".format(best_speed, old_speed)
+        msg += "  long_moves_accel: {:.0f} (currently {:.0f})\n".format(best_accel, old_accel)
+        msg += "  rev_long_moves_speed_factor: {:.1f} (currently {:.1f})".format(best_factor, old_factor)
+        self.logger.raw(msg)
+
+        if save:
+            cur_lane.long_moves_speed               = best_speed
+            cur_lane.long_moves_accel               = best_accel
+            cur_lane.rev_long_moves_speed_factor    = best_factor
+            self.ConfigRewrite(cur_lane.fullname, 'long_moves_speed', best_speed, '')
+            self.ConfigRewrite(cur_lane.fullname, 'long_moves_accel', best_accel, '')
+            self.ConfigRewrite(cur_lane.fullname, 'rev_long_moves_speed_factor', best_factor, '')
+
+    def _tune_speed_trials(self, cur_lane, speed, accel, factor, reference, margin, trials, tolerance):
+        """
+        Helper function for AFC_TUNE_SPEED that moves filament from hub trigger point to toolhead sensor and back
+        trials times with given values. Filament starts and ends at hub trigger point.
+
+        :return (bool, list): True if all trials passed, list of seconds it took to reach toolhead sensor
+        """
+        cur_extruder = cur_lane.extruder_obj
+        short_speed, short_accel = cur_lane.get_speed_accel(SpeedMode.SHORT)
+        cur_lane.long_moves_speed               = speed
+        cur_lane.long_moves_accel               = accel
+        cur_lane.rev_long_moves_speed_factor    = factor
+        fast = max(reference - margin, 0)
+        times = []
+        for _ in range(trials):
+            start_time = self.afc.reactor.monotonic()
+            cur_lane.move_advanced(fast, SpeedMode.LONG)
+            # Sensor triggering before slow approach means filament moved further than commanded
+            if cur_lane.get_sensor_state("tool_start"):
+                self._tune_speed_return(cur_lane, fast, speed, accel, short_speed, None)
+                return False, times
+            triggered, moved = cur_lane.move_to_sensor(margin + tolerance * 2, cur_extruder.tool_load_speed,
+                                                       short_accel, "tool_start")
+            times.append(self.afc.reactor.monotonic() - start_time)
+            late = not triggered or abs(fast + moved - reference) > tolerance
+            if not self._tune_speed_return(cur_lane, fast + moved, speed, accel, short_speed, tolerance) or late:
+                return False, times
+        return True, times
+
+    def _tune_speed_return(self, cur_lane, distance, speed, accel, short_speed, tolerance):
+        """
+        Helper function for AFC_TUNE_SPEED that retracts filament distance back to hub trigger point, last
+        learned_bowden_margin is moved slowly until hub sensor clears and then filament moves forward until
+        hub triggers again.
+
+        :param tolerance: How far in mm hub can clear from expected point, None to skip check
+        :return bool: True if hub cleared within tolerance of expected point
+        """
+        cur_hub = cur_lane.hub_obj
+        margin = min(self.afc.learned_bowden_margin, distance)
+        short_accel = cur_lane.get_speed_accel(SpeedMode.SHORT)[1]
+        cur_lane.move((distance - margin) * -1, speed, accel, True)
+        check_dist = margin + (tolerance * 2 if tolerance is not None else cur_hub.afc_bowden_length)
+        cleared, moved = cur_lane.move_to_sensor(check_dist * -1, short_speed, short_accel, "hub", state=False,
+                                                 assist_active=True)
+        if cleared:
+            cur_lane.move_to_sensor(cur_hub.move_dis, short_speed / 5, short_accel, "hub")
+        if not cleared:
+            return False
+        return tolerance is None or abs(abs(moved) - margin) <= tolerance
+
+    def _tune_speed_result(self, passed, times):
+        """
+        Helper function that formats result of AFC_TUNE_SPEED trials for console
+        """
+        result = "passed" if passed else "failed"
+        if times:
+            result += ", hub to toolhead sensor {}".format(", ".join("{:.2f}s".format(t) for t in times))
+        return result
+
     cmd_TEST_help = "Test Assist Motors, spins spoolers like rewinding spool"
     def cmd_TEST(self, gcmd):
         """
@@ -1623,14 +2140,33 @@ class afcFunction:
 
 class afcDeltaTime:
     def __init__(self, AFC):
+        self.afc    = AFC
         self.logger = AFC.logger
         self.start_time = None
         self.last_time  = None
+        self.last_span_time = None
+        # Bounded ring buffer of toolchange phase spans, oldest spans are dropped once full
+        self.spans  = deque(maxlen=AFC.timeline_size)
 
     def set_start_time(self):
-        self.major_delta_time = self.last_time = self.start_time = datetime.now()
+        self.major_delta_time = self.last_time = self.last_span_time = self.start_time = datetime.now()
 
-    def log_with_time(self, msg, debug=True):
+    def start_span(self):
+        """
+        Marks start of next span, called when a load or unload starts so time spent between toolchanges is not
+        counted towards first phase
+        """
+        self.last_span_time = datetime.now()
+
+    def log_with_time(self, msg, debug=True, span=None):
+        """
+        Logs message with time since last logged message and since start time.
+
+        :param msg: Message to log
+        :param debug: Logs message to debug when True, info when False
+        :param span: Name of toolchange phase that ends with this message, when set a span covering the time
+                     since the previous span ended is added to the timeline
+        """
         try:
             curr_time = datetime.now()
             delta_time = (curr_time - self.last_time ).total_seconds()
@@ -1641,9 +2177,65 @@ class afcDeltaTime:
             else:
                 self.logger.info( msg )
             self.last_time = curr_time
+            if span is not None:
+                self.add_span(span, curr_time)
         except Exception as e:
             self.logger.debug("Error in log_with_time function {}".format(e))
 
+    def add_span(self, name, end_time=None):
+        """
+        Adds span to timeline ring buffer that starts when previous span ended and ends at end_time.
+
+        :param name: Name of toolchange phase
+        :param end_time: datetime when phase ended, defaults to now
+        """
+        if end_time is None:
+            end_time = datetime.now()
+        start_time = self.last_span_time if self.last_span_time is not None else end_time
+        self.spans.append({
+            "phase":        name,
+            "lane":         self.afc.current_loading,
+            "toolchange":   self.afc.current_toolchange,
+            "start":        round(start_time.timestamp(), 3),
+            "duration":     round((end_time - start_time).total_seconds(), 3)})
+        self.last_span_time = end_time
+
+    def get_spans(self, phase=None):
+        """
+        Returns list of spans in timeline, oldest first
+
+        :param phase: Only return spans for this phase when set
+        """
+        return [ span for span in self.spans if phase is None or span["phase"] == phase ]
+
+    def get_summary(self):
+        """
+        Summarises spans in timeline per phase
+
+        :return dict: Dictionary keyed by phase name with count, p50, p95 and max durations in seconds
+        """
+        durations = {}
+        for span in self.spans:
+            durations.setdefault(span["phase"], []).append(span["duration"])
+
+        summary = {}
+        for phase, values in durations.items():
+            values.sort()
+            summary[phase] = {
+                "count":    len(values),
+                "p50":      self._percentile(values, 50),
+                "p95":      self._percentile(values, 95),
+                "max":      values[-1]}
+        return summary
+
+    @staticmethod
+    def _percentile(values, percent):
+        """
+        Nearest rank percentile of a sorted list
+        """
+        index = max(int(math.ceil(percent / 100. * len(values))) - 1, 0)
+        return values[index]
+
     def log_major_delta(self, msg, debug=True):
         delta_time = 0
         try:
@@ -26,6 +26,8 @@ class afc_hub:
         self.unit = None
         self.lanes = {}
         self.state = False
+        self.response   = {}
+        self.status_key = None                  # Values used to build response, used to check if response needs to be rebuilt
 
         # HUB Cut variables
         # Next two variables are used in AFC
@@ -101,24 +103,33 @@ class afc_hub:
     def switch_pin_callback(self, eventtime, state):
         self.state = state
 
+    def clear_learned_bowden_length(self):
+        """
+        Clears learned bowden length for all lanes connected to hub, called when afc_bowden_length is changed
+        """
+        for lane in self.lanes.values():
+            lane.clear_learned_bowden_length()
+
     def hub_cut(self, cur_lane):
         servo_string = 'SET_SERVO SERVO={servo} ANGLE={{angle}}'.format(servo=self.cut_servo_name)
 
         # Prep the servo for cutting.
         self.gcode.run_script_from_command(servo_string.format(angle=self.cut_servo_prep_angle))
-        # Load the lane until the hub is triggered.
-        while not self.state:
-            cur_lane.move(self.move_dis, cur_lane.short_moves_speed, cur_lane.short_moves_accel)
-
-        # To have an accurate reference position for `hub_cut_dist`, move back and forth in smaller steps
-        # to find the point where the hub just triggers.
-        while self.state:
-            cur_lane.move(-10, cur_lane.short_moves_speed, cur_lane.short_moves_accel, self.assisted_retract)
-        while not self.state:
-            cur_lane.move(2, cur_lane.short_moves_speed, cur_lane.short_moves_accel)
-
-        # Feed the `hub_cut_dist` amount.
-        cur_lane.move(self.cut_dist, cur_lane.short_moves_speed, cur_lane.short_moves_accel)
+        with cur_lane.manual_move_session():
+            # Load the lane until the hub is triggered.
+            while not self.state:
+                cur_lane.move_to_sensor(self.move_dis, cur_lane.short_moves_speed, cur_lane.short_moves_accel, "hub")
+
+            # To have an accurate reference position for `hub_cut_dist`, back off the sensor and then slowly
+            # approach again to find the point where the hub just triggers.
+            while self.state:
+                cur_lane.move_to_sensor(-10, cur_lane.short_moves_speed, cur_lane.short_moves_accel, "hub",
+                                        state=False, assist_active=self.assisted_retract)
+            while not self.state:
+                cur_lane.move_to_sensor(10, cur_lane.short_moves_speed / 5, cur_lane.short_moves_accel, "hub")
+
+            # Feed the `hub_cut_dist` amount.
+            cur_lane.move(self.cut_dist, cur_lane.short_moves_speed, cur_lane.short_moves_accel)
         # Have a snooze
         self.reactor.pause(self.reactor.monotonic() + 0.5)
 
@@ -141,6 +152,14 @@ class afc_hub:
         cur_lane.move(-self.cut_clear, cur_lane.short_moves_speed, cur_lane.short_moves_accel, self.assisted_retract)
 
     def get_status(self, eventtime=None):
+        # Only rebuild response when a value in it has changed
+        status_key = (self.state, self.cut, self.cut_cmd, self.cut_dist, self.cut_clear, self.cut_min_length,
+                      self.cut_servo_pass_angle, self.cut_servo_clip_angle, self.cut_servo_prep_angle,
+                      len(self.lanes), self.afc_bowden_length)
+        if status_key == self.status_key:
+            return self.response
+        self.status_key = status_key
+
         self.response = {}
         self.response['state'] = bool(self.state)
         self.response['cut'] = self.cut
@@ -7,7 +7,7 @@
 import math
 import traceback
 
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 from configfile import error
 from datetime import datetime
 from enum import Enum
@@ -64,6 +64,10 @@ class AFCLane:
         self.buffer_obj         = None
         self.extruder_obj       = None
 
+        # Cached get_status response, rebuilt when a tracked value changes
+        self._status_cache      = None
+        self._status_key        = None
+
         #stored status variables
         self.fullname           = config.get_name()
         self.name               = self.fullname.split()[-1]
@@ -71,7 +75,11 @@ class AFCLane:
         # when lanes are unloaded
         self.tool_loaded        = False
         self.loaded_to_hub      = False
+        self.prestaged_dist     = 0                                                     # Distance lane has been advanced towards hub while printing, for lanes loaded to hub distance fed past their parked position
+        self.prefed_bowden      = 0                                                     # Distance lane was fed past its hub ahead of TOOL_LOAD, only used when parallel_toolchange or background_load is enabled
+        self.learned_bowden_length = {}                                                 # Distance from hub to toolhead sensor trigger point per hub, only used when learn_bowden_length is enabled
         self.spool_id           = None
+        self.spool_data_changed = False                                                 # True when spoolman data differed from saved data after moonraker connected late
         self.color              = None
         self.weight             = 0
         self._material          = None
@@ -116,6 +124,10 @@ class AFCLane:
         self.long_moves_accel   = config.getfloat("long_moves_accel", None)             # Acceleration in mm/s squared when doing long moves. Setting value here overrides values set in unit(AFC_BoxTurtle/NightOwl/etc) section
         self.short_moves_speed  = config.getfloat("short_moves_speed", None)            # Speed in mm/s to move filament when doing short moves. Setting value here overrides values set in unit(AFC_BoxTurtle/NightOwl/etc) section
         self.short_moves_accel  = config.getfloat("short_moves_accel", None)            # Acceleration in mm/s squared when doing short moves. Setting value here overrides values set in unit(AFC_BoxTurtle/NightOwl/etc) section
+        self.long_moves_start_dist  = config.getfloat("long_moves_start_dist", None)    # Distance in mm moved at long_moves_start_speed at the start of a bowden move. Setting value here overrides values set in unit(AFC_BoxTurtle/NightOwl/etc) section
+        self.long_moves_start_speed = config.getfloat("long_moves_start_speed", None)   # Speed in mm/s for the start of a bowden move. Setting value here overrides values set in unit(AFC_BoxTurtle/NightOwl/etc) section
+        self.long_moves_slow_dist   = config.getfloat("long_moves_slow_dist", None)     # Distance in mm moved at long_moves_slow_speed at the end of a bowden move. Setting value here overrides values set in unit(AFC_BoxTurtle/NightOwl/etc) section
+        self.long_moves_slow_speed  = config.getfloat("long_moves_slow_speed", None)    # Speed in mm/s for the end of a bowden move. Setting value here overrides values set in unit(AFC_BoxTurtle/NightOwl/etc) section
         self.short_move_dis     = config.getfloat("short_move_dis", None)               # Move distance in mm for failsafe moves. Setting value here overrides values set in unit(AFC_BoxTurtle/NightOwl/etc) section
         self.max_move_dis       = config.getfloat("max_move_dis", None)                 # Maximum distance to move filament. AFC breaks filament moves over this number into multiple moves. Useful to lower this number if running into timer too close errors when doing long filament moves. Setting value here overrides values set in unit(AFC_BoxTurtle/NightOwl/etc) section
         self.n20_break_delay_time= config.getfloat("n20_break_delay_time", None)        # Time to wait between breaking n20 motors(nSleep/FWD/RWD all 1) and then releasing the break to allow coasting. Setting value here overrides values set in unit(AFC_BoxTurtle/NightOwl/etc) section
@@ -218,6 +230,7 @@ class AFCLane:
         To use custom density, set density after setting material
         """
         self._material = value
+        self._status_cache = None
         if not value:
             self.filament_density = 1.24 # Setting to a default value
             return
@@ -228,6 +241,66 @@ class AFCLane:
                 self.filament_density = float(v[1])
                 break
 
+    @property
+    def status(self):
+        """
+        Returns lanes current AFCLaneState
+        """
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        self._status = value
+        self._status_cache = None
+
+    @property
+    def load_state(self):
+        """
+        Returns current state of lanes load sensor
+        """
+        return self._load_state
+
+    @load_state.setter
+    def load_state(self, value):
+        self._load_state = value
+        self._status_cache = None
+
+    @property
+    def prep_state(self):
+        """
+        Returns current state of lanes prep sensor
+        """
+        return self._prep_state
+
+    @prep_state.setter
+    def prep_state(self, value):
+        self._prep_state = value
+        self._status_cache = None
+
+    @property
+    def weight(self):
+        """
+        Returns remaining filament weight in grams
+        """
+        return self._weight
+
+    @weight.setter
+    def weight(self, value):
+        self._weight = value
+        self._status_cache = None
+
+    @property
+    def color(self):
+        """
+        Returns lanes filament color
+        """
+        return self._color
+
+    @color.setter
+    def color(self, value):
+        self._color = value
+        self._status_cache = None
+
     def _handle_ready(self):
         """
         Handles klippy:ready callback and verifies that steppers have units defined in their config
@@ -371,6 +444,10 @@ class AFCLane:
         if self.long_moves_accel            is None: self.long_moves_accel  = self.unit_obj.long_moves_accel
         if self.short_moves_speed           is None: self.short_moves_speed = self.unit_obj.short_moves_speed
         if self.short_moves_accel           is None: self.short_moves_accel = self.unit_obj.short_moves_accel
+        if self.long_moves_start_dist       is None: self.long_moves_start_dist     = self.unit_obj.long_moves_start_dist
+        if self.long_moves_start_speed      is None: self.long_moves_start_speed    = self.unit_obj.long_moves_start_speed
+        if self.long_moves_slow_dist        is None: self.long_moves_slow_dist      = self.unit_obj.long_moves_slow_dist
+        if self.long_moves_slow_speed       is None: self.long_moves_slow_speed     = self.unit_obj.long_moves_slow_speed
         if self.short_move_dis              is None: self.short_move_dis    = self.unit_obj.short_move_dis
         if self.max_move_dis                is None: self.max_move_dis      = self.unit_obj.max_move_dis
         if self.td1_when_loaded             is None: self.td1_when_loaded   = self.unit_obj.td1_when_loaded
@@ -493,14 +570,166 @@ class AFCLane:
             if self.drive_stepper is not None:
                 self.drive_stepper.move(distance, speed, accel, assist_active)
 
-    def move_advanced(self, distance, speed_mode: SpeedMode, assist_active: AssistActive = AssistActive.NO):
+    def move_profile(self, segments, accel, assist_active=False):
         """
-        Wrapper for move function and is used to compute several arguments
-        to move the lane accordingly.
-        Parameters:
-        distance (float): The distance to move.
-        speed_mode (Enum SpeedMode): Identifies which speed to use.
-        assist_active (Enum AssistActive): Determines to force assist or to dynamically determine.
+        Moves lane through a list of segments that each have their own speed, segments are moved back to back
+        without stopping in between. Lanes that share a drive stepper use drive stepper to perform move.
+
+        :param segments: List of (distance, speed) tuples, all distances need to have the same sign
+        :param accel: Acceleration used between segments and at start and end of move
+        :param assist_active: Whether to assist
+        """
+        self.unit_obj.select_lane( self )
+        speed = max(speed for _, speed in segments)
+        with self.assist_move( speed, segments[0][0] < 0, assist_active):
+            if self.drive_stepper is not None:
+                self.drive_stepper.move_profile(segments, accel, assist_active)
+
+    def get_bowden_profile(self, distance):
+        """
+        Builds segments for a bowden move that starts at long_moves_start_speed for long_moves_start_dist, moves
+        at long_moves_speed and slows down to long_moves_slow_speed for the last long_moves_slow_dist.
+
+        :param distance: Total distance to move, negative to retract
+        :return list: List of (distance, speed) segments for move_profile, None if no profile is configured
+        """
+        if self.long_moves_start_dist <= 0 and self.long_moves_slow_dist <= 0:
+            return None
+        direction = 1 if distance > 0 else -1
+        start_dist = min(self.long_moves_start_dist, abs(distance))
+        slow_dist = min(self.long_moves_slow_dist, abs(distance) - start_dist)
+        cruise_dist = abs(distance) - start_dist - slow_dist
+        segments = [(start_dist, self.long_moves_start_speed),
+                    (cruise_dist, self.long_moves_speed),
+                    (slow_dist, self.long_moves_slow_speed)]
+        return [(dist * direction, speed) for dist, speed in segments if dist > 0]
+
+    def queue_move(self, distance, speed, accel):
+        """
+        Queues a move that runs alongside the toolhead without waiting for it to finish. Lanes that share a
+        drive stepper cannot move independently so this returns None, override in lanes that have their own stepper.
+
+        :return float: Print time when queued move finishes, None if move could not be queued
+        """
+        return None
+
+    def wait_queued_move(self):
+        """
+        Blocks until a move started with queue_move has finished, lanes without their own stepper never queue moves
+        """
+        return
+
+    def get_queue_start_time(self):
+        """
+        Returns earliest print time a queued move can start at, lanes that share a drive stepper cannot queue moves
+        so this returns None. Override in lanes that have their own stepper.
+        """
+        return None
+
+    def move_async(self, distance, speed, accel, assist_active=False, start_time=None):
+        """
+        Moves lane and returns a completion that callers wait on when they need the move to be done. Lanes that
+        share a drive stepper cannot move independently, so move is done right away and a completed completion
+        is returned. Override in lanes that have their own stepper.
+
+        :param distance: The distance to move.
+        :param speed: The speed of the movement.
+        :param accel: The acceleration of the movement.
+        :param assist_active: Whether to assist
+        :param start_time: Optional print time to start move at, unused for lanes without their own stepper
+        :return completion: Reactor completion that completes once the move has finished
+        """
+        self.move(distance, speed, accel, assist_active)
+        completion = self.reactor.completion()
+        completion.complete(True)
+        return completion
+
+    def get_sensor_state(self, sensor):
+        """
+        Helper function that returns current state of a named sensor that lane filament passes through
+
+        :param sensor: Name of sensor, valid names are hub, tool_start, tool_end, load and prep
+        :return bool: Current state of sensor
+        """
+        if sensor == "hub":
+            return bool(self.hub_obj.state)
+        elif sensor == "tool_start":
+            return bool(self.get_toolhead_pre_sensor_state())
+        elif sensor == "tool_end":
+            return bool(self.extruder_obj.tool_end_state)
+        elif sensor == "load":
+            return bool(self.load_state)
+        elif sensor == "prep":
+            return bool(self.prep_state)
+        raise error("Unknown sensor '{}' for {}".format(sensor, self.name))
+
+    def move_to_sensor(self, distance, speed, accel, sensor, state=True, assist_active=False):
+        """
+        Moves lane up to distance and stops as soon as named sensor changes to specified state. Move is
+        streamed as a single move instead of multiple short moves so filament does not stop and start
+        while waiting for sensor to trigger.
+
+        :param distance: Maximum distance to move, negative to retract
+        :param speed: The speed of the movement
+        :param accel: The acceleration of the movement
+        :param sensor: Name of sensor to watch, valid names are hub, tool_start, tool_end, load and prep
+        :param state: Sensor state that ends the move, True to move until triggered and False to move until cleared
+        :param assist_active: Whether to assist
+        :return (bool, float): True if sensor reached state, distance that was moved
+        """
+        def sensor_reached():
+            return self.get_sensor_state(sensor) == state
+
+        if sensor_reached():
+            return True, 0.
+
+        self.unit_obj.select_lane( self )
+        with self.assist_move( speed, distance < 0, assist_active):
+            return self.drip_move(distance, speed, accel, sensor_reached)
+
+    def get_move_chunk_counts(self):
+        """
+        Returns current move chunk size and number of chunks moved with each chunk size, lanes that share a drive
+        stepper return values from drive stepper.
+
+        :return (float, dict): Current chunk size, dictionary of chunk size to number of chunks moved
+        """
+        if self.drive_stepper is not None:
+            return self.drive_stepper.get_move_chunk_counts()
+        return self.max_move_dis, {}
+
+    def manual_move_session(self):
+        """
+        Returns a context manager that keeps lanes stepper bound for manual moves until it exits, use around
+        loops of short moves. Lanes that share a drive stepper use the drive steppers session.
+        """
+        if self.drive_stepper is not None:
+            return self.drive_stepper.manual_move_session()
+        return nullcontext()
+
+    def drip_move(self, distance, speed, accel, check_func):
+        """
+        Moves lane until check_func returns True or distance has been moved. Lanes that share a drive
+        stepper use drive stepper to perform move.
+
+        :param distance: Maximum distance to move
+        :param speed: The speed of the movement
+        :param accel: The acceleration of the movement
+        :param check_func: Function that returns True once move should be stopped
+        :return (bool, float): True if move was stopped by check_func, distance that was moved
+        """
+        if self.drive_stepper is not None:
+            return self.drive_stepper.drip_move(distance, speed, accel, check_func)
+        return check_func(), 0.
+
+    def _get_move_settings(self, distance, speed_mode: SpeedMode, assist_active: AssistActive):
+        """
+        Helper function that returns speed, accel and whether to assist for move_advanced and move_advanced_async.
+
+        :param distance: The distance to move.
+        :param speed_mode: Identifies which speed to use.
+        :param assist_active: Determines to force assist or to dynamically determine.
+        :return (float, float, bool): Speed, accel and True if espooler should assist
         """
         speed, accel = self.get_speed_accel(speed_mode)
 
@@ -509,8 +738,40 @@ class AFCLane:
             assist = True
         elif assist_active == AssistActive.DYNAMIC:
             assist = abs(distance) > 200
+        return speed, accel, assist
+
+    def move_advanced(self, distance, speed_mode: SpeedMode, assist_active: AssistActive = AssistActive.NO,
+                      profile=None):
+        """
+        Wrapper for move function and is used to compute several arguments
+        to move the lane accordingly.
+        Parameters:
+        distance (float): The distance to move.
+        speed_mode (Enum SpeedMode): Identifies which speed to use.
+        assist_active (Enum AssistActive): Determines to force assist or to dynamically determine.
+        profile (list): Optional list of (distance, speed) segments from get_bowden_profile, replaces distance
+                        and speed from speed_mode unless quiet mode is active.
+        """
+        speed, accel, assist = self._get_move_settings(distance, speed_mode, assist_active)
+
+        if profile and not self.afc._get_quiet_mode():
+            self.move_profile(profile, accel, assist)
+        else:
+            self.move(distance, speed, accel, assist)
 
-        self.move(distance, speed, accel, assist)
+    def move_advanced_async(self, distance, speed_mode: SpeedMode, assist_active: AssistActive = AssistActive.NO,
+                            start_time=None):
+        """
+        Same as move_advanced, but move is started with move_async and its completion is returned.
+        Parameters:
+        distance (float): The distance to move.
+        speed_mode (Enum SpeedMode): Identifies which speed to use.
+        assist_active (Enum AssistActive): Determines to force assist or to dynamically determine.
+        start_time (float): Optional print time to start move at, see get_queue_start_time.
+        """
+        speed, accel, assist = self._get_move_settings(distance, speed_mode, assist_active)
+
+        return self.move_async(distance, speed, accel, assist, start_time)
 
     def set_afc_prep_done(self):
         """
@@ -631,6 +892,8 @@ class AFCLane:
                     self.afc.function.afc_led(self.led_not_ready, self.led_index)
                     self.status = AFCLaneState.NONE
                     self.loaded_to_hub = False
+                    self.prestaged_dist = 0
+                    self.prefed_bowden = 0
                     self.td1_data = {}
                     self.afc.spool.clear_values(self)
                     self.afc.function.afc_led(self.afc.led_not_ready, self.led_index)
@@ -692,7 +955,9 @@ class AFCLane:
 
                     # Checking if loaded to hub(it should not be since filament was just inserted), if false load to hub. Does a fast load if hub distance is over 200mm
                     if self.load_to_hub and not self.loaded_to_hub and self.load_state and self.prep_state:
-                        self.move(self.dist_hub, self.dist_hub_move_speed, self.dist_hub_move_accel, self.dist_hub > 200)
+                        # Queued so spools inserted into several lanes at once load to their hubs at the same time
+                        self.move_async(self.dist_hub, self.dist_hub_move_speed, self.dist_hub_move_accel,
+                                        self.dist_hub > 200).wait()
                         self.loaded_to_hub = True
 
                     self.do_enable(False)
@@ -745,6 +1010,8 @@ class AFCLane:
                 self.tool_loaded = False
                 self.status = AFCLaneState.NONE
                 self.loaded_to_hub = False
+                self.prestaged_dist = 0
+                self.prefed_bowden = 0
                 self.td1_data = {}
                 self.afc.spool.clear_values(self)
                 self.unit_obj.lane_unloaded(self)
@@ -779,6 +1046,17 @@ class AFCLane:
     def _set_current(self, current):
         return
 
+    def get_current_change_counts(self):
+        """
+        Returns number of TMC current changes sent and elided, lanes that share a drive stepper return values from
+        drive stepper.
+
+        :return (int, int): Changes sent, changes elided
+        """
+        if self.drive_stepper is not None:
+            return self.drive_stepper.get_current_change_counts()
+        return 0, 0
+
     def set_load_current(self):
         """
         Helper function to update TMC current to use run current value
@@ -897,6 +1175,10 @@ class AFCLane:
         filament_weight_change = filament_volume_mm3 * self.filament_density / 1000  # Convert mm cubed to g
         self.weight -= filament_weight_change
 
+        # Collect usage for spoolman, reported in batches by AFC_moonraker
+        if self.afc.spoolman_usage_interval > 0 and self.afc.spoolman is not None and self.spool_id:
+            self.afc.moonraker.record_spool_use(self.spool_id, distance_moved, filament_weight_change)
+
         # Weight cannot be negative, force back to zero if it's below zero
         if self.weight < 0:
             self.weight = 0
@@ -967,6 +1249,29 @@ class AFCLane:
         else:
             return self.extruder_obj.tool_start_state
 
+    def get_learned_bowden_length(self):
+        """
+        Helper function to get learned distance from lanes hub to toolhead sensor
+
+        :return float: Learned distance in mm, None if distance has not been learned yet
+        """
+        return self.learned_bowden_length.get(self.hub)
+
+    def set_learned_bowden_length(self, length):
+        """
+        Helper function to record distance from lanes hub to where toolhead sensor triggered
+
+        :param length: Distance in mm moved from hub until toolhead sensor triggered
+        """
+        self.learned_bowden_length[self.hub] = round(length, 2)
+        self.logger.debug("{} learned bowden length for {}: {:.2f}mm".format(self.name, self.hub, length))
+
+    def clear_learned_bowden_length(self):
+        """
+        Helper function to clear learned bowden length so next load uses configured afc_bowden_length
+        """
+        self.learned_bowden_length.pop(self.hub, None)
+
     def get_trailing(self):
         """
         Helper function to get trailing status, returns none if buffer is not defined
@@ -1368,7 +1673,29 @@ class AFCLane:
         """
         self.afc.function.ConfigRewrite(self.fullname, 'dist_hub', self.dist_hub, '')
 
+    def _get_status_key(self):
+        """
+        Helper function that returns values used in get_status that are not tracked by property setters, cached
+        status is rebuilt when any of these values change
+        """
+        return (self.map, self.spool_id, self.spool_data_changed, self.tool_loaded, self.loaded_to_hub,
+                self.prestaged_dist, self.prefed_bowden, self.extruder_temp, self.runout_lane, self.dist_hub,
+                id(self.td1_data), len(self.td1_data),
+                tuple(self.learned_bowden_length.items()), self.buffer_status(),
+                self.extruder_obj.lane_loaded if self.extruder_obj is not None else None)
+
     def get_status(self, eventtime=None, save_to_file=False):
+        if save_to_file:
+            return self._build_status(save_to_file)
+
+        if not self.connect_done: return {}
+        status_key = self._get_status_key()
+        if self._status_cache is None or status_key != self._status_key:
+            self._status_cache = self._build_status()
+            self._status_key = status_key
+        return self._status_cache
+
+    def _build_status(self, save_to_file=False):
         response = {}
         if not self.connect_done: return response
         response['name'] = self.name
@@ -1383,6 +1710,9 @@ class AFCLane:
         response["prep"] =bool(self.prep_state)
         response["tool_loaded"] = self.tool_loaded
         response["loaded_to_hub"] = self.loaded_to_hub
+        response["prestaged_dist"] = self.prestaged_dist
+        response["prefed_bowden"] = self.prefed_bowden
+        response["learned_bowden_length"] = dict(self.learned_bowden_length)
         response["material"]=self.material
         if save_to_file:
             response["density"]=self.filament_density
@@ -1390,6 +1720,8 @@ class AFCLane:
             response["empty_spool_weight"]=self.empty_spool_weight
 
         response["spool_id"]= int(self.spool_id) if self.spool_id else None
+        if not save_to_file:
+            response["spool_data_changed"] = self.spool_data_changed
         response["color"]=self.color
         response["weight"]=self.weight
         response["extruder_temp"] = self.extruder_temp
@@ -1401,7 +1733,7 @@ class AFCLane:
         response['dist_hub']        = self.dist_hub
 
         if save_to_file:
-            response['td1_data']        = self.td1_data
+            response['td1_data']        = dict(self.td1_data)
         else:
             response['td1_td']          = self.td1_data['td'] if "td" in self.td1_data else ''
             response['td1_color']       = self.td1_data['color'] if "color" in self.td1_data else ''
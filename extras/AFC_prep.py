@@ -127,6 +127,10 @@ class afcPrep:
             error_string += 'AFC.cfg file and make sure the file and path exists.'
             self.afc.error.AFC_error(error_string, False)
 
+        # Fetch spoolman data for all lanes with one request instead of one request per lane
+        if self.afc.spoolman is not None:
+            self.afc.spool.prefetch_spools(units)
+
         # check if Lane is supposed to be loaded in tool head from saved file
         for extruder in self.afc.tools.keys():
             PrinterObject=self.afc.tools[extruder]
@@ -180,6 +184,9 @@ class afcPrep:
                     if 'hub_loaded' in units[cur_lane.unit][cur_lane.name]: lane.loaded_to_hub = units[cur_lane.unit][cur_lane.name]['hub_loaded']
                     # Check for loaded_to_hub as this is how its being saved version > 1030
                     if 'loaded_to_hub' in units[cur_lane.unit][cur_lane.name]: cur_lane.loaded_to_hub = units[cur_lane.unit][cur_lane.name]['loaded_to_hub']
+                    if 'prestaged_dist' in units[cur_lane.unit][cur_lane.name]: cur_lane.prestaged_dist = units[cur_lane.unit][cur_lane.name]['prestaged_dist']
+                    if 'prefed_bowden' in units[cur_lane.unit][cur_lane.name]: cur_lane.prefed_bowden = units[cur_lane.unit][cur_lane.name]['prefed_bowden']
+                    if 'learned_bowden_length' in units[cur_lane.unit][cur_lane.name]: cur_lane.learned_bowden_length = units[cur_lane.unit][cur_lane.name]['learned_bowden_length']
                     if 'tool_loaded' in units[cur_lane.unit][cur_lane.name]: cur_lane.tool_loaded = units[cur_lane.unit][cur_lane.name]['tool_loaded']
                     if 'td1_data' in units[cur_lane.unit][cur_lane.name]: cur_lane.td1_data = units[cur_lane.unit][cur_lane.name]['td1_data']
                     # Commenting out until there is better handling of this variable as it could cause someone to not be able to load their lane if klipper crashes
@@ -239,7 +246,8 @@ class afcPrep:
         if self.afc.bypass.filament_present:
             self.logger.raw(f"<span class=warning--text>{bypass_name} enabled</span>")
 
-        self.afc.afc_stats.check_cut_threshold()
+        if self.afc.afc_stats is not None:
+            self.afc.afc_stats.check_cut_threshold()
 
         # Defaulting to no active spool, putting at end so endpoint has time to register
         if self.afc.current is None:
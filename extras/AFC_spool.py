@@ -12,6 +12,7 @@ class AFCSpool:
 
         # Temporary status variables
         self.next_spool_id      = ''
+        self.refresh_timer      = None
 
     def handle_connect(self):
         """
@@ -203,9 +204,62 @@ class AFCSpool:
         cur_lane.send_lane_data()
         self.afc.save_vars()
 
+    def prefetch_spools(self, units):
+        """
+        Fetches spoolman data for every spool ID saved for lanes and the next spool ID with a single
+        request so PREP does not look up each lane on its own. Starts background refresh so cached
+        spools stay current.
+
+        :param units: Dictionary of unit values loaded from AFC.var.unit file
+        """
+        ids = [ values['spool_id'] for unit, lanes in units.items() if unit != 'system'
+                for values in lanes.values() if isinstance(values, dict) and values.get('spool_id') ]
+        ids.append(self.next_spool_id)
+        count = self.afc.moonraker.get_spools(ids)
+        if count is not None:
+            self.logger.debug(f"Prefetched {count} spools from spoolman")
+
+        if self.refresh_timer is None and self.afc.spoolman_cache_ttl > 0:
+            self.refresh_timer = self.reactor.register_timer(self._refresh_spools,
+                                                             self.reactor.monotonic() + self.afc.spoolman_cache_ttl / 2)
+
+    def reconcile_spools(self):
+        """
+        Called once moonraker is reachable after PREP started from saved spoolman data. Fetches current spoolman
+        data for all lanes and marks lanes whose data changed since it was saved.
+        """
+        lanes = [lane for lane in self.afc.lanes.values() if lane.spool_id]
+        self.afc.moonraker.get_spools([lane.spool_id for lane in lanes] + [self.next_spool_id])
+        changed = []
+        for lane in lanes:
+            values = self._get_spool_values(lane)
+            self.set_spoolID(lane, lane.spool_id, save_vars=False)
+            if values != self._get_spool_values(lane):
+                lane.spool_data_changed = True
+                changed.append(lane.name)
+
+        if changed:
+            self.logger.info("Spoolman data changed since last boot for: {}".format(", ".join(changed)))
+            self.afc.save_vars()
+
+    def _get_spool_values(self, cur_lane):
+        return (cur_lane.material, cur_lane.extruder_temp, cur_lane.bed_temp, cur_lane.filament_density,
+                cur_lane.filament_diameter, cur_lane.color, cur_lane.weight)
+
+    def _refresh_spools(self, eventtime):
+        """
+        Timer callback that refreshes cached spools used by lanes in the background before they expire
+        """
+        if self.afc.spoolman is not None and self.afc.moonraker is not None:
+            ids = [lane.spool_id for lane in self.afc.lanes.values()] + [self.next_spool_id]
+            self.afc.moonraker.get_spools(ids, wait=False)
+        return eventtime + self.afc.spoolman_cache_ttl / 2
+
     def set_active_spool(self, ID):
         webhooks = self.printer.lookup_object('webhooks')
-        if self.afc.spoolman is not None:
+        # AFC reports usage itself when spoolman_usage_interval is set, moonraker tracking the active
+        # spool as well would count usage twice
+        if self.afc.spoolman is not None and self.afc.spoolman_usage_interval == 0:
             if ID and ID is not None:
                 id = int(ID)
             else:
@@ -253,6 +307,9 @@ class AFCSpool:
                     self.logger.error(f"SpoolId {SpoolID} already assigned to a lane, cannot assign to {lane}.")
                     return
 
+            # Spool may have been changed in spoolman, always use current data when ID is set by user
+            if SpoolID != '':
+                self.afc.moonraker.invalidate_spool(SpoolID)
             self.set_spoolID(cur_lane, SpoolID)
 
     def _get_filament_values( self, filament, field, default=None):
@@ -295,6 +352,7 @@ class AFCSpool:
         cur_lane.clear_lane_data()
 
     def set_spoolID(self, cur_lane, SpoolID, save_vars=True):
+        cur_lane.spool_data_changed = False
         if self.afc.spoolman is not None:
             if SpoolID !='':
                 try:
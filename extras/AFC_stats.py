@@ -88,8 +88,8 @@ class AFCStats_var:
 
     def update_database(self):
         """
-        Calls AFC_moonraker update_afc_stats function with correct key, value to update
-        value in moonrakers database
+        Calls AFC_moonraker update_afc_stats function with correct key, value so value is
+        written to moonrakers database on next flush
         """
         self.moonraker.update_afc_stats(f"{self.parent_name}.{self.name}", self._value)
 
@@ -123,7 +123,11 @@ class AFCStats:
     def __init__(self, moonraker, logger, cut_threshold):
         self.moonraker  = moonraker
         self.logger     = logger
-        afc_stats       = self.moonraker.get_afc_stats()
+        self.moonraker.get_afc_stats()
+        # Restore values that did not make it to moonraker before klipper stopped, done after database
+        # values are loaded so journal values are merged into them
+        self.moonraker.replay_stats_journal()
+        afc_stats       = self.moonraker.afc_stats
 
         if afc_stats is not None:
             values = afc_stats["value"]
@@ -216,6 +220,12 @@ class AFCStats:
         self.tc_without_error.reset_count()
         self.tc_last_load_error.set_current_time()
 
+    def flush(self):
+        """
+        Writes all stat changes that have been collected to moonrakers database
+        """
+        self.moonraker.flush_afc_stats()
+
     def print_stats(self, afc_obj, short:bool=False):
         """
         Prints all stat to console
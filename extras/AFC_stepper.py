@@ -5,8 +5,11 @@
 # This file may be distributed under the terms of the GNU GPLv3 license.
 
 import chelper
+import math
 import traceback
 
+from contextlib import contextmanager
+
 from kinematics import extruder
 from configfile import error
 from extras.force_move import calc_move_time
@@ -18,6 +21,65 @@ try: from extras.AFC_lane import AFCLane
 except: raise error(ERROR_STR.format(import_lib="AFC_lane", trace=traceback.format_exc()))
 
 LARGE_TIME_OFFSET = 99999.9
+QUEUED_MOVE_LEAD_TIME = 0.250
+DRIP_CHECK_TIME = 0.010     # How often sensor is checked during a drip move
+DRIP_FLUSH_TIME = 0.500     # Upper bound on how far ahead of the mcu steps are generated
+MOVE_CHUNK_SIZES = (25., 50., 100., 200., 400., 800.) # Chunk sizes in mm that long moves are split into, capped by max_move_dis
+MOVE_CHUNK_MIN_SLACK = 0.100    # Chunk size is lowered when steps for a chunk are generated less than this many seconds ahead of the mcu
+MOVE_CHUNK_GROW_SLACK = 0.200   # Chunk size is raised after MOVE_CHUNK_GROW_COUNT chunks were generated at least this many seconds ahead
+MOVE_CHUNK_GROW_COUNT = 4
+PROFILE_LEAD_TIME = 0.500       # How far ahead of the mcu the next piece of a profile move is generated
+QUEUED_FEED_LEAD_TIME = 0.500   # How far ahead of the mcu the next chunk of a move_async move is queued
+
+def calc_profile_moves(segments, accel):
+    """
+    Calculates trapezoids for a list of segments so they can be moved back to back without stopping. Speed at
+    each junction is the lower of both segments speeds, limited to what can be reached with accel from the
+    start of the move and what can still be stopped from before the end of the move.
+
+    :param segments: List of (distance, speed) tuples, distances are absolute values
+    :param accel: Acceleration in mm/s squared
+    :return list: List of (accel_t, cruise_t, decel_t, start_v, cruise_v) tuples, one for each segment
+    """
+    # Junction speeds, move starts and ends at standstill
+    junctions = [0.] + [min(segments[i][1], segments[i+1][1]) for i in range(len(segments) - 1)] + [0.]
+    for i in range(len(segments) - 1, -1, -1):
+        junctions[i] = min(junctions[i], math.sqrt(junctions[i+1]**2 + 2. * accel * segments[i][0]))
+    for i in range(len(segments)):
+        junctions[i+1] = min(junctions[i+1], math.sqrt(junctions[i]**2 + 2. * accel * segments[i][0]))
+
+    moves = []
+    for i, (distance, speed) in enumerate(segments):
+        start_v, end_v = junctions[i], junctions[i+1]
+        cruise_v = min(speed, math.sqrt(accel * distance + (start_v**2 + end_v**2) / 2.))
+        cruise_v = max(cruise_v, start_v, end_v)
+        accel_d = (cruise_v**2 - start_v**2) / (2. * accel)
+        decel_d = (cruise_v**2 - end_v**2) / (2. * accel)
+        cruise_d = max(distance - accel_d - decel_d, 0.)
+        moves.append(((cruise_v - start_v) / accel, cruise_d / cruise_v if cruise_v > 0. else 0.,
+                      (cruise_v - end_v) / accel, start_v, cruise_v))
+    return moves
+
+def calc_trapezoid_distance(move_t, accel_t, cruise_t, cruise_v, accel):
+    """
+    Calculates distance covered by a symmetric trapezoid move that starts and ends at standstill, after
+    move_t seconds into the move.
+
+    :param move_t: Seconds since start of move
+    :param accel_t: Acceleration time, also used as deceleration time
+    :param cruise_t: Cruise time
+    :param cruise_v: Cruise velocity
+    :param accel: Acceleration in mm/s squared
+    :return float: Absolute distance moved
+    """
+    move_t = min(max(move_t, 0.), accel_t + cruise_t + accel_t)
+    if move_t <= accel_t:
+        return .5 * accel * move_t**2
+    dist = .5 * accel * accel_t**2
+    if move_t <= accel_t + cruise_t:
+        return dist + cruise_v * (move_t - accel_t)
+    decel_t = move_t - accel_t - cruise_t
+    return dist + cruise_v * cruise_t + cruise_v * decel_t - .5 * accel * decel_t**2
 
 class AFCExtruderStepper(AFCLane):
     def __init__(self, config):
@@ -32,6 +94,21 @@ class AFCExtruderStepper(AFCLane):
             self.motion_queuing = None
 
         self.next_cmd_time = 0.
+        self.queued_move_timer  = None
+        self.queued_prev_sk     = None
+        self.queued_prev_trapq  = None
+        self.queued_pos         = 0.
+        self.queued_completion  = None
+        self.queued_assist      = None
+        self.queued_done_time   = 0.
+        self.queued_feeds       = []    # Remaining [distance, direction, speed, accel] of move_async moves still to be queued
+        self.queued_feed_timer  = self.reactor.register_timer(self._queued_feed_callback)
+        self.queued_feed_completion = None  # Completed once all chunks of move_async moves have been queued
+        self.manual_move_depth  = 0     # Number of nested manual move sessions, stepper is bound to lanes trapq while > 0
+        self.move_chunk_sizes   = None  # Chunk sizes available to move, built on first move and whenever max_move_dis changes
+        self.move_chunk_index   = 0
+        self.move_chunk_good    = 0     # Number of chunks in a row that had enough slack to raise chunk size
+        self.move_chunk_counts  = {}    # Number of chunks moved with each chunk size
 
         ffi_main, ffi_lib = chelper.get_ffi()
         self.stepper_kinematics = ffi_main.gc(
@@ -54,6 +131,13 @@ class AFCExtruderStepper(AFCLane):
         if self.tmc_print_current is not None:
             self._get_tmc_values( config )
 
+        # TMC current requests are coalesced and only sent when current actually changes
+        self.tmc_current            = self.tmc_load_current # Current last sent to driver, driver starts at run_current
+        self.tmc_pending_current    = None                  # Requested current that has not been sent yet
+        self.tmc_current_scheduled  = False                 # True while callback to send pending current is registered
+        self.tmc_current_changes    = 0                     # Number of current changes sent to driver
+        self.tmc_current_elided     = 0                     # Number of requested current changes that did not need to be sent
+
         # Get and save base rotation dist
         self.base_rotation_dist = self.extruder_stepper.stepper.get_rotation_distance()[0]
 
@@ -70,6 +154,44 @@ class AFCExtruderStepper(AFCLane):
 
         self.tmc_load_current = self.tmc_driver.getfloat('run_current')
 
+    @contextmanager
+    def manual_move_session(self):
+        """
+        Binds lane stepper to its own stepper kinematics and trapq once for a sequence of moves and restores
+        the previous binding when the session exits, so loops of short moves do not swap kinematics and flush
+        step generation for every move. Sessions can be nested, only the outermost session binds the stepper.
+        Lane must not be synced to an extruder while a session is active.
+        """
+        if self.manual_move_depth > 0:
+            self.manual_move_depth += 1
+            try:
+                yield
+            finally:
+                self.manual_move_depth -= 1
+            return
+
+        # Make sure any queued move has finished before taking over stepper
+        self.wait_queued_move()
+        self.apply_pending_current()
+
+        # Code based off force_move.py manual_move function
+        toolhead    = self.printer.lookup_object('toolhead')
+        stepper     = self.extruder_stepper.stepper
+        toolhead.flush_step_generation()
+        prev_sk     = stepper.set_stepper_kinematics(self.stepper_kinematics)
+        prev_trapq  = stepper.set_trapq(self.trapq)
+        stepper.set_position((0., 0., 0.))
+        self.manual_move_depth = 1
+        try:
+            yield
+        finally:
+            self.manual_move_depth = 0
+            toolhead.flush_step_generation()
+            stepper.set_trapq(prev_trapq)
+            stepper.set_stepper_kinematics(prev_sk)
+            if self.motion_queuing is not None:
+                self.motion_queuing.wipe_trapq(self.trapq)
+
     def _move(self, distance, speed, accel, assist_active=False):
         """
         Helper function to move the specified lane a given distance with specified speed and acceleration.
@@ -79,20 +201,16 @@ class AFCExtruderStepper(AFCLane):
         distance (float): The distance to move.
         speed (float): The speed of the movement.
         accel (float): The acceleration of the movement.
-        """
 
-
-        with self.assist_move(speed, distance < 0, assist_active):
-            # Code based off force_move.py manual_move function
-            toolhead = self.printer.lookup_object('toolhead')
-            toolhead.flush_step_generation()
-            prev_sk     = self.extruder_stepper.stepper.set_stepper_kinematics(self.stepper_kinematics)
-            prev_trapq  = self.extruder_stepper.stepper.set_trapq(self.trapq)
-            self.extruder_stepper.stepper.set_position((0., 0., 0.))
+        :return float: Seconds between steps being generated and start of move on the mcu
+        """
+        with self.assist_move(speed, distance < 0, assist_active), self.manual_move_session():
+            toolhead    = self.printer.lookup_object('toolhead')
+            start_pos   = self.extruder_stepper.stepper.get_commanded_position()
             axis_r, accel_t, cruise_t, cruise_v = calc_move_time(distance, speed, accel)
             print_time = toolhead.get_last_move_time()
             self.trapq_append(self.trapq, print_time, accel_t, cruise_t, accel_t,
-                              0., 0., 0., axis_r, 0., 0., 0., cruise_v, accel)
+                              start_pos, 0., 0., axis_r, 0., 0., 0., cruise_v, accel)
             print_time = print_time + accel_t + cruise_t + accel_t
 
             if self.motion_queuing is None:
@@ -103,13 +221,297 @@ class AFCExtruderStepper(AFCLane):
             else:
                 self.motion_queuing.note_mcu_movequeue_activity(print_time)
 
+            # Time between steps for this move being generated and mcu needing them, low slack means host
+            # is close to falling behind
+            mcu = self.extruder_stepper.stepper.get_mcu()
+            slack = print_time - (accel_t + cruise_t + accel_t) - mcu.estimated_print_time(self.reactor.monotonic())
+
             toolhead.dwell(accel_t + cruise_t + accel_t)
-            toolhead.flush_step_generation()
-            self.extruder_stepper.stepper.set_trapq(prev_trapq)
-            self.extruder_stepper.stepper.set_stepper_kinematics(prev_sk)
-            if self.motion_queuing is not None:
-                self.motion_queuing.wipe_trapq(self.trapq)
             toolhead.wait_moves()
+        return slack
+
+    def queue_move(self, distance, speed, accel, start_time=None):
+        """
+        Queues a move on the lanes trapq without dwelling the toolhead, so the lane moves while the toolhead
+        keeps printing. Moves queued while a previous queued move is still running are appended after it.
+        Stepper kinematics are restored by a timer once the last queued move has finished.
+
+        :param distance: The distance to move.
+        :param speed: The speed of the movement.
+        :param accel: The acceleration of the movement.
+        :param start_time: Optional print time to start move at, used to start moves on several lanes together.
+                           Ignored when move is appended to a move that is already queued.
+        :return float: Print time when queued move finishes, None if lane is synced to an extruder or a manual
+                      move session is active
+        """
+        if self.extruder_stepper.motion_queue is not None or self.manual_move_depth > 0:
+            return None
+
+        toolhead    = self.printer.lookup_object('toolhead')
+        mcu         = self.extruder_stepper.stepper.get_mcu()
+        eventtime   = self.reactor.monotonic()
+
+        if self.queued_move_timer is None:
+            self.apply_pending_current()
+            eventtime   = self.reactor.monotonic()
+            print_time  = max(self.next_cmd_time, mcu.estimated_print_time(eventtime) + QUEUED_MOVE_LEAD_TIME)
+            if start_time is not None:
+                print_time = max(print_time, start_time)
+            self.queued_prev_sk     = self.extruder_stepper.stepper.set_stepper_kinematics(self.stepper_kinematics)
+            self.queued_prev_trapq  = self.extruder_stepper.stepper.set_trapq(self.trapq)
+            self.extruder_stepper.stepper.set_position((0., 0., 0.))
+            self.queued_pos         = 0.
+            self.queued_completion  = self.reactor.completion()
+            self.queued_move_timer  = self.reactor.register_timer(self._queued_move_done)
+        else:
+            # Append to the end of the move that is already queued, unless it already finished on the mcu
+            print_time  = max(self.next_cmd_time, mcu.estimated_print_time(eventtime) + QUEUED_MOVE_LEAD_TIME)
+
+        axis_r, accel_t, cruise_t, cruise_v = calc_move_time(distance, speed, accel)
+        self.trapq_append(self.trapq, print_time, accel_t, cruise_t, accel_t,
+                          self.queued_pos, 0., 0., axis_r, 0., 0., 0., cruise_v, accel)
+        end_time = print_time + accel_t + cruise_t + accel_t
+        self.queued_pos += distance
+
+        if self.motion_queuing is None:
+            self.extruder_stepper.stepper.generate_steps(end_time)
+            self.trapq_finalize_moves(self.trapq, end_time + LARGE_TIME_OFFSET,
+                                      end_time + LARGE_TIME_OFFSET)
+            toolhead.note_mcu_movequeue_activity(end_time)
+        else:
+            self.motion_queuing.note_mcu_movequeue_activity(end_time)
+
+        self.next_cmd_time = end_time
+        self.queued_done_time = eventtime + (end_time - mcu.estimated_print_time(eventtime)) + QUEUED_MOVE_LEAD_TIME
+        self.reactor.update_timer(self.queued_move_timer, self.queued_done_time)
+        return end_time
+
+    def get_queue_start_time(self):
+        """
+        Returns earliest print time a move queued with queue_move can start at, used to line up moves on
+        several lanes so they all start at the same time.
+
+        :return float: Print time, None if lane is synced to an extruder or a manual move session is active
+        """
+        if self.extruder_stepper.motion_queue is not None or self.manual_move_depth > 0:
+            return None
+        if self.queued_move_timer is not None:
+            return self.next_cmd_time
+        mcu = self.extruder_stepper.stepper.get_mcu()
+        return max(self.next_cmd_time, mcu.estimated_print_time(self.reactor.monotonic()) + QUEUED_MOVE_LEAD_TIME)
+
+    def move_async(self, distance, speed, accel, assist_active=False, start_time=None):
+        """
+        Queues a move without blocking and returns a completion that callers wait on when they need the move
+        to be done. Moves are split into chunks with the adaptive chunk size, only the first chunk is queued
+        right away and the rest are queued by a timer as the move runs. If lane is synced to an extruder the
+        move, or a manual move session is active, the move is done as a blocking move and an already completed
+        completion is returned.
+
+        :param distance: The distance to move.
+        :param speed: The speed of the movement.
+        :param accel: The acceleration of the movement.
+        :param assist_active: Whether to assist, espooler assist stays on until completion
+        :param start_time: Optional print time to start move at, see get_queue_start_time
+        :return completion: Reactor completion that completes once the move has finished
+        """
+        if self.extruder_stepper.motion_queue is not None or self.manual_move_depth > 0 or distance == 0:
+            self.move(distance, speed, accel, assist_active)
+            completion = self.reactor.completion()
+            completion.complete(True)
+            return completion
+
+        direction = 1 if distance > 0 else -1
+        move_total = abs(distance)
+        if direction == -1:
+            speed = speed * self.rev_long_moves_speed_factor
+
+        # Breaks up move length to help with TTC errors, chunks are queued just ahead of the mcu so steps are
+        # not generated for the whole move at once
+        self.queued_feeds.append([move_total, direction, speed, accel])
+        if len(self.queued_feeds) == 1:
+            self._feed_queued_move(start_time)
+
+        if assist_active and self.queued_assist is None:
+            self.queued_assist = self.assist_move(speed, distance < 0, True)
+            self.queued_assist.__enter__()
+        return self.queued_completion
+
+    def _feed_queued_move(self, start_time=None):
+        """
+        Helper function that queues next chunk of the oldest move_async move and schedules feed timer for the
+        chunk after it. Slack between queuing chunk and start of chunk on the mcu adjusts chunk size.
+
+        :param start_time: Optional print time to start chunk at, see get_queue_start_time
+        """
+        mcu     = self.extruder_stepper.stepper.get_mcu()
+        feed    = self.queued_feeds[0]
+        chunk   = self._get_move_chunk()
+        move_value = min(chunk, feed[0])
+        feed[0] -= move_value
+        if feed[0] <= 0:
+            self.queued_feeds.pop(0)
+
+        chunk_start = self.get_queue_start_time()
+        if start_time is not None:
+            chunk_start = max(chunk_start, start_time)
+        self.queue_move(move_value * feed[1], feed[2], feed[3], start_time)
+        eventtime = self.reactor.monotonic()
+        est_time = mcu.estimated_print_time(eventtime)
+        self._update_move_chunk(chunk, chunk_start - est_time)
+
+        if self.queued_feeds:
+            feed_time = eventtime + max(self.next_cmd_time - QUEUED_FEED_LEAD_TIME - est_time, 0.)
+            self.reactor.update_timer(self.queued_feed_timer, feed_time)
+        else:
+            self._complete_queued_feeds()
+
+    def _complete_queued_feeds(self):
+        """
+        Helper function that wakes up wait_queued_move once no chunks of move_async moves are left to queue
+        """
+        if self.queued_feed_completion is not None:
+            completion, self.queued_feed_completion = self.queued_feed_completion, None
+            completion.complete(True)
+
+    def _queued_feed_callback(self, eventtime):
+        """
+        Timer callback that queues next chunk of a move_async move once the mcu is close to the end of the
+        chunks already queued
+        """
+        if self.queued_feeds and self.queued_move_timer is not None:
+            self._feed_queued_move()
+            if self.queued_feeds:
+                mcu = self.extruder_stepper.stepper.get_mcu()
+                return eventtime + max(self.next_cmd_time - QUEUED_FEED_LEAD_TIME
+                                       - mcu.estimated_print_time(eventtime), 0.)
+        return self.reactor.NEVER
+
+    def _queued_move_done(self, eventtime):
+        """
+        Timer callback that restores stepper kinematics once a queued move has finished. If chunks of a
+        move_async move are still waiting because feed timer ran late they are queued instead.
+        """
+        if self.queued_feeds:
+            self._feed_queued_move()
+            return self.queued_done_time
+        self._restore_queued_move()
+        return self.reactor.NEVER
+
+    def _restore_queued_move(self):
+        """
+        Helper function to restore stepper kinematics and trapq that were swapped out in queue_move, turns off
+        espooler assist and completes the completion returned by move_async
+        """
+        if self.queued_move_timer is None:
+            return
+        self.reactor.unregister_timer(self.queued_move_timer)
+        self.queued_move_timer = None
+        self.queued_feeds = []
+        self.reactor.update_timer(self.queued_feed_timer, self.reactor.NEVER)
+        self._complete_queued_feeds()
+        self.extruder_stepper.stepper.set_trapq(self.queued_prev_trapq)
+        self.extruder_stepper.stepper.set_stepper_kinematics(self.queued_prev_sk)
+        if self.motion_queuing is not None:
+            self.motion_queuing.wipe_trapq(self.trapq)
+        if self.queued_assist is not None:
+            self.queued_assist.__exit__(None, None, None)
+            self.queued_assist = None
+        completion, self.queued_completion = self.queued_completion, None
+        completion.complete(True)
+
+    def wait_queued_move(self):
+        """
+        Blocks until a move started with queue_move has finished and stepper kinematics have been restored
+        """
+        if self.queued_move_timer is None:
+            return
+        # Let feed timer queue remaining chunks of move_async moves before waiting for them
+        if self.queued_feeds:
+            if self.queued_feed_completion is None:
+                self.queued_feed_completion = self.reactor.completion()
+            self.queued_feed_completion.wait()
+        toolhead = self.printer.lookup_object('toolhead')
+        self.sync_print_time()
+        toolhead.wait_moves()
+        self._restore_queued_move()
+
+    def drip_move(self, distance, speed, accel, check_func):
+        """
+        Streams a single move and stops it as soon as check_func returns True. The move is added to the
+        lanes trapq in full, and steps are generated by the background flush a short time ahead of the mcu,
+        so once check_func returns True the remainder of the move is replaced with a deceleration that starts
+        after the steps that were already generated.
+
+        :param distance: Maximum distance to move, negative to retract
+        :param speed: The speed of the movement
+        :param accel: The acceleration of the movement
+        :param check_func: Function that returns True once move should be stopped
+        :return (bool, float): True if move was stopped by check_func, distance that was moved when
+                               check_func returned True or full distance if it did not
+        """
+        if distance < 0:
+            speed = speed * self.rev_long_moves_speed_factor
+
+        with self.manual_move_session():
+            toolhead    = self.printer.lookup_object('toolhead')
+            stepper     = self.extruder_stepper.stepper
+            mcu         = stepper.get_mcu()
+            start_pos   = stepper.get_commanded_position()
+            axis_r, accel_t, cruise_t, cruise_v = calc_move_time(distance, speed, accel)
+            print_time  = toolhead.get_last_move_time()
+            self.trapq_append(self.trapq, print_time, accel_t, cruise_t, accel_t,
+                              start_pos, 0., 0., axis_r, 0., 0., 0., cruise_v, accel)
+            end_time    = print_time + accel_t + cruise_t + accel_t
+
+            # Steps are only generated a short time ahead of the mcu, so the move can still be cut short
+            if self.motion_queuing is None:
+                toolhead.note_mcu_movequeue_activity(end_time)
+            else:
+                self.motion_queuing.note_mcu_movequeue_activity(end_time)
+
+            triggered = False
+            trigger_time = end_time
+            while True:
+                eventtime = self.reactor.monotonic()
+                if check_func():
+                    triggered = True
+                    trigger_time = min(mcu.estimated_print_time(eventtime), end_time)
+                    break
+                if mcu.estimated_print_time(eventtime) >= end_time:
+                    break
+                self.reactor.pause(eventtime + DRIP_CHECK_TIME)
+
+            # Steps up to decel_time may already be generated, so the move is kept as is up to then and
+            # decelerates to a stop from there instead of the remainder of the move
+            stop_time = end_time
+            decel_time = min(end_time, mcu.estimated_print_time(self.reactor.monotonic()) + DRIP_FLUSH_TIME)
+            ramp_t = min(accel_t, decel_time - print_time)
+            stop_cruise_t = max(decel_time - print_time - accel_t, 0.)
+            if print_time + ramp_t + stop_cruise_t + ramp_t < end_time:
+                if self.motion_queuing is None:
+                    self.trapq_finalize_moves(self.trapq, self.reactor.NEVER, 0)
+                else:
+                    self.motion_queuing.wipe_trapq(self.trapq)
+                ramp_v = cruise_v if ramp_t >= accel_t else accel * ramp_t
+                self.trapq_append(self.trapq, print_time, ramp_t, stop_cruise_t, ramp_t,
+                                  start_pos, 0., 0., axis_r, 0., 0., 0., ramp_v, accel)
+                stop_time = print_time + ramp_t + stop_cruise_t + ramp_t
+                if self.motion_queuing is None:
+                    toolhead.note_mcu_movequeue_activity(stop_time)
+                else:
+                    self.motion_queuing.note_mcu_movequeue_activity(stop_time)
+
+            self.next_cmd_time = max(self.next_cmd_time, stop_time)
+            self.sync_print_time()
+            toolhead.wait_moves()
+            if self.motion_queuing is None:
+                self.trapq_finalize_moves(self.trapq, self.reactor.NEVER, 0)
+
+        moved = axis_r * calc_trapezoid_distance(trigger_time - print_time, accel_t, cruise_t, cruise_v, accel)
+        if not triggered:
+            triggered = check_func()
+        return triggered, moved
 
     def move(self, distance, speed, accel, assist_active=False):
         """
@@ -126,14 +528,135 @@ class AFCExtruderStepper(AFCLane):
         if direction == -1:
             speed = speed * self.rev_long_moves_speed_factor
 
-        # Breaks up move length to help with TTC errors
-        while move_total > 0:
-            move_value = self.max_move_dis if move_total > self.max_move_dis else move_total
-            move_total -= move_value
-            # Adding back direction
-            move_value = move_value * direction
+        # Breaks up move length to help with TTC errors, chunk size adapts to how far ahead of the mcu
+        # steps are generated
+        with self.manual_move_session():
+            while move_total > 0:
+                chunk = self._get_move_chunk()
+                move_value = chunk if move_total > chunk else move_total
+                move_total -= move_value
+                # Adding back direction
+                move_value = move_value * direction
+
+                slack = self._move(move_value, speed, accel, assist_active)
+                self._update_move_chunk(chunk, slack)
+
+    def move_profile(self, segments, accel, assist_active=False):
+        """
+        Moves lane through a list of segments that each have their own speed. Segments are added to the lanes
+        trapq back to back with the junction speeds from calc_profile_moves, so filament does not stop between
+        segments. Cruise parts are split into chunks the same size long moves use and each chunk is added once
+        the previous one is nearly done on the mcu, so steps are not generated for the whole move at once.
+
+        :param segments: List of (distance, speed) tuples, all distances need to have the same sign
+        :param accel: Acceleration used between segments and at start and end of move
+        :param assist_active: Whether to assist
+        """
+        direction = 1 if segments[0][0] > 0 else -1
+        speed_factor = self.rev_long_moves_speed_factor if direction == -1 else 1.
+        segments = [(abs(distance), speed * speed_factor) for distance, speed in segments]
+        speed = max(speed for _, speed in segments)
+
+        with self.assist_move(speed, direction == -1, assist_active), self.manual_move_session():
+            toolhead    = self.printer.lookup_object('toolhead')
+            pos         = self.extruder_stepper.stepper.get_commanded_position()
+            start_time  = print_time = toolhead.get_last_move_time()
+            for accel_t, cruise_t, decel_t, start_v, cruise_v in calc_profile_moves(segments, accel):
+                if accel_t > 0.:
+                    print_time, pos, _ = self._append_profile_piece(print_time, pos, direction, accel_t, 0., 0.,
+                                                                    start_v, cruise_v, accel)
+                cruise_d = cruise_t * cruise_v
+                while cruise_d > 1e-9:
+                    chunk = self._get_move_chunk()
+                    move_value = min(chunk, cruise_d)
+                    cruise_d -= move_value
+                    print_time, pos, slack = self._append_profile_piece(print_time, pos, direction, 0.,
+                                                                        move_value / cruise_v, 0., cruise_v,
+                                                                        cruise_v, accel)
+                    self._update_move_chunk(chunk, slack)
+                if decel_t > 0.:
+                    print_time, pos, _ = self._append_profile_piece(print_time, pos, direction, 0., 0., decel_t,
+                                                                    cruise_v, cruise_v, accel)
+
+            toolhead.dwell(print_time - start_time)
+            toolhead.wait_moves()
+
+    def _append_profile_piece(self, print_time, pos, direction, accel_t, cruise_t, decel_t, start_v, cruise_v, accel):
+        """
+        Helper function for move_profile that adds one piece of the profile to the lanes trapq and generates its
+        steps. Waits until the mcu is close to the end of the piece before returning so the next piece is
+        generated while this one is moving.
 
-            self._move(move_value, speed, accel, assist_active)
+        :return (float, float, float): Print time and position at end of piece, seconds between steps being
+                                       generated and start of piece on the mcu
+        """
+        mcu = self.extruder_stepper.stepper.get_mcu()
+        self.trapq_append(self.trapq, print_time, accel_t, cruise_t, decel_t,
+                          pos, 0., 0., direction, 0., 0., start_v, cruise_v, accel)
+        end_time = print_time + accel_t + cruise_t + decel_t
+        pos += direction * ((start_v + cruise_v) * .5 * accel_t + cruise_v * cruise_t
+                            + (cruise_v - .5 * accel * decel_t) * decel_t)
+
+        if self.motion_queuing is None:
+            self.extruder_stepper.stepper.generate_steps(end_time)
+            self.trapq_finalize_moves(self.trapq, end_time + LARGE_TIME_OFFSET,
+                                      end_time + LARGE_TIME_OFFSET)
+            self.printer.lookup_object('toolhead').note_mcu_movequeue_activity(end_time)
+        else:
+            self.motion_queuing.note_mcu_movequeue_activity(end_time)
+
+        eventtime = self.reactor.monotonic()
+        est_time = mcu.estimated_print_time(eventtime)
+        slack = print_time - est_time
+        # Wait until only PROFILE_LEAD_TIME of this piece is left so next piece is generated just ahead of the mcu
+        wait_time = end_time - PROFILE_LEAD_TIME - est_time
+        if wait_time > 0.:
+            self.reactor.pause(eventtime + wait_time)
+        return end_time, pos, slack
+
+    def _get_move_chunk(self):
+        """
+        Helper function that returns current chunk size to split long moves into. Chunk sizes are
+        MOVE_CHUNK_SIZES below max_move_dis followed by max_move_dis, move starts out using the largest
+        MOVE_CHUNK_SIZES entry that is not over max_move_dis. Chunk sizes are rebuilt when max_move_dis changes.
+        """
+        if self.move_chunk_sizes is None or self.move_chunk_sizes[-1] != self.max_move_dis:
+            self.move_chunk_sizes = [size for size in MOVE_CHUNK_SIZES if size < self.max_move_dis]
+            self.move_chunk_sizes.append(self.max_move_dis)
+            self.move_chunk_index = max(sum(1 for size in MOVE_CHUNK_SIZES if size <= self.max_move_dis) - 1, 0)
+            self.move_chunk_good  = 0
+        return self.move_chunk_sizes[self.move_chunk_index]
+
+    def _update_move_chunk(self, chunk, slack):
+        """
+        Helper function that records chunk size used and lowers chunk size when steps were generated with less
+        than MOVE_CHUNK_MIN_SLACK seconds to spare. Chunk size is raised again once MOVE_CHUNK_GROW_COUNT chunks
+        in a row had at least MOVE_CHUNK_GROW_SLACK seconds to spare.
+
+        :param chunk: Chunk size that was used for move
+        :param slack: Seconds between steps being generated and start of move on the mcu
+        """
+        self.move_chunk_counts[chunk] = self.move_chunk_counts.get(chunk, 0) + 1
+
+        if slack < MOVE_CHUNK_MIN_SLACK:
+            self.move_chunk_good = 0
+            if self.move_chunk_index > 0:
+                self.move_chunk_index -= 1
+                self.logger.debug("{} lowering move chunk size to {}mm, slack {:.3f}s".format(
+                    self.name, self.move_chunk_sizes[self.move_chunk_index], slack))
+        elif slack >= MOVE_CHUNK_GROW_SLACK and self.move_chunk_index < len(self.move_chunk_sizes) - 1:
+            self.move_chunk_good += 1
+            if self.move_chunk_good >= MOVE_CHUNK_GROW_COUNT:
+                self.move_chunk_good = 0
+                self.move_chunk_index += 1
+                self.logger.debug("{} raising move chunk size to {}mm".format(
+                    self.name, self.move_chunk_sizes[self.move_chunk_index]))
+
+    def get_move_chunk_counts(self):
+        """
+        Returns current move chunk size and number of chunks moved with each chunk size
+        """
+        return self._get_move_chunk(), dict(self.move_chunk_counts)
 
     def do_enable(self, enable):
         """
@@ -165,15 +688,19 @@ class AFCExtruderStepper(AFCLane):
 
     def sync_to_extruder(self, update_current=True, extruder_name=None):
         """
-        Helper function to sync lane to extruder and set print current if specified.
+        Helper function to sync lane to extruder and set print current if specified. Pending current is sent
+        right away since lane moves with the extruder from here on, if lane was unsynced and synced again during
+        the same command pending current matches driver current and nothing is sent.
 
         :param update_current: Sets current to specified print current when True
         """
         if extruder_name is None:
             extruder_name = self.extruder_name
+        self.wait_queued_move()
 
         self.extruder_stepper.sync_to_extruder(extruder_name)
         if update_current: self.set_print_current()
+        self.apply_pending_current()
 
     def unsync_to_extruder(self, update_current=True):
         """
@@ -186,12 +713,62 @@ class AFCExtruderStepper(AFCLane):
 
     def _set_current(self, current):
         """
-        Helper function to update TMC current.
+        Helper function to request a TMC current change. Request is not sent right away, it is sent before lane
+        moves on its own, when lane is synced to an extruder or once the gcode command that requested it has
+        finished, whichever comes first. Unsyncing and syncing again during a load or unload only sends last
+        requested current, and nothing is sent when driver is already at requested current.
 
         :param current: Sets TMC current to specified value
         """
-        if self.tmc_print_current is not None and current is not None:
-            self.gcode.run_script_from_command("SET_TMC_CURRENT STEPPER='{}' CURRENT={}".format(self.name, current))
+        if self.tmc_print_current is None or current is None:
+            return
+        if self.tmc_pending_current is not None:
+            # Previous request gets replaced before it was sent
+            self.tmc_current_elided += 1
+        self.tmc_pending_current = current
+        if not self.tmc_current_scheduled:
+            self.tmc_current_scheduled = True
+            self.reactor.register_callback(self._send_pending_current)
+
+    def _send_pending_current(self, eventtime):
+        """
+        Reactor callback that sends pending current once gcode command that requested it has finished
+        """
+        self.tmc_current_scheduled = False
+        try:
+            self.apply_pending_current(from_command=False)
+        except Exception as e:
+            self.logger.error("Error setting TMC current for {}: {}".format(self.name, e))
+
+    def apply_pending_current(self, from_command=True):
+        """
+        Sends requested TMC current to driver if it differs from current driver is already set to. Current change
+        is scheduled at toolhead print time by SET_TMC_CURRENT.
+
+        :param from_command: Set to False when not called from a gcode command so SET_TMC_CURRENT waits for
+                             gcode mutex
+        """
+        current, self.tmc_pending_current = self.tmc_pending_current, None
+        if current is None:
+            return
+        if current == self.tmc_current:
+            self.tmc_current_elided += 1
+            return
+        self.tmc_current = current
+        self.tmc_current_changes += 1
+        script = "SET_TMC_CURRENT STEPPER='{}' CURRENT={}".format(self.name, current)
+        if from_command:
+            self.gcode.run_script_from_command(script)
+        else:
+            self.gcode.run_script(script)
+
+    def get_current_change_counts(self):
+        """
+        Returns number of TMC current changes sent to driver and number of requested changes that were not sent
+
+        :return (int, int): Changes sent, changes elided
+        """
+        return self.tmc_current_changes, self.tmc_current_elided
 
     def set_load_current(self):
         """
@@ -53,6 +53,10 @@ class afcUnit:
         self.long_moves_accel            = config.getfloat("long_moves_accel", self.afc.long_moves_accel)   # Acceleration in mm/s squared when doing long moves. Setting value here overrides values set in AFC.cfg file
         self.short_moves_speed           = config.getfloat("short_moves_speed", self.afc.short_moves_speed) # Speed in mm/s to move filament when doing short moves. Setting value here overrides values set in AFC.cfg file
         self.short_moves_accel           = config.getfloat("short_moves_accel", self.afc.short_moves_accel) # Acceleration in mm/s squared when doing short moves. Setting value here overrides values set in AFC.cfg file
+        self.long_moves_start_dist       = config.getfloat("long_moves_start_dist", self.afc.long_moves_start_dist)   # Distance in mm moved at long_moves_start_speed at the start of a bowden move. Setting value here overrides values set in AFC.cfg file
+        self.long_moves_start_speed      = config.getfloat("long_moves_start_speed", self.afc.long_moves_start_speed) # Speed in mm/s for the start of a bowden move. Setting value here overrides values set in AFC.cfg file
+        self.long_moves_slow_dist        = config.getfloat("long_moves_slow_dist", self.afc.long_moves_slow_dist)     # Distance in mm moved at long_moves_slow_speed at the end of a bowden move. Setting value here overrides values set in AFC.cfg file
+        self.long_moves_slow_speed       = config.getfloat("long_moves_slow_speed", self.afc.long_moves_slow_speed)   # Speed in mm/s for the end of a bowden move. Setting value here overrides values set in AFC.cfg file
         self.short_move_dis              = config.getfloat("short_move_dis", self.afc.short_move_dis)       # Move distance in mm for failsafe moves. Setting value here overrides values set in AFC.cfg file
         self.max_move_dis                = config.getfloat("max_move_dis", self.afc.max_move_dis)            # Maximum distance to move filament. AFC breaks filament moves over this number into multiple moves. Useful to lower this number if running into timer too close errors when doing long filament moves. Setting value here overrides values set in AFC.cfg file
         self.debug                       = config.getboolean("debug",            False)                      # Turns on/off debug messages to console
@@ -9,22 +9,23 @@
 import traceback
 import json
 import inspect
+import os
+import threading
+import time
+import queue
+import http.client
 
 from datetime import datetime
 from urllib.request import (
-    Request,
-    urlopen
+    Request
 )
 from urllib.parse import (
     urlencode,
     urljoin,
+    urlsplit,
     quote
 )
 
-from urllib.error import (
-    HTTPError
-)
-
 ERROR_STR = "Error trying to import {import_lib}, please rerun install-afc.sh script in your AFC-Klipper-Add-On directory then restart klipper\n\n{trace}"
 
 def add_filament_switch( switch_name, switch_pin, printer, show_sensor=True, runout_callback = None, enable_runout=False, debounce_delay=0. ):
@@ -148,6 +149,194 @@ class DebounceButton:
             self.button_action(eventtime, self.logical_state)
 
 
+class AFCVarWriter:
+    """
+    Writes AFC variable file on a background thread so file I/O does not block klipper's reactor.
+
+    Only the most recent data is written when multiple writes are queued before the writer thread gets to them.
+    Data is written to a temporary file that is fsynced and then renamed over the variable file, so a crash
+    never leaves a truncated file behind.
+    """
+    def __init__(self, reactor, logger, filename):
+        self.reactor    = reactor
+        self.logger     = logger
+        self.filename   = filename
+        self.cond       = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.pending    = None
+        self.sequence   = 0
+        self.written    = 0
+        self.thread     = None
+
+    def write_async(self, data):
+        """
+        Queues data to be written by writer thread, replaces any data that has not been written yet
+
+        :param data: Dictionary to save as json
+        """
+        with self.cond:
+            self.sequence += 1
+            self.pending = (self.sequence, data)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._writer_thread, name="AFC_var_writer", daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def write(self, data):
+        """
+        Writes data to file before returning, any data that is still queued is dropped as it is older
+
+        :param data: Dictionary to save as json
+        """
+        with self.cond:
+            self.sequence += 1
+            sequence = self.sequence
+            self.pending = None
+        self._write(sequence, data)
+
+    def _writer_thread(self):
+        while True:
+            with self.cond:
+                while self.pending is None:
+                    self.cond.wait()
+                sequence, data = self.pending
+                self.pending = None
+            self._write(sequence, data)
+
+    def _write(self, sequence, data):
+        with self.write_lock:
+            # Skip data that is older than what has already been written
+            if sequence < self.written:
+                return
+            temp_file = "{}.tmp".format(self.filename)
+            try:
+                with open(temp_file, 'w') as f:
+                    f.write(json.dumps(data, indent=4))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_file, self.filename)
+                self.written = sequence
+            except Exception as e:
+                trace = traceback.format_exc()
+                self.reactor.register_async_callback(lambda eventtime, e=e, trace=trace: self._log_error(e, trace))
+
+    def _log_error(self, e, trace):
+        self.logger.error(f"Error happened when trying to save {self.filename}, check AFC.log for error")
+        self.logger.debug(f"Error:{e}\n{trace}", only_debug=True)
+
+class MoonrakerConnectionPool:
+    """
+    Pool of keep-alive http connections to moonraker so requests do not set up and tear down a TCP connection
+    each time. Connections that were closed by moonraker are reconnected and the request is retried once, requests
+    other than GET are only retried when sending failed so they are never applied twice.
+    Pool is thread safe, connections are handed out to one caller at a time.
+
+    Latency of each request is recorded in a histogram per endpoint.
+    """
+    LATENCY_BUCKETS = (0.005, 0.010, 0.025, 0.050, 0.100, 0.250, 0.500, 1.0, 2.5) # Histogram bucket upper bounds in seconds
+
+    def __init__(self, host:str, timeout:float=10., max_idle:int=4):
+        url             = urlsplit(host)
+        self.https      = url.scheme == "https"
+        self.hostname   = url.hostname
+        self.port       = url.port
+        self.timeout    = timeout
+        self.max_idle   = max_idle
+        self.lock       = threading.Lock()
+        self.idle       = []
+        self.latency    = {}
+        self.reconnects = 0
+
+    def _connect(self):
+        if self.https:
+            return http.client.HTTPSConnection(self.hostname, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.hostname, self.port, timeout=self.timeout)
+
+    def _release(self, conn):
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method:str, url:str, body=None, headers=None):
+        """
+        Sends request over a pooled connection and reads full response
+
+        :param method: Http method
+        :param url: Full url or path to request
+        :param body: Optional encoded body to send
+        :param headers: Optional dictionary of headers
+        :return (int, str, bytes): Response status, reason and body
+        """
+        url         = urlsplit(url)
+        path        = url.path + ("?" + url.query if url.query else "")
+        headers     = dict(headers or {})
+        start_time  = time.monotonic()
+
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        reused = conn is not None
+        if conn is None:
+            conn = self._connect()
+
+        while True:
+            sent = False
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                sent = True
+                resp = conn.getresponse()
+                data = resp.read()
+                break
+            except (http.client.HTTPException, ConnectionError) as e:
+                conn.close()
+                # Moonraker may have closed an idle connection, retry once on a new connection. Requests that
+                # were already sent are only retried for GET, other requests may have been applied already
+                if not reused or (sent and method != "GET"):
+                    raise e
+                reused = False
+                self.reconnects += 1
+                conn = self._connect()
+            except Exception:
+                conn.close()
+                raise
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        self._record_latency(url.path, time.monotonic() - start_time)
+        return resp.status, resp.reason, data
+
+    def _record_latency(self, endpoint, seconds):
+        with self.lock:
+            stats = self.latency.setdefault(endpoint, {"count": 0, "total": 0., "max": 0.,
+                                                       "buckets": [0] * (len(self.LATENCY_BUCKETS) + 1)})
+            stats["count"] += 1
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            index = next((i for i, bound in enumerate(self.LATENCY_BUCKETS) if seconds <= bound), len(self.LATENCY_BUCKETS))
+            stats["buckets"][index] += 1
+
+    def get_latency(self):
+        """
+        Returns copy of latency histograms
+
+        :return dict: Dictionary keyed by endpoint path with count, total, max and buckets, last bucket counts
+                      requests slower than largest bound in LATENCY_BUCKETS
+        """
+        with self.lock:
+            return {endpoint: dict(stats, buckets=list(stats["buckets"])) for endpoint, stats in self.latency.items()}
+
+    def close(self):
+        """
+        Closes all idle connections
+        """
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
 class AFC_moonraker:
     """
     This class is used to communicate with moonraker to look up information and post
@@ -159,18 +348,59 @@ class AFC_moonraker:
         Port to connect to moonrakers localhost
     logger: AFC_logger
         AFC logger object to log and print to console
+    stats_journal: String
+        Path to file where afc_stats values that have not been written to moonraker yet are kept
+    stats_flush_delay: Float
+        Seconds to collect afc_stats changes before they are written to moonraker
+    spool_cache_ttl: Float
+        Seconds spoolman spool data is served from cache before it is fetched again
+    spool_snapshot: String
+        Path to file where last known spoolman spool data is saved, used when spoolman cannot be reached
+    spool_use_journal: String
+        Path to file where filament usage that has not been reported to spoolman yet is kept
+    spool_use_interval: Float
+        Seconds to collect filament usage before it is reported to spoolman
     """
     ERROR_STRING = "Error getting data from moonraker, check AFC.log for more information"
-    def __init__(self, host:str, port:str, logger:object):
+    # Spool and filament fields kept in spool snapshot file
+    SNAPSHOT_SPOOL_FIELDS       = ("id", "spool_weight", "remaining_weight")
+    SNAPSHOT_FILAMENT_FIELDS    = ("material", "settings_extruder_temp", "settings_bed_temp", "density", "diameter",
+                                   "color_hex", "multi_color_hexes")
+    def __init__(self, host:str, port:str, logger:object, reactor, timeout:float=10.,
+                 stats_journal:str=None, stats_flush_delay:float=30., spool_cache_ttl:float=300.,
+                 spool_snapshot:str=None, spool_use_journal:str=None, spool_use_interval:float=60.):
         self.port           = port
         self.logger         = logger
+        self.reactor        = reactor
         self.host           = f'{host.rstrip("/")}:{port}'
+        self.pool           = MoonrakerConnectionPool(self.host, timeout)
+        self.requests       = queue.Queue()     # Requests waiting for worker thread
+        self.worker         = None
         self.database_url   = urljoin(self.host, "server/database/item")
         self.afc_stats_key  = "afc_stats"
         self.afc_stats      = None
         self.last_stats_time= None
+        self.afc_stats_loaded = False           # True once afc_stats were read from database, whole groups are only written after this
+        self.pending_stats  = {}                # afc_stats values waiting for next flush, keyed by database key
+        self.unsent_stats   = {}                # afc_stats values moonraker has not confirmed yet, kept in journal
+        self.stats_flush_delay = stats_flush_delay
+        self.stats_timer    = self.reactor.register_timer(self._flush_stats_timer)
+        self.stats_journal  = AFCVarWriter(self.reactor, self.logger, stats_journal) if stats_journal else None
+        self.spool_cache    = {}                # Spoolman spool data keyed by spool id, values are (fetch time, data)
+        self.spool_cache_ttl= spool_cache_ttl
+        self.spool_writer   = AFCVarWriter(self.reactor, self.logger, spool_snapshot) if spool_snapshot else None
+        self.spool_snapshot = {}                # Last known spoolman spool data keyed by spool id
+        self.spoolman_server= None              # Spoolman server from snapshot until moonraker reports it
+        self.connected      = False
+        self.spool_use      = {}                # Filament usage waiting for next report keyed by spool id, values are [length, weight]
+        self.spool_use_sent = {}                # Filament usage spoolman has not confirmed yet keyed by spool id
+        self.spool_use_interval = spool_use_interval
+        self.spool_use_timer= self.reactor.register_timer(self._flush_spool_use_timer)
+        self.spool_use_journal = AFCVarWriter(self.reactor, self.logger, spool_use_journal) if spool_use_journal else None
         self._lane_data     = False
         self.logger.debug(f"Moonraker url: {self.host}")
+        self._load_spool_snapshot()
+        self._load_spool_use_journal()
 
     def _get_results(self, url_string, print_error=True):
         """
@@ -190,18 +420,92 @@ class AFC_moonraker:
         else:
             logger = self.logger.debug
 
-        try:
-            resp = urlopen(url_string)
-            if resp.status >= 200 and resp.status <= 300:
-                data = json.load(resp)
-            else:
-                logger(self.ERROR_STRING)
-                logger(f"Response: {resp.status} Reason: {resp.reason}")
-        except:
-            logger(self.ERROR_STRING, traceback=traceback.format_exc())
-            data = None
+        data, error_msg, trace = self._submit(self._fetch, url_string).wait()
+        if trace is not None:
+            logger(self.ERROR_STRING, traceback=trace)
+        elif error_msg is not None:
+            logger(self.ERROR_STRING)
+            logger(error_msg)
         return data['result'] if data is not None else data
 
+    def _post(self, req, error_msg):
+        """
+        Helper function to send data to moonraker without waiting for response, errors are logged once
+        request has finished.
+
+        :param req: Request object to send
+        :param error_msg: Message to display if request fails
+        """
+        def log_result(result):
+            data, msg, trace = result
+            if data is None:
+                self.logger.error(error_msg)
+                self.logger.debug(f"{msg}\n{trace}" if trace is not None else f"{msg}")
+        self._submit(self._fetch, req, log_result)
+
+    def _fetch(self, req):
+        """
+        Sends request and decodes json response, runs on worker thread so nothing is logged here
+
+        :param req: URL string or Request object
+        :return (dict, str, str): Decoded data or None, error message, traceback
+        """
+        try:
+            status, reason, body = self._request(req)
+            if status >= 200 and status <= 300:
+                return json.loads(body), None, None
+            return None, f"Response: {status} Reason: {reason}", None
+        except Exception:
+            return None, None, traceback.format_exc()
+
+    def _submit(self, func, req, callback=None):
+        """
+        Queues request for worker thread so moonraker I/O does not block klipper's reactor. Caller can wait on
+        returned completion, waiting lets reactor keep running until request finishes.
+
+        :param func: Function to run on worker thread
+        :param req: Argument passed to function
+        :param callback: Optional function called from reactor with result once request finishes
+        :return completion: Reactor completion that completes with result of func
+        """
+        completion = self.reactor.completion()
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._worker_thread, name="AFC_moonraker", daemon=True)
+            self.worker.start()
+        self.requests.put((func, req, completion, callback))
+        return completion
+
+    def _worker_thread(self):
+        while True:
+            func, req, completion, callback = self.requests.get()
+            result = func(req)
+            self.reactor.async_complete(completion, result)
+            if callback is not None:
+                self.reactor.register_async_callback(lambda eventtime, result=result, callback=callback: callback(result))
+
+    def _request(self, req):
+        """
+        Helper function to send a url string or urllib Request over connection pool
+
+        :param req: URL string for a GET request or Request object
+        :return (int, str, bytes): Response status, reason and body
+        """
+        if not isinstance(req, Request):
+            req = Request(req)
+        headers = dict(req.header_items())
+        # urlopen adds form content type for requests with data, keep doing the same
+        if req.data is not None and not any(key.lower() == "content-type" for key in headers):
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        return self.pool.request(req.get_method(), req.full_url, req.data, headers)
+
+    def get_latency(self):
+        """
+        Returns latency histograms for each moonraker endpoint requested
+
+        :return dict: Dictionary keyed by endpoint, see MoonrakerConnectionPool.get_latency
+        """
+        return self.pool.get_latency()
+
     def wait_for_moonraker(self, toolhead, timeout:int=30):
         """
         Function to wait for moonraker to start, times out after passed in timeout value
@@ -214,8 +518,7 @@ class AFC_moonraker:
         """
         self.logger.info(f"Waiting max {timeout}s for moonraker to connect")
         for i in range(0,timeout):
-            resp = self._get_results(urljoin(self.host, 'server/info'), print_error=False)
-            if resp is not None:
+            if self.check_connection():
                 self.logger.debug(f"Connected to moonraker after {i} tries")
                 return True
             else:
@@ -223,6 +526,15 @@ class AFC_moonraker:
         self.logger.warning(f"Failed to connect to moonraker after {timeout} seconds, check AFC.log for more information")
         return False
 
+    def check_connection(self):
+        """
+        Checks once if moonraker is reachable
+
+        :return: True if moonraker responded
+        """
+        self.connected = self._get_results(urljoin(self.host, 'server/info'), print_error=False) is not None
+        return self.connected
+
     def get_spoolman_server(self)->str:
         """
         Queries moonraker to see if spoolman is configured, returns True when
@@ -233,9 +545,11 @@ class AFC_moonraker:
         resp = self._get_results(urljoin(self.host, 'server/config'))
         # Check to make sure response is valid and spoolman exists in dictionary
         if resp is not None and 'orig' in resp and 'spoolman' in resp['orig']:
-            return resp['orig']['spoolman']['server']     # check for spoolman and grab url
+            self.spoolman_server = resp['orig']['spoolman']['server']     # check for spoolman and grab url
+            return self.spoolman_server
         else:
             self.logger.debug("Spoolman server is not defined")
+            self.spoolman_server = None
             return None
 
     def get_file_filament_change_count(self, filename:str ):
@@ -283,6 +597,10 @@ class AFC_moonraker:
             resp = self._get_results(urljoin(self.database_url, f"?namespace={self.afc_stats_key}"))
             if resp is not None:
                 self.afc_stats = resp
+                self.afc_stats_loaded = True
+                # Database does not have values that are still waiting to be written, keep them in cache
+                for key, value in self.unsent_stats.items():
+                    self._cache_afc_stat(key, value)
             else:
                 self.logger.debug("AFC_stats not in database")
 
@@ -290,46 +608,361 @@ class AFC_moonraker:
 
     def update_afc_stats(self, key, value):
         """
-        Updates afc_stats in moonrakers database with key, value pair
+        Records afc_stats key, value pair to be written to moonrakers database on next flush. Value is
+        also added to the local journal so that it is not lost if klipper stops before the flush happens.
 
         :param key: The key indicating the field where the value should be inserted
         :param value: The value to insert into the database
         """
-        resp = None
+        if not self.pending_stats:
+            self.reactor.update_timer(self.stats_timer, self.reactor.monotonic() + self.stats_flush_delay)
+        self.pending_stats[key] = value
+        self.unsent_stats[key]  = value
+        self._cache_afc_stat(key, value)
+        self._write_stats_journal()
+
+    def flush_afc_stats(self):
+        """
+        Writes all pending afc_stats values to moonrakers database. Values are grouped by their parent key
+        so that each parent is written with a single request. Until values have been read from the database
+        each value is written by its own key instead, so fields missing from cache are not overwritten.
+        """
+        self.reactor.update_timer(self.stats_timer, self.reactor.NEVER)
+        if not self.pending_stats:
+            return
+        pending, self.pending_stats = self.pending_stats, {}
+
+        groups = {}
+        for key, value in pending.items():
+            parent, _, name = key.partition(".")
+            groups.setdefault(parent, {})[name] = value
+
+        values = self.afc_stats["value"]
+        for parent, sent in groups.items():
+            if self.afc_stats_loaded:
+                self._post_afc_stats(parent, values[parent], parent, sent)
+            else:
+                for name, value in sent.items():
+                    self._post_afc_stats(f"{parent}.{name}", value, parent, {name: value})
+
+    def _post_afc_stats(self, key, value, parent, sent):
         post_payload = {
-            "request_method": "POST",
             "namespace": self.afc_stats_key,
             "key": key,
             "value": value
         }
-        req = Request(self.database_url, urlencode(post_payload).encode())
+        req = Request( url=self.database_url, data=json.dumps(post_payload).encode(),
+                       method="POST", headers={"Content-Type": "application/json"})
+        self._submit(self._fetch, req,
+                     lambda result, parent=parent, sent=sent: self._flush_stats_result(parent, sent, result))
 
-        resp = self._get_results(req)
-        if resp is None:
-            self.logger.error(f"Error when trying to update {key} in moonraker, see AFC.log for more info")
+    def replay_stats_journal(self):
+        """
+        Reads afc_stats values that were not written to moonraker before klipper last stopped and
+        queues them to be written again.
+        """
+        if self.stats_journal is None:
+            return
+        journal = self._read_journal(self.stats_journal.filename, "afc_stats")
+        if journal:
+            self.logger.debug(f"Replaying {len(journal)} afc_stats values from journal")
+            for key, value in journal.items():
+                self.update_afc_stats(key, value)
+            self.flush_afc_stats()
+
+    def save_stats_journal(self):
+        """
+        Writes afc_stats journal before returning, used when klipper is shutting down
+        """
+        if self.stats_journal is not None:
+            self.stats_journal.write(dict(self.unsent_stats))
+
+    def _read_journal(self, filename, name):
+        """
+        Helper function to read a journal file
+
+        :param filename: Path to journal file
+        :param name: Name of journal used in error message
+        :return: Dictionary of journal entries, None if file does not exist or could not be read
+        """
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'r') as f:
+                return json.load(f)
+        except Exception:
+            self.logger.error(f"Error reading {name} journal, check AFC.log for more information")
+            self.logger.debug(traceback.format_exc(), only_debug=True)
+            return None
+
+    def _write_stats_journal(self):
+        if self.stats_journal is not None:
+            self.stats_journal.write_async(dict(self.unsent_stats))
+
+    def _cache_afc_stat(self, key, value):
+        """
+        Updates cached afc_stats with value so cache matches what will be in moonrakers database
+        """
+        if self.afc_stats is None:
+            self.afc_stats = {"namespace": self.afc_stats_key, "value": {}}
+        parent, _, name = key.partition(".")
+        parent_values = self.afc_stats["value"].get(parent)
+        if not isinstance(parent_values, dict):
+            parent_values = self.afc_stats["value"][parent] = {}
+        parent_values[name] = value
+
+    def _flush_stats_timer(self, eventtime):
+        self.flush_afc_stats()
+        return self.reactor.NEVER
+
+    def _flush_stats_result(self, parent, sent, result):
+        """
+        Called once moonraker responds to a flush. Confirmed values are removed from journal, values that
+        failed to write are queued again for the next flush unless a newer value is already waiting.
+        """
+        data, msg, trace = result
+        if data is None:
+            self.logger.error(f"Error when trying to update {parent} in moonraker, see AFC.log for more info")
+            self.logger.debug(f"{msg}\n{trace}" if trace is not None else f"{msg}")
+            for name, value in sent.items():
+                key = f"{parent}.{name}"
+                if key not in self.pending_stats:
+                    self.update_afc_stats(key, self.unsent_stats.get(key, value))
+            return
+
+        for name in sent:
+            key = f"{parent}.{name}"
+            if key not in self.pending_stats:
+                self.unsent_stats.pop(key, None)
+        self._write_stats_journal()
 
     def get_spool(self, id:int):
         """
-        Uses moonrakers proxy to query spoolID from spoolman
+        Uses moonrakers proxy to query spoolID from spoolman, spool is returned from cache when
+        it was fetched less than `spool_cache_ttl` seconds ago
 
         :param id: SpoolID to lookup and fetch data from spoolman
         :return: Returns dictionary of spoolID, returns None if error occurred or ID does not exist
         """
-        resp = None
-        request_payload = {
-            "request_method": "GET",
-            "path": f"/v1/spool/{id}"
-        }
-        spool_url = urljoin(self.host, 'server/spoolman/proxy')
-        req = Request( spool_url, urlencode(request_payload).encode() )
+        key = self._spool_key(id)
+        if key in self.spool_cache:
+            fetch_time, spool = self.spool_cache[key]
+            if self.reactor.monotonic() - fetch_time < self.spool_cache_ttl:
+                return spool
 
-        resp = self._get_results(req)
+        # Use saved data while moonraker is not reachable, data is reconciled once it connects
+        if not self.connected and key in self.spool_snapshot:
+            return self.spool_snapshot[key]
+
+        resp = self._get_results(self._spool_request(f"/v1/spool/{id}"))
         if resp is not None:
-            resp = resp
+            self._cache_spools([resp], {key})
+        elif key in self.spool_snapshot:
+            self.logger.info(f"SpoolID: {id} could not be fetched, using last known spoolman data")
+            resp = self.spool_snapshot[key]
         else:
             self.logger.info(f"SpoolID: {id} not found")
         return resp
 
+    def get_spools(self, ids, wait:bool=True):
+        """
+        Fetches all spools from spoolman with a single request and caches the spools whose ID is in ids.
+        Used to fill cache for all lanes at once instead of looking up each spool on its own.
+
+        :param ids: List of spool IDs to cache
+        :param wait: Set to False to fetch in the background without waiting for moonraker to respond
+        :return: Number of spools cached, None when not waiting, moonraker is not connected or an error occurred
+        """
+        keys = set(self._spool_key(id) for id in ids if id != '')
+        if not keys or not self.connected:
+            return None if keys else 0
+        req = self._spool_request("/v1/spool")
+        if wait:
+            resp = self._get_results(req)
+            return self._cache_spools(resp, keys) if resp is not None else None
+
+        def cache_result(result):
+            data, msg, trace = result
+            if data is not None:
+                self._cache_spools(data['result'], keys)
+            else:
+                self.logger.debug("Error refreshing spoolman cache")
+                self.logger.debug(f"{msg}\n{trace}" if trace is not None else f"{msg}")
+        self._submit(self._fetch, req, cache_result)
+
+    def invalidate_spool(self, id):
+        """
+        Removes spool from cache so next lookup fetches current data from spoolman
+
+        :param id: SpoolID to remove from cache
+        """
+        self.spool_cache.pop(self._spool_key(id), None)
+
+    def record_spool_use(self, id, length:float, weight:float):
+        """
+        Adds filament used from spool to usage that is reported to spoolman on next flush. Usage is also
+        added to the local journal so it is not lost if klipper stops before it is reported.
+
+        :param id: SpoolID filament was used from
+        :param length: Length of filament used in mm
+        :param weight: Weight of filament used in grams
+        """
+        key = self._spool_key(id)
+        if not self.spool_use:
+            self.reactor.update_timer(self.spool_use_timer, self.reactor.monotonic() + self.spool_use_interval)
+        use = self.spool_use.setdefault(key, [0., 0.])
+        use[0] += length
+        use[1] += weight
+        self._write_spool_use_journal()
+
+    def flush_spool_use(self):
+        """
+        Reports all collected filament usage to spoolman, one request is sent for each spool used
+        """
+        self.reactor.update_timer(self.spool_use_timer, self.reactor.NEVER)
+        if not self.spool_use:
+            return
+        pending, self.spool_use = self.spool_use, {}
+        spool_url = urljoin(self.host, 'server/spoolman/proxy')
+        for key, (length, weight) in pending.items():
+            sent = self.spool_use_sent.setdefault(key, [0., 0.])
+            sent[0] += length
+            sent[1] += weight
+            post_payload = {
+                "request_method": "PUT",
+                "path": f"/v1/spool/{key}/use",
+                "body": {"use_length": length}
+            }
+            req = Request( url=spool_url, data=json.dumps(post_payload).encode(),
+                           method="POST", headers={"Content-Type": "application/json"})
+            self.logger.debug(f"Reporting {length:.1f}mm ({weight:.2f}g) used from SpoolID {key} to spoolman")
+            self._submit(self._fetch, req,
+                         lambda result, key=key, use=(length, weight): self._flush_spool_use_result(key, use, result))
+
+    def replay_spool_use_journal(self):
+        """
+        Reports filament usage loaded from journal that was not reported to spoolman before klipper last stopped
+        """
+        if self.spool_use:
+            self.logger.debug(f"Reporting spoolman usage for {len(self.spool_use)} spools from journal")
+            self.flush_spool_use()
+
+    def _load_spool_use_journal(self):
+        """
+        Loads filament usage that was not reported before klipper last stopped, loaded before any new usage is
+        recorded so journal is not overwritten. Usage is reported once spoolman is reachable.
+        """
+        if self.spool_use_journal is None:
+            return
+        journal = self._read_journal(self.spool_use_journal.filename, "spoolman usage")
+        if journal:
+            self.spool_use = {self._spool_key(key): list(use) for key, use in journal.items()}
+
+    def save_spool_use_journal(self):
+        """
+        Writes spoolman usage journal before returning, used when klipper is shutting down
+        """
+        if self.spool_use_journal is not None:
+            self.spool_use_journal.write(self._get_unreported_spool_use())
+
+    def _get_unreported_spool_use(self):
+        unreported = {}
+        for usage in (self.spool_use_sent, self.spool_use):
+            for key, (length, weight) in usage.items():
+                use = unreported.setdefault(str(key), [0., 0.])
+                use[0] += length
+                use[1] += weight
+        return unreported
+
+    def _write_spool_use_journal(self):
+        if self.spool_use_journal is not None:
+            self.spool_use_journal.write_async(self._get_unreported_spool_use())
+
+    def _flush_spool_use_timer(self, eventtime):
+        self.flush_spool_use()
+        return self.reactor.NEVER
+
+    def _flush_spool_use_result(self, key, use, result):
+        """
+        Called once spoolman responds to a usage report. Reported usage is removed from journal, usage that
+        failed to report is added back so it is sent with the next flush.
+        """
+        data, msg, trace = result
+        sent = self.spool_use_sent[key]
+        sent[0] -= use[0]
+        sent[1] -= use[1]
+        # Small tolerance since float subtraction can leave a tiny remainder
+        if sent[0] < 1e-6:
+            del self.spool_use_sent[key]
+
+        if data is None:
+            self.logger.error(f"Error reporting filament usage for SpoolID {key} to spoolman, see AFC.log for more info")
+            self.logger.debug(f"{msg}\n{trace}" if trace is not None else f"{msg}")
+            self.record_spool_use(key, *use)
+            return
+
+        # Spoolman returns updated spool, keep cache up to date with new remaining weight
+        if key in self.spool_cache and isinstance(data.get('result'), dict):
+            self._cache_spools([data['result']], {key})
+        self._write_spool_use_journal()
+
+    def _cache_spools(self, spools, keys):
+        """
+        Adds spools whose ID is in keys to cache
+
+        :return: Number of spools cached
+        """
+        now = self.reactor.monotonic()
+        count = 0
+        for spool in spools:
+            key = self._spool_key(spool.get('id', ''))
+            if key in keys:
+                self.spool_cache[key] = (now, spool)
+                self.spool_snapshot[key] = self._snapshot_spool(spool)
+                count += 1
+        if count and self.spool_writer is not None:
+            self.spool_writer.write_async({"spoolman": self.spoolman_server,
+                                           "spools": {str(key): spool for key, spool in self.spool_snapshot.items()}})
+        return count
+
+    def _snapshot_spool(self, spool):
+        """
+        Returns copy of spool with only the fields AFC uses so snapshot file stays small
+        """
+        snapshot = {field: spool[field] for field in self.SNAPSHOT_SPOOL_FIELDS if field in spool}
+        filament = spool.get('filament', {})
+        snapshot['filament'] = {field: filament[field] for field in self.SNAPSHOT_FILAMENT_FIELDS if field in filament}
+        return snapshot
+
+    def _load_spool_snapshot(self):
+        """
+        Loads last known spoolman data saved in snapshot file
+        """
+        if self.spool_writer is None or not os.path.exists(self.spool_writer.filename):
+            return
+        try:
+            with open(self.spool_writer.filename, 'r') as f:
+                snapshot = json.load(f)
+            self.spoolman_server = snapshot.get("spoolman")
+            self.spool_snapshot = {self._spool_key(key): spool for key, spool in snapshot.get("spools", {}).items()}
+        except Exception:
+            self.logger.error("Error reading spoolman snapshot, check AFC.log for more information")
+            self.logger.debug(traceback.format_exc(), only_debug=True)
+
+    def _spool_key(self, id):
+        try:
+            return int(id)
+        except (TypeError, ValueError):
+            return id
+
+    def _spool_request(self, path):
+        request_payload = {
+            "request_method": "GET",
+            "path": path
+        }
+        spool_url = urljoin(self.host, 'server/spoolman/proxy')
+        return Request( spool_url, urlencode(request_payload).encode() )
+
     def check_for_td1(self):
         """
         Checks moonrakers server/config endpoint to see if user has `[td1]` and `[lane_data]`
@@ -400,15 +1033,9 @@ class AFC_moonraker:
         # back lane_data module
         # if self._lane_data:
         # url = urljoin( self.host, 'machine/set_lane_data')
-        try:
-            req = Request( url=self.database_url, data=json.dumps(data).encode(),
-                        method="POST", headers={"Content-Type": "application/json"})
-            if self._get_results(req) is None:
-                self.logger.error("Error sending lane data, check AFC.log for more information")
-        except HTTPError as e:
-            self.logger.error("Error occurred when trying to send lane data to moonraker database,"+
-                              "\nplease check AFC.log for more information.")
-            self.logger.debug(f"{e}")
+        req = Request( url=self.database_url, data=json.dumps(data).encode(),
+                    method="POST", headers={"Content-Type": "application/json"})
+        self._post(req, "Error sending lane data, check AFC.log for more information")
 
     def delete_lane_data(self):
         """
@@ -418,18 +1045,21 @@ class AFC_moonraker:
         system to a 4 lane system, removing and then readding will make sure database has
         current up to date data.
         """
+        def log_result(result):
+            data, msg, trace = result
+            if data is None:
+                self.logger.debug("Error occurred when trying to delete lane data")
+                self.logger.debug(f"{msg}\n{trace}" if trace is not None else f"{msg}")
+
         resp = self._get_results(urljoin(self.database_url, "?namespace=lane_data"), print_error=False)
         if resp is not None:
             value = resp.get("value")
-            try:
-                for key in value.keys():
-                    payload = {
-                        "request_method": "DELETE",
-                        "namespace":"lane_data",
-                        "key": key
-                    }
-                    req = Request( self.database_url, urlencode(payload).encode(), method="DELETE")
-                    urlopen(req)
-            except HTTPError as e:
-                self.logger.debug("Error occurred when trying to delete lane data")
-                self.logger.debug(f"{e}")
\ No newline at end of file
+            for key in value.keys():
+                payload = {
+                    "request_method": "DELETE",
+                    "namespace":"lane_data",
+                    "key": key
+                }
+                req = Request( self.database_url, urlencode(payload).encode(), method="DELETE")
+                # Deletes are not waited on, worker thread sends them in order before any later request
+                self._submit(self._fetch, req, log_result)
\ No newline at end of file